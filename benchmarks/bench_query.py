@@ -0,0 +1,131 @@
+"""pytest-benchmark micro-suite for the per-call overhead of PyFlo.query().
+
+Requests are answered in-process by StubTransport, a requests transport adapter that
+returns canned responses without opening a socket, so the timings measure only the
+client's own work per call (headers, parameters, retry and circuit breaker
+bookkeeping, decoding) plus the fixed cost of requests itself.
+
+    pip3 install pytest-benchmark
+    pytest benchmarks/bench_query.py
+"""
+
+import json
+import os
+import sys
+import time
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyflowater import METHOD_GET, METHOD_POST, PyFlo  # noqa: E402
+from pyflowater.auth import MemoryTokenStore  # noqa: E402
+
+API_BASE = "https://stub.invalid/api/v2"
+AUTH_URL = "https://stub.invalid/api/v1/users/auth"
+DEVICE_ID = "0123abcd-0000-0000-0000-000000000001"
+
+DEVICE = json.dumps(
+    {
+        "id": DEVICE_ID,
+        "macAddress": "f87aef000001",
+        "valve": {"target": "open", "lastKnown": "open"},
+        "systemMode": {"target": "home", "lastKnown": "home"},
+        "telemetry": {
+            "current": {
+                "gpm": 0.0,
+                "psi": 60.4,
+                "tempF": 66.0,
+                "updated": "2021-09-04T23:07:03.000Z",
+            }
+        },
+    }
+).encode()
+
+
+class StubTransport(BaseAdapter):
+    """Answers every request with 200 and a fixed JSON body (and logins with a
+    token), recording the last request sent."""
+
+    def __init__(self, body):
+        super().__init__()
+        self.body = body
+        self.auth_body = json.dumps(
+            {
+                "token": "stub-token",
+                "tokenPayload": {"user": {"user_id": "stub-user"}},
+                "tokenExpiration": 86400,
+                "timeNow": int(time.time()),
+            }
+        ).encode()
+        self.last_request = None
+
+    def send(self, request, **kwargs):
+        self.last_request = request
+        response = requests.Response()
+        response.status_code = 200
+        response.headers = CaseInsensitiveDict({"Content-Type": "application/json"})
+        response._content = self.auth_body if request.url == AUTH_URL else self.body
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def transport():
+    return StubTransport(DEVICE)
+
+
+@pytest.fixture
+def flo(transport):
+    session = requests.Session()
+    session.mount("https://", transport)
+    client = PyFlo(
+        "user@example.com",
+        "password",
+        token_store=MemoryTokenStore(),
+        refresh_in_background=False,
+        api_base=API_BASE,
+        auth_url=AUTH_URL,
+        session=session,
+    )
+    yield client
+    client.close()
+
+
+def test_get(benchmark, flo):
+    url = f"{API_BASE}/devices/{DEVICE_ID}"
+    assert benchmark(flo.query, url, method=METHOD_GET)["id"] == DEVICE_ID
+
+
+def test_get_params(benchmark, flo):
+    url = f"{API_BASE}/water/consumption"
+    params = {"macAddress": "f87aef000001", "interval": "1h"}
+    assert benchmark(flo.query, url, method=METHOD_GET, extra_params=params)
+
+
+def test_get_raw(benchmark, flo):
+    url = f"{API_BASE}/devices/{DEVICE_ID}"
+    assert benchmark(flo.query, url, method=METHOD_GET, decode=False) == DEVICE
+
+
+def test_post(benchmark, flo):
+    url = f"{API_BASE}/devices/{DEVICE_ID}"
+    assert benchmark(flo.query, url, method=METHOD_POST, extra_params={"valve": {}})
+
+
+def test_extra_headers(benchmark, flo, transport):
+    url = f"{API_BASE}/devices/{DEVICE_ID}"
+    benchmark(flo.query, url, method=METHOD_GET, extra_headers={"X-Trace": "1"})
+    assert transport.last_request.headers["X-Trace"] == "1"
+
+    # headers of one request must not leak into the next
+    flo.query(url, method=METHOD_GET)
+    assert "X-Trace" not in transport.last_request.headers
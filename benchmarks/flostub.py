@@ -0,0 +1,660 @@
+"""A local stand-in for the Flo cloud, for load testing and benchmarks without network.
+
+FloStubServer serves the endpoints PyFlo uses (auth, users, locations, devices,
+water/consumption, water/metrics, alerts, presence and session/firestore) for a synthetic fleet,
+with configurable latency and error rate. FakeFirestore replaces the firestore
+connection of real-time listeners with an in-process snapshot source.
+
+It lives with the benchmarks and is not installed with pyflowater; import it from a
+checkout of the repository (benchmarks.flostub, with the repository root on sys.path).
+
+    with FloStubServer(locations=10, devices_per_location=5, latency=0.02) as server:
+        flo = PyFlo(
+            "user@example.com",
+            "password",
+            token_store=MemoryTokenStore(),
+            api_base=server.api_base,
+            auth_url=server.auth_url,
+            firestore_backend=FakeFirestore(server),
+        )
+"""
+
+import logging
+import gzip
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from pyflowater.dispatch import get_field
+from pyflowater.timeutil import format_flo_time, parse_flo_time
+
+LOG = logging.getLogger(__name__)
+
+API_PREFIX = "/api/v2"
+AUTH_PATH = "/api/v1/users/auth"
+
+_INTERVAL_SECONDS = {"1h": 3600, "1d": 86400, "1m": 30 * 86400}
+
+
+def _mac(n):
+    return "".join(f"{b:02x}" for b in n.to_bytes(6, "big"))
+
+
+def _device_document(device_id, mac_address, location_id):
+    return {
+        "id": device_id,
+        "macAddress": mac_address,
+        "location": {"id": location_id},
+        "deviceType": "flo_device_v2",
+        "isConnected": True,
+        "valve": {"target": "open", "lastKnown": "open"},
+        "systemMode": {"target": "home", "lastKnown": "home"},
+        "telemetry": {
+            "current": {
+                "gpm": 0.0,
+                "psi": 60.0,
+                "tempF": 65.0,
+                "updated": format_flo_time(datetime.now(timezone.utc)),
+            }
+        },
+    }
+
+
+class FloStubServer:
+    """Threaded HTTP server mimicking the Flo cloud for a synthetic fleet.
+
+    Any username and password are accepted. State changes (valve, systemMode) are
+    applied to the fleet immediately."""
+
+    def __init__(
+        self,
+        locations=1,
+        devices_per_location=1,
+        latency=0.0,
+        error_rate=0.0,
+        alerts_per_location=0,
+        actuation_delay=0.0,
+        etags=False,
+        compress=False,
+        token_expiration=86400,
+        host="127.0.0.1",
+        port=0,
+        seed=None,
+    ):
+        """
+        :param locations: number of locations in the account
+        :param devices_per_location: number of devices at each location
+        :param latency: seconds added to every response
+        :param error_rate: fraction (0-1) of API requests answered with a 503
+        :param alerts_per_location: number of triggered alerts at each location
+        :param actuation_delay: seconds before a device's valve and systemMode lastKnown
+            reach a new target
+        :param etags: send ETags with GET responses and answer matching
+            If-None-Match requests with 304 Not Modified
+        :param compress: gzip responses to clients that accept it
+        :param token_expiration: seconds issued auth tokens are valid
+        :param port: port to listen on (default: any free port)
+        :param seed: seed for the random error injection and telemetry
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.actuation_delay = actuation_delay
+        self.etags = etags
+        self.compress = compress
+        self.not_modified = 0  # 304 responses sent
+        self.bytes_sent = 0  # response body bytes sent (after compression)
+        self.token_expiration = token_expiration
+        self.user_id = str(uuid.UUID(int=1))
+        self.requests = 0  # requests served, including injected errors
+        self.errors = 0  # injected errors
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = set()
+        self.locations = {}  # location_id -> location document
+        self.devices = {}  # device_id -> device document
+        self.alerts = []
+        self._actuations = {}  # (device_id, field) -> (target, monotonic time due)
+
+        n = 0
+        for i in range(locations):
+            location_id = str(uuid.UUID(int=(1 << 64) + i))
+            location = {
+                "id": location_id,
+                "nickname": f"Location {i}",
+                "systemMode": {"target": "home"},
+                "devices": [],
+            }
+            for _ in range(devices_per_location):
+                n += 1
+                device_id = str(uuid.UUID(int=(2 << 64) + n))
+                device = _device_document(device_id, _mac(n), location_id)
+                self.devices[device_id] = device
+                location["devices"].append(
+                    {"id": device_id, "macAddress": device["macAddress"]}
+                )
+            for j in range(alerts_per_location):
+                self.alerts.append(
+                    {
+                        "id": str(uuid.UUID(int=(3 << 64) + len(self.alerts))),
+                        "locationId": location_id,
+                        "status": "triggered",
+                        "alarm": {
+                            "id": 10 + j % 20,
+                            "severity": ("critical", "warning")[j % 2],
+                        },
+                        "createAt": format_flo_time(
+                            datetime.now(timezone.utc) - timedelta(minutes=j)
+                        ),
+                    }
+                )
+            self.locations[location_id] = location
+        # the API returns alerts newest first
+        self.alerts.sort(key=lambda alert: alert["createAt"], reverse=True)
+
+        self._server = ThreadingHTTPServer((host, port), _StubHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        (host, port) = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def api_base(self):
+        """Pass as PyFlo(api_base=...)"""
+        return self.url + API_PREFIX
+
+    @property
+    def auth_url(self):
+        """Pass as PyFlo(auth_url=...)"""
+        return self.url + AUTH_PATH
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._server.serve_forever, name="FloStubServer", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def device_for_mac(self, mac_address):
+        self._settle()
+        for device in self.devices.values():
+            if device["macAddress"] == mac_address:
+                return device
+        return None
+
+    def step_telemetry(self, device):
+        """Advance the simulated telemetry of a device document and return it"""
+        current = device["telemetry"]["current"]
+        flowing = self._random.random() < 0.2
+        current["gpm"] = round(self._random.uniform(0.5, 4.0), 2) if flowing else 0.0
+        current["psi"] = round(60.0 + self._random.uniform(-2, 2), 1)
+        current["tempF"] = round(65.0 + self._random.uniform(-1, 1), 1)
+        previous = parse_flo_time(current["updated"])
+        current["updated"] = format_flo_time(
+            datetime.fromtimestamp(max(time.time(), previous + 1), timezone.utc)
+        )
+        return device
+
+    def _actuate(self, device, field, target):
+        """Set a device's valve or systemMode target; lastKnown follows once the
+        actuation delay has passed"""
+        device[field] = {**device[field], "target": target}
+        with self._lock:
+            self._actuations[(device["id"], field)] = (
+                target,
+                time.monotonic() + self.actuation_delay,
+            )
+        self._settle()
+
+    def _settle(self):
+        now = time.monotonic()
+        with self._lock:
+            for ((device_id, field), (target, due)) in list(self._actuations.items()):
+                if now >= due:
+                    self.devices[device_id][field]["lastKnown"] = target
+                    del self._actuations[(device_id, field)]
+
+    # request handling (called on the server's threads)
+
+    def _handle(self, method, path, query, body, headers):
+        self._settle()
+        with self._lock:
+            self.requests += 1
+            inject_error = self.error_rate and self._random.random() < self.error_rate
+            if inject_error:
+                self.errors += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        if path == AUTH_PATH and method == "POST":
+            return self._auth(body)
+        if not path.startswith(API_PREFIX):
+            return (404, {"error": "not found"})
+        if inject_error:
+            return (503, {"error": "injected failure"})
+        if headers.get("authorization") not in self._tokens:
+            return (401, {"error": "invalid token"})
+
+        for (route_method, pattern, handler) in _ROUTES:
+            if method != route_method:
+                continue
+            match = pattern.fullmatch(path[len(API_PREFIX) :])
+            if match:
+                return handler(self, query, body, *match.groups())
+        return (404, {"error": "not found"})
+
+    def _auth(self, body):
+        if not body.get("username") or not body.get("password"):
+            return (400, {"error": "username and password required"})
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._tokens.add(token)
+        return (
+            200,
+            {
+                "token": token,
+                "tokenPayload": {
+                    "user": {"user_id": self.user_id, "email": body["username"]},
+                    "timestamp": int(time.time()),
+                },
+                "tokenExpiration": self.token_expiration,
+                "timeNow": int(time.time()),
+            },
+        )
+
+    def _user(self, query, body, user_id):
+        if user_id != self.user_id:
+            return (404, {"error": "no such user"})
+        user = {"id": user_id, "email": "user@example.com"}
+        if "locations" in query.get("expand", ""):
+            user["locations"] = list(self.locations.values())
+        else:
+            user["locations"] = [{"id": id} for id in self.locations]
+        return (200, user)
+
+    def _location(self, query, body, location_id):
+        location = self.locations.get(location_id)
+        if location is None:
+            return (404, {"error": "no such location"})
+        if "devices" in query.get("expand", ""):
+            devices = [self.devices[device["id"]] for device in location["devices"]]
+            location = {**location, "devices": devices}
+        return (200, location)
+
+    def _system_mode(self, query, body, location_id):
+        location = self.locations.get(location_id)
+        if location is None:
+            return (404, {"error": "no such location"})
+        location["systemMode"] = {"target": body.get("target")}
+        for device in location["devices"]:
+            self._actuate(self.devices[device["id"]], "systemMode", body.get("target"))
+        return (200, {})
+
+    def _device(self, query, body, device_id):
+        device = self.devices.get(device_id)
+        if device is None:
+            return (404, {"error": "no such device"})
+        return (200, device)
+
+    def _update_device(self, query, body, device_id):
+        device = self.devices.get(device_id)
+        if device is None:
+            return (404, {"error": "no such device"})
+        if "valve" in body:
+            self._actuate(device, "valve", body["valve"].get("target"))
+        return (200, device)
+
+    def _health_test(self, query, body, device_id):
+        if device_id not in self.devices:
+            return (404, {"error": "no such device"})
+        return (200, {"roundId": uuid.uuid4().hex, "status": "pending"})
+
+    def _consumption(self, query, body):
+        try:
+            start = parse_flo_time(query["startDate"])
+            end = parse_flo_time(query["endDate"])
+        except (KeyError, ValueError):
+            return (400, {"error": "startDate and endDate required"})
+        step = _INTERVAL_SECONDS.get(query.get("interval", "1h"), 3600)
+        rng = random.Random(f"{query.get('macAddress')}{start}")
+        items = []
+        t = start - start % step
+        while t <= end:
+            items.append(
+                {
+                    "time": format_flo_time(datetime.fromtimestamp(t, timezone.utc)),
+                    "gallonsConsumed": round(rng.uniform(0, 5), 3),
+                }
+            )
+            t += step
+        total = round(sum(item["gallonsConsumed"] for item in items), 3)
+        return (
+            200,
+            {
+                "params": dict(query),
+                "aggregations": {"sumTotalGallonsConsumed": total},
+                "items": items,
+            },
+        )
+
+    def _metrics(self, query, body):
+        try:
+            start = parse_flo_time(query["startDate"])
+            end = parse_flo_time(query["endDate"])
+        except (KeyError, ValueError):
+            return (400, {"error": "startDate and endDate required"})
+        step = _INTERVAL_SECONDS.get(query.get("interval", "1h"), 3600)
+        rng = random.Random(f"metrics{query.get('macAddress')}{start}")
+        items = []
+        t = start - start % step
+        while t <= end:
+            items.append(
+                {
+                    "time": format_flo_time(datetime.fromtimestamp(t, timezone.utc)),
+                    "averageGpm": round(rng.uniform(0, 1.5), 2),
+                    "averagePsi": round(rng.uniform(58, 62), 1),
+                    "averageTempF": round(rng.uniform(60, 70), 1),
+                }
+            )
+            t += step
+        return (200, {"params": dict(query), "items": items})
+
+    def _alerts(self, query, body):
+        locations = set(query.get("locationId", "").split(",")) - {""}
+        severities = set(query.get("severity", "").split(",")) - {""}
+        alerts = [
+            alert
+            for alert in self.alerts
+            if (not locations or alert["locationId"] in locations)
+            and (not severities or alert["alarm"]["severity"] in severities)
+        ]
+        page = int(query.get("page", 1))
+        size = int(query.get("size", 100))
+        return (
+            200,
+            {
+                "items": alerts[(page - 1) * size : page * size],
+                "page": page,
+                "total": len(alerts),
+            },
+        )
+
+    def _presence(self, query, body):
+        return (200, {})
+
+    def _firestore_token(self, query, body):
+        return (200, {"token": uuid.uuid4().hex})
+
+
+_ROUTES = [
+    ("GET", re.compile(r"/users/([^/]+)"), FloStubServer._user),
+    ("GET", re.compile(r"/locations/([^/]+)"), FloStubServer._location),
+    ("POST", re.compile(r"/locations/([^/]+)/systemMode"), FloStubServer._system_mode),
+    ("GET", re.compile(r"/devices/([^/]+)"), FloStubServer._device),
+    ("POST", re.compile(r"/devices/([^/]+)"), FloStubServer._update_device),
+    (
+        "POST",
+        re.compile(r"/devices/([^/]+)/healthTest/run"),
+        FloStubServer._health_test,
+    ),
+    ("GET", re.compile(r"/water/consumption"), FloStubServer._consumption),
+    ("GET", re.compile(r"/water/metrics"), FloStubServer._metrics),
+    ("GET", re.compile(r"/alerts"), FloStubServer._alerts),
+    ("POST", re.compile(r"/presence/me"), FloStubServer._presence),
+    ("POST", re.compile(r"/session/firestore"), FloStubServer._firestore_token),
+]
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, as with the real API
+    disable_nagle_algorithm = True  # headers and body are written separately
+
+    def _serve(self, method):
+        (path, _, raw_query) = self.path.partition("?")
+        # repeated parameters are joined with commas
+        query = {key: ",".join(v) for key, v in parse_qs(raw_query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        body = {}
+        if length:
+            try:
+                body = json.loads(self.rfile.read(length)) or {}
+            except ValueError:
+                body = {}
+        headers = {key.lower(): value for key, value in self.headers.items()}
+
+        stub = self.server.stub
+        (status, payload) = stub._handle(
+            method, urlsplit(path).path, query, body, headers
+        )
+        data = json.dumps(payload).encode()
+        extra = {}
+        if stub.etags and method == "GET" and status == 200:
+            etag = '"' + hashlib.sha1(data).hexdigest()[:16] + '"'
+            extra["ETag"] = etag
+            if headers.get("if-none-match") == etag:
+                (status, data) = (304, b"")
+                with stub._lock:
+                    stub.not_modified += 1
+        if stub.compress and data and "gzip" in headers.get("accept-encoding", ""):
+            data = gzip.compress(data, 5)
+            extra["Content-Encoding"] = "gzip"
+        with stub._lock:
+            stub.bytes_sent += len(data)
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for (name, value) in extra.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._serve("GET")
+
+    def do_POST(self):
+        self._serve("POST")
+
+    def do_PUT(self):
+        self._serve("PUT")
+
+    def log_message(self, format, *args):
+        LOG.debug("%s - %s", self.address_string(), format % args)
+
+
+class FakeSnapshot:
+    """Stands in for a firestore DocumentSnapshot of a device document."""
+
+    __slots__ = ("id", "_data")
+
+    def __init__(self, document_id, data):
+        self.id = document_id
+        self._data = data
+
+    def get(self, path):
+        value = get_field(self._data, path)
+        if value is None:
+            raise KeyError(path)
+        return value
+
+    def to_dict(self):
+        return self._data
+
+
+class _FakeWatch:
+    def __init__(self, firestore, document_id, callback):
+        self._firestore = firestore
+        self.document_id = document_id
+        self.callback = callback
+
+    def close(self):
+        self._firestore._remove(self)
+
+
+class _FakeDocument:
+    def __init__(self, firestore, document_id):
+        self._firestore = firestore
+        self._document_id = document_id
+
+    def on_snapshot(self, callback):
+        return self._firestore._add(self._document_id, callback)
+
+
+class _FakeCollection:
+    def __init__(self, firestore):
+        self._firestore = firestore
+
+    def document(self, document_id):
+        return _FakeDocument(self._firestore, document_id)
+
+
+class _FakeClient:
+    def __init__(self, firestore):
+        self._firestore = firestore
+
+    def collection(self, name):
+        return _FakeCollection(self._firestore)
+
+
+class _FakeCredentials:
+    def __init__(self, token):
+        self.token = token
+        self.expiry = None
+
+
+class FakeFirestore:
+    """In-process replacement for Flo's firestore, used as a FirestoreBackend.
+
+    Watches receive the current document when they start, like firestore, and then
+    whatever is publish()ed. With a FloStubServer, documents come from its fleet and
+    stream() advances their telemetry; otherwise documents are synthesized."""
+
+    def __init__(self, server=None, seed=None):
+        self._server = server
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._watches = {}  # document id (MAC address) -> [_FakeWatch]
+        self._documents = {}  # document id -> data, if there is no server
+        self._stream_thread = None
+        self._stop = threading.Event()
+        self.published = 0
+
+    # FirestoreBackend
+
+    def token_info(self, token):
+        return {"idToken": token, "refreshToken": token, "expiresIn": "3600"}
+
+    def client(self, tinfo):
+        return (_FakeClient(self), _FakeCredentials(tinfo["idToken"]))
+
+    # snapshot source
+
+    @property
+    def document_ids(self):
+        """Document ids (MAC addresses) being watched"""
+        with self._lock:
+            return list(self._watches)
+
+    def document(self, document_id):
+        """Current data of a device document"""
+        if self._server is not None:
+            device = self._server.device_for_mac(document_id)
+            if device is not None:
+                return device
+        with self._lock:
+            data = self._documents.get(document_id)
+            if data is None:
+                data = self._documents[document_id] = _device_document(
+                    document_id, document_id, None
+                )
+            return data
+
+    def publish(self, document_id, data=None):
+        """Deliver a snapshot of document_id (its current data if None) to its
+        watches, on the calling thread"""
+        if data is None:
+            data = self.document(document_id)
+        snapshot = FakeSnapshot(document_id, data)
+        with self._lock:
+            watches = list(self._watches.get(document_id, ()))
+        for watch in watches:
+            watch.callback([snapshot], [], datetime.now(timezone.utc))
+        self.published += len(watches)
+        return len(watches)
+
+    def stream(self, interval=1.0):
+        """Advance and publish the telemetry of every watched document each interval
+        seconds, from a background thread, until stop()"""
+        if self._stream_thread is not None:
+            return
+        self._stop.clear()
+        self._stream_thread = threading.Thread(
+            target=self._stream, args=(interval,), name="FakeFirestore", daemon=True
+        )
+        self._stream_thread.start()
+
+    def stop(self):
+        """Stop stream()ing"""
+        if self._stream_thread is not None:
+            self._stop.set()
+            self._stream_thread.join()
+            self._stream_thread = None
+
+    def _stream(self, interval):
+        while not self._stop.wait(interval):
+            for document_id in self.document_ids:
+                self.publish(document_id, self._step(document_id))
+
+    def _step(self, document_id):
+        data = self.document(document_id)
+        if self._server is not None:
+            return self._server.step_telemetry(data)
+        current = data["telemetry"]["current"]
+        current["gpm"] = round(self._random.uniform(0, 3), 2)
+        current["updated"] = format_flo_time(datetime.now(timezone.utc))
+        return data
+
+    def _add(self, document_id, callback):
+        watch = _FakeWatch(self, document_id, callback)
+        with self._lock:
+            self._watches.setdefault(document_id, []).append(watch)
+        # firestore sends the current state as soon as a listener starts
+        snapshot = FakeSnapshot(document_id, self.document(document_id))
+        threading.Thread(
+            target=callback,
+            args=([snapshot], [], datetime.now(timezone.utc)),
+            daemon=True,
+        ).start()
+        return watch
+
+    def _remove(self, watch):
+        with self._lock:
+            watches = self._watches.get(watch.document_id, [])
+            if watch in watches:
+                watches.remove(watch)
+            if not watches:
+                self._watches.pop(watch.document_id, None)
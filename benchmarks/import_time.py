@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Guard the cold-start cost of `import pyflowater`.
+
+Imports the package in fresh interpreters and fails if the median import time exceeds
+the budget, or if importing it loaded the firestore (gRPC/protobuf) stack, which must
+only be loaded when a real-time listener is started.
+
+    python benchmarks/import_time.py [--budget-ms 250] [--runs 5]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import pyflowater
+elapsed = time.perf_counter() - start
+heavy = sorted(m for m in ("google.cloud.firestore", "grpc", "google.protobuf") if m in sys.modules)
+print(elapsed, ",".join(heavy))
+"""
+
+
+def measure(runs):
+    env = dict(
+        os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", "")
+    )
+    timings = []
+    heavy = set()
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, "-c", PROBE], env=env, text=True
+        )
+        (elapsed, modules) = output.split(" ", 1)
+        timings.append(float(elapsed) * 1000)
+        heavy.update(filter(None, modules.strip().split(",")))
+    return (timings, heavy)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=250.0)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    (timings, heavy) = measure(args.runs)
+    median = statistics.median(timings)
+    print(f"import pyflowater: median {median:.1f} ms over {args.runs} runs")
+
+    failed = False
+    if heavy:
+        print(f"FAIL: importing pyflowater loaded {', '.join(sorted(heavy))}")
+        failed = True
+    if median > args.budget_ms:
+        print(f"FAIL: exceeds budget of {args.budget_ms:.0f} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
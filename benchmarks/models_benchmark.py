@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Compare memory and CPU of pyflowater.models against plain dicts.
+
+Decodes many device responses (shaped like GET /devices/{id}) both ways, keeps all of
+them in memory, then reads the current telemetry and valve state of each, reporting
+bytes retained per device and the time taken.
+
+    python benchmarks/models_benchmark.py [--devices 20000]
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyflowater import loads, orjson  # noqa: E402
+from pyflowater.models import Device  # noqa: E402
+
+
+def device_json(n):
+    """A device response of realistic size (the real API returns ~100 fields)"""
+    return json.dumps(
+        {
+            "id": f"{n:08x}-0000-0000-0000-000000000000",
+            "macAddress": f"{n:012x}",
+            "nickname": f"Device {n}",
+            "deviceType": "flo_device_v2",
+            "deviceModel": "flo_device_075_v2",
+            "isConnected": True,
+            "fwVersion": "6.1.1",
+            "location": {"id": "00000000-0000-0000-0000-000000000001"},
+            "valve": {"target": "open", "lastKnown": "open"},
+            "systemMode": {"isLocked": False, "target": "home", "lastKnown": "home"},
+            "telemetry": {
+                "current": {
+                    "gpm": 0.0,
+                    "psi": 61.2,
+                    "tempF": 66.0,
+                    "updated": "2021-09-04T23:07:03.000Z",
+                }
+            },
+            "notifications": {
+                "pending": {"infoCount": 0, "warningCount": 0, "criticalCount": 0}
+            },
+            "fwProperties": {f"property_{i}": i * 1.5 for i in range(60)},
+            "healthTest": {"config": {"enabled": True, "timesPerDay": 1}},
+            "installStatus": {"isInstalled": True, "installDate": "2020-01-01"},
+            "irrigationSchedule": {"isEnabled": False},
+            "serialNumber": f"SN{n:010d}",
+        }
+    ).encode()
+
+
+def timings(build, read, bodies):
+    """Seconds to build every item, then to read each"""
+    gc.collect()
+    start = time.perf_counter()
+    items = [build(body) for body in bodies]
+    built = time.perf_counter() - start
+    start = time.perf_counter()
+    for item in items:
+        read(item)
+    return (built, time.perf_counter() - start)
+
+
+def memory(build, read, n):
+    """Bytes retained by n items before and after reading them, including response
+    bodies that the items keep"""
+    gc.collect()
+    tracemalloc.start()
+    items = [build(device_json(i)) for i in range(n)]
+    unread = tracemalloc.get_traced_memory()[0]
+    for item in items:
+        read(item)
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (unread, retained)
+
+
+def read_dict(device):
+    current = device["telemetry"]["current"]
+    return (current["gpm"], current["psi"], device["valve"]["lastKnown"])
+
+
+def read_model(device):
+    return (device.telemetry.gpm, device.telemetry.psi, device.valve.last_known)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=20000)
+    args = parser.parse_args()
+
+    bodies = [device_json(n) for n in range(args.devices)]
+    n = len(bodies)
+    print(f"{n} devices, {sum(map(len, bodies)) / n:.0f} bytes of JSON each, ", end="")
+    print("orjson" if orjson is not None else "json (orjson not installed)")
+
+    for (name, build, read) in (
+        ("dict", loads, read_dict),
+        ("model", Device, read_model),
+        ("model(dict)", lambda body: Device(loads(body)), read_model),
+    ):
+        (built, reads) = timings(build, read, bodies)
+        (unread, retained) = memory(build, read, n)
+        print(
+            f"{name:12} build {built * 1e6 / n:6.2f} us  read {reads * 1e6 / n:6.2f} us"
+            f"  memory {unread / n:7.0f} B unread, {retained / n:7.0f} B read"
+        )
+
+
+if __name__ == "__main__":
+    main()
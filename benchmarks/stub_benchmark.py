@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""Benchmark PyFlo against a local stub of the Flo cloud, without network access.
+
+Measures query() throughput and latency percentiles, the memory held per device by
+the device cache and telemetry history, and real-time listener fan-out through a
+TelemetryDispatcher, so regressions in querying, caching or streaming show up on
+any machine.
+
+    python benchmarks/stub_benchmark.py [--devices 200] [--threads 8] [--latency 0.005]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyflowater import PyFlo  # noqa: E402
+from pyflowater.auth import MemoryTokenStore  # noqa: E402
+from pyflowater.dispatch import TelemetryDispatcher  # noqa: E402
+from pyflowater.history import TelemetryHistory  # noqa: E402
+from benchmarks.flostub import FakeFirestore, FloStubServer  # noqa: E402
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def client(server, **kwargs):
+    return PyFlo(
+        "bench@example.com",
+        "password",
+        token_store=MemoryTokenStore(),
+        refresh_in_background=False,
+        api_base=server.api_base,
+        auth_url=server.auth_url,
+        **kwargs,
+    )
+
+
+def bench_queries(server, device_ids, threads, requests):
+    """device() throughput with the cache disabled, from concurrent threads"""
+    flo = client(server, device_cache_ttl=0)
+    latencies = []
+
+    def fetch(i):
+        start = time.perf_counter()
+        flo.device(device_ids[i % len(device_ids)])
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(fetch, range(requests)))
+    elapsed = time.perf_counter() - start
+    print(
+        f"query:    {requests / elapsed:8.0f} req/s  "
+        f"p50 {percentile(latencies, 50) * 1000:6.2f} ms  "
+        f"p99 {percentile(latencies, 99) * 1000:6.2f} ms  "
+        f"({threads} threads, {server.errors} injected errors)"
+    )
+
+
+def bench_cached(server, device_ids, requests):
+    """device() throughput when answered from the device cache"""
+    flo = client(server, device_cache_ttl=3600)
+    for device_id in device_ids:
+        flo.device(device_id)
+    start = time.perf_counter()
+    for i in range(requests):
+        flo.device(device_ids[i % len(device_ids)])
+    elapsed = time.perf_counter() - start
+    print(f"cached:   {requests / elapsed:8.0f} req/s")
+
+
+def bench_memory(server, device_ids, samples):
+    """Bytes retained per device by the device cache and a telemetry history"""
+    history = TelemetryHistory(capacity=samples)
+    flo = client(server, telemetry_history=history, device_cache_ttl=3600)
+    flo.data()
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for device_id in device_ids:
+        flo.device(device_id)
+        flo.telemetry(device_id)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    retained = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    print(
+        f"memory:   {retained / len(device_ids):8.0f} bytes/device  "
+        f"(cache + {samples}-sample history)"
+    )
+
+
+def bench_fanout(server, device_ids, seconds, interval):
+    """Listener events delivered per second and their dispatch lag"""
+    firestore = FakeFirestore(server)
+    flo = client(server, firestore_backend=firestore)
+    received = []
+    lock = threading.Lock()
+
+    def on_event(event):
+        with lock:
+            received.append(event.lag)
+
+    dispatcher = TelemetryDispatcher(on_event, workers=2, deltas=False)
+    manager = flo.get_listener_manager(heartbeat=False, dispatcher=dispatcher)
+    for device_id in device_ids:
+        manager.subscribe(device_id)
+
+    time.sleep(0.5)  # initial snapshots
+    with lock:
+        received.clear()
+    firestore.stream(interval)
+    time.sleep(seconds)
+    firestore.stop()
+    manager.stop()
+    dispatcher.stop(timeout=5)
+
+    lags = received or [0.0]
+    print(
+        f"fan-out:  {len(received) / seconds:8.0f} events/s  "
+        f"p50 lag {statistics.median(lags) * 1000:6.2f} ms  "
+        f"max lag {max(lags) * 1000:6.2f} ms  "
+        f"({len(device_ids)} devices, {dispatcher.coalesced} coalesced)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--locations", type=int, default=10)
+    parser.add_argument("--devices", type=int, default=200, help="fleet size")
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--samples", type=int, default=1000)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--interval", type=float, default=0.05)
+    args = parser.parse_args()
+
+    per_location = max(1, args.devices // args.locations)
+    with FloStubServer(
+        locations=args.locations,
+        devices_per_location=per_location,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        seed=0,
+    ) as server:
+        device_ids = list(server.devices)
+        bench_queries(server, device_ids, args.threads, args.requests)
+        bench_cached(server, device_ids, args.requests * 10)
+        bench_memory(server, device_ids, args.samples)
+        bench_fanout(server, device_ids, args.seconds, args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,61 @@
 """Base Python Class file for Flo"""
 
 import logging
+import asyncio
 import json
+import threading
 import time
-from datetime import datetime, timezone
+from types import MappingProxyType
+from urllib.parse import urlsplit
 
 import requests
 from retry import retry
 
+try:
+    import orjson
+except ImportError:  # optional, several times faster than json
+    orjson = None
+
+from pyflowater.alerts import (
+    ALERT_PAGE_SIZE,
+    ALERT_SEVERITIES,
+    alert_params,
+    alert_time,
+    async_paginate,
+    paginate,
+)
+from pyflowater.auth import (
+    FileTokenStore,
+    refresh_time,
+    token_info_from_response,
+    token_key,
+)
+from pyflowater.cache import DeviceCache
 from pyflowater.const import (
     FLO_AUTH_URL,
+    FLO_DEVICE_CACHE_TTL,
+    FLO_KEEPALIVE_TIMEOUT,
+    FLO_MAX_CONCURRENCY,
     FLO_MODES,
     FLO_PRESENCE_HEARTBEAT,
     FLO_TIME_FORMAT,
+    FLO_TOKEN_REFRESH_MARGIN,
     FLO_USER_AGENT,
     FLO_V2_API_BASE,
     INTERVAL_DAILY,
     INTERVAL_HOURLY,
     INTERVAL_MONTHLY,
 )
-from pyflowater.flostream import FloListener
+from pyflowater.flostream import FloListener, FloListenerManager
+from pyflowater.index import DeviceIndex
+from pyflowater.resilience import (
+    CircuitBreaker,
+    RetryBudget,
+    RetryPolicy,
+    endpoint_template,
+    parse_retry_after,
+)
+from pyflowater.timeutil import day_window, format_flo_time
 
 LOG = logging.getLogger(__name__)
 
@@ -27,8 +63,21 @@ METHOD_GET = "GET"
 METHOD_PUT = "PUT"
 METHOD_POST = "POST"
 
+# kept for compatibility, like the FLO_PRESENCE_HEARTBEAT and FLO_TIME_FORMAT imports:
+# device_id -> (location_id, mac_address) of every device seen by any client, filled
+# each time a client's device_index is rebuilt (prefer device_index for lookups)
 DEVICE_ID_TO_LOCATION_MAC_TUPLE = {}
 
+# headers sent with every request; each client adds its authorization header once per
+# token (see _client_headers) rather than rebuilding them for each request
+_BASE_HEADERS = MappingProxyType(
+    {
+        "User-Agent": FLO_USER_AGENT,
+        "Content-Type": "application/json;charset=UTF-8",
+        "Accept": "application/json",
+    }
+)
+
 
 class FloError(Exception):
     pass
@@ -38,46 +87,269 @@ class DataNotObtained(Exception):
     pass
 
 
+class CircuitOpenError(FloError):
+    """Raised without sending a request while an endpoint's circuit breaker is open."""
+
+
+def loads(data):
+    """Decode a JSON response body (bytes or str), with orjson if it is installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _client_headers(token):
+    """Immutable request headers for an auth token"""
+    return MappingProxyType({**_BASE_HEADERS, "authorization": token})
+
+
+def _no_auth(request):
+    """requests auth hook that leaves requests untouched (stops netrc lookups)"""
+    return request
+
+
+def _consumption_params(location_id, mac_address, startDate, endDate, interval):
+    """Build the /water/consumption query parameters. If startDate or endDate are naive
+    (tzinfo is None), they are assumed to represent local time of the running system."""
+
+    # calculate since beginning of day in LOCAL timezone; Flo website queries for current
+    # data sets end timestamp as the last millisecond of the day, so do the same
+    (today_start, today_end) = day_window()
+    return {
+        "locationId": location_id,
+        "macAddress": mac_address,
+        "startDate": format_flo_time(startDate or today_start),
+        "endDate": format_flo_time(endDate or today_end),
+        "interval": interval,
+    }
+
+
+def _metrics_params(mac_address, startDate, endDate, interval):
+    """Build the /water/metrics query parameters (dates as in _consumption_params)"""
+    (today_start, today_end) = day_window()
+    return {
+        "macAddress": mac_address,
+        "startDate": format_flo_time(startDate or today_start),
+        "endDate": format_flo_time(endDate or today_end),
+        "interval": interval,
+    }
+
+
+def _alert_filters(location_ids, severities):
+    """Normalize single values of alert filters into lists"""
+    if isinstance(location_ids, str):
+        location_ids = [location_ids]
+    if isinstance(severities, str):
+        severities = [severities]
+    return (list(location_ids), list(severities))
+
+
+def _mode_params(mode, additional_params=None):
+    """Build the body for a location systemMode change"""
+    params = {"target": mode}
+    if mode == "sleep":
+        # Number of minutes to sleep (120=2 hours, 480=8 hours)
+        params["revertMinutes"] = 480
+        # Mode to set after sleep concludes ("away" or "home")
+        params["revertMode"] = "home"
+
+    if additional_params:
+        params = {**params, **additional_params}
+    return params
+
+
 class PyFlo:
     """Base object for Flo."""
 
-    def __init__(self, username, password=None):
+    def __init__(
+        self,
+        username,
+        password=None,
+        device_cache_ttl=FLO_DEVICE_CACHE_TTL,
+        token_store=None,
+        refresh_in_background=True,
+        retry_policy=None,
+        retry_budget=None,
+        telemetry_history=None,
+        stream_staleness=None,
+        metrics=None,
+        api_base=FLO_V2_API_BASE,
+        auth_url=FLO_AUTH_URL,
+        firestore_backend=None,
+        session=None,
+        concurrency_limits=(),
+        login_limiter=None,
+        http_cache=None,
+        leak_detector=None,
+    ):
         """Create a PyFlo object.
+
+        If token_store holds a still valid token for username, it is reused instead of
+        logging in again; password is then kept for one login should the server reject
+        that token.
         :param username: Flo user email
         :param password: Flo user password
+        :param device_cache_ttl: seconds device() snapshots are reused (0 to disable)
+        :param token_store: TokenStore shared across clients and processes (default
+            FileTokenStore; pass a MemoryTokenStore to keep tokens off disk)
+        :param refresh_in_background: refresh the token on a timer before it expires
+            (requires save_password())
+        :param retry_policy: RetryPolicy deciding backoff between query() attempts
+        :param retry_budget: RetryBudget capping retries across all queries
+        :param telemetry_history: TelemetryHistory recording telemetry() results and
+            real-time listener snapshots
+        :param stream_staleness: if set, real-time listener snapshots update the device
+            cache, and telemetry(), valve_status() and preset_mode() answer from memory
+            while the device's stream has updated within this many seconds
+        :param metrics: FloMetrics receiving per-request measurements (default none)
+        :param api_base: base URL of the Flo v2 API (e.g. a local FloStubServer of
+            benchmarks/flostub.py)
+        :param auth_url: URL of the Flo authentication endpoint
+        :param firestore_backend: FirestoreBackend real-time listeners connect with
+            (e.g. the FakeFirestore of benchmarks/flostub.py)
+        :param session: requests.Session to send requests with, which may be shared by
+            many clients since auth headers are sent per request (see AccountPool)
+        :param concurrency_limits: semaphores each request holds while in flight
+        :param login_limiter: RateLimiter spacing out password logins
+        :param http_cache: HttpCache revalidating GET responses with ETag and
+            Last-Modified instead of downloading them again (default none)
+        :param leak_detector: LeakDetector evaluating telemetry() results and
+            real-time listener snapshots (it closes valves through this client)
         :returns PyFlo base object
         """
-        self._session = requests.Session()
-        self._headers = {}
+        self._api_base = api_base
+        self._auth_url = auth_url
+        self._firestore_backend = firestore_backend
+        self._session = session
+        if session is None:
+            self._session = requests.Session()
+            # pool as many connections as threads may use at once (e.g. bulk commands)
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=FLO_MAX_CONCURRENCY)
+            self._session.mount("https://", adapter)
+            self._session.mount("http://", adapter)
+        self._concurrency_limits = tuple(concurrency_limits)
+        self._login_limiter = login_limiter
+        self._http_cache = http_cache
+        self._headers = _BASE_HEADERS
+        self._transport_settings = {}  # host -> (send() settings, auth)
+        self._device_cache = DeviceCache(ttl=device_cache_ttl)
+        self._device_index = DeviceIndex()
         self.clear_cache()
 
         self._auth_token = None
+        self._auth_token_expiry = 0
+        self._user_id = None
         self._username = username
         self._password = None  # call save_password() if you want to save it
-
-        self.login_with_password(password)
+        self._initial_password = None
+        self._token_store = token_store if token_store is not None else FileTokenStore()
+        self._token_key = token_key(auth_url, username)
+        self._refresh_in_background = refresh_in_background
+        self._refresh_timer = None
+        self._retry_policy = retry_policy or RetryPolicy()
+        self._retry_budget = retry_budget or RetryBudget()
+        self._breakers = {}  # endpoint template -> CircuitBreaker
+        self._listener_manager = None
+        self._telemetry_history = telemetry_history
+        self._leak_detector = leak_detector
+        if leak_detector is not None and leak_detector.flo is None:
+            leak_detector.flo = self
+        self._stream_staleness = stream_staleness
+        self._metrics = metrics
+
+        if self._load_token():
+            self._initial_password = password  # discarded after the first login
+        else:
+            self.login_with_password(password)
 
     def __repr__(self):
         """Object representation."""
         return "<{0}: {1}>".format(self.__class__.__name__, self._username)
 
     def login(self):
-        if self._password:
-            self.login_with_password(self._password)
+        password = self._password or self._initial_password
+        if password:
+            self._initial_password = None
+            self.login_with_password(password)
 
     def save_password(self, password):
         """Client can save password to enable automatic reauthentication"""
         self._password = password
+        self._schedule_refresh()
+
+    def close(self):
+        """Stop refreshing the auth token in the background."""
+        if self._refresh_timer:
+            self._refresh_timer.cancel()
+            self._refresh_timer = None
+
+    def _load_token(self):
+        """Adopt the stored token for this account if it does not need refreshing yet"""
+        token_info = self._token_store.load(self._token_key)
+        if not token_info or token_info.get("token") == self._auth_token:
+            return False
+        if time.time() >= refresh_time(token_info) - FLO_TOKEN_REFRESH_MARGIN:
+            return False
+        self._set_token(token_info)
+        return True
+
+    def _forget_token(self):
+        """Drop the stored token if it is the one the server rejected (rather than one
+        another client or process has saved since)"""
+        token_info = self._token_store.load(self._token_key)
+        if token_info and token_info.get("token") == self._auth_token:
+            self._token_store.clear(self._token_key)
+
+    def _set_token(self, token_info):
+        self._auth_token = token_info["token"]
+        self._headers = _client_headers(self._auth_token)
+        self._auth_token_expiry = refresh_time(token_info)
+        self._user_id = token_info["user_id"]
+        self._schedule_refresh()
+
+    def _schedule_refresh(self):
+        if not self._refresh_in_background or not self._password:
+            return
+        if self._refresh_timer:
+            self._refresh_timer.cancel()
+
+        delay = self._auth_token_expiry - FLO_TOKEN_REFRESH_MARGIN - time.time()
+        self._refresh_timer = threading.Timer(max(delay, 0), self._refresh_token)
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+
+    def _refresh_token(self):
+        """Replace the auth token before it expires, reusing one another client or
+        process already refreshed if possible."""
+        timer = self._refresh_timer
+        try:
+            with self._token_store.lock():
+                if not self._load_token():
+                    self.login()
+        except Exception as e:
+            LOG.error(f"Failed refreshing Flo token for {self._username}: {e}")
+
+        # if nothing was rescheduled (e.g. login failed) try again a bit later
+        if self._refresh_timer is timer and self._password:
+            self._refresh_timer = threading.Timer(
+                FLO_TOKEN_REFRESH_MARGIN / 5, self._refresh_token
+            )
+            self._refresh_timer.daemon = True
+            self._refresh_timer.start()
 
     def login_with_password(self, password):
         """Login to the Flo account and generate access token"""
-        self._reset_headers()
-
         # authenticate with user/password
         payload = json.dumps({"username": self._username, "password": password})
 
-        LOG.debug(f"Authenticating Flo account {self._username} via {FLO_AUTH_URL}")
-        response = requests.post(FLO_AUTH_URL, data=payload, headers=self._headers)
+        LOG.debug(
+            "Authenticating Flo account %s via %s", self._username, self._auth_url
+        )
+        if self._login_limiter:
+            self._login_limiter.acquire()
+        response = self._session.post(
+            self._auth_url, data=payload, headers=_BASE_HEADERS
+        )
         # Example response:
         # { "token": "caJhb.....",
         #   "tokenPayload": { "user": { "user_id": "9aab2ced-c495-4884-ac52-b63f3008b6c7", "email": "your@email.com"},
@@ -89,11 +361,9 @@ class PyFlo:
         # LOG.debug("Flo user %s authentication results %s : %s", self._username, FLO_AUTH_URL, json_response)
 
         if "token" in json_response:
-            self._auth_token = json_response["token"]
-            self._auth_token_expiry = time.time() + int(
-                int(json_response["tokenExpiration"]) / 2
-            )
-            self._user_id = json_response["tokenPayload"]["user"]["user_id"]
+            token_info = token_info_from_response(json_response)
+            self._token_store.save(self._token_key, token_info)
+            self._set_token(token_info)
         else:
             LOG.error(f"Failed authenticating Flo user {self._username}")
 
@@ -106,15 +376,24 @@ class PyFlo:
     def user_id(self):
         return self._user_id
 
-    def _reset_headers(self):
-        """Reset the headers and params."""
-        self._headers = {
-            "User-Agent": FLO_USER_AGENT,
-            "Content-Type": "application/json;charset=UTF-8",
-            "Accept": "application/json",
-            "authorization": self._auth_token,
-        }
-        self.__params = {}
+    def _transport(self, url):
+        """Return (send() settings, auth) for requests to the host of url.
+
+        requests.Session.request() resolves proxies and CA bundles from the
+        environment, and credentials from netrc, on every call, which costs more than
+        the rest of query() together. They are resolved once per host instead, so
+        changes to the environment apply to clients created afterwards."""
+        host = urlsplit(url).netloc
+        transport = self._transport_settings.get(host)
+        if transport is None:
+            session = self._session
+            settings = session.merge_environment_settings(url, {}, None, None, None)
+            settings.update(timeout=None, allow_redirects=True)
+            auth = None
+            if session.trust_env and not session.auth:
+                auth = requests.utils.get_netrc_auth(url) or _no_auth
+            transport = self._transport_settings.setdefault(host, (settings, auth))
+        return transport
 
     def query(
         self,
@@ -124,78 +403,206 @@ class PyFlo:
         extra_headers=None,
         retry=3,
         force_login=True,
+        decode=True,
+        revalidate=False,
     ):
         """
-        Returns a JSON object for an HTTP request (no caching included)
+        Returns a JSON object for an HTTP request
         :param url: API URL
         :param method: Specify the method GET, POST or PUT (default=POST)
         :param extra_params: Dictionary to be appended on request.body
         :param extra_headers: Dictionary to be apppended on request.headers
         :param retry: Retry attempts for the query (default=3)
+        :param decode: if False, return the raw JSON bytes (e.g. for pyflowater.models)
+        :param revalidate: with an http_cache, check a cached GET response with the
+            server even if it is still fresh
+
+        If the client has an http_cache, GET responses are cached per user, URL and
+        params. A response still fresh under its Cache-Control max-age is returned
+        without a request; otherwise the request is made conditional with the cached
+        ETag (If-None-Match) and Last-Modified (If-Modified-Since), and a 304 Not
+        Modified is answered from the cache. PUT and POST are never cached.
+
+        Retries back off exponentially with jitter (honoring Retry-After) and stop once
+        the client's retry budget is spent. A 401 triggers one re-authentication.
+        Raises CircuitOpenError while the endpoint's circuit breaker is open.
         """
-        response = None
-        self._reset_headers()  # ensure the headers and params are reset to the bare minimum
+        if method not in (METHOD_GET, METHOD_PUT, METHOD_POST):
+            LOG.error("Invalid request method: %s", method)
+            return None
 
         if force_login and not self.is_connected:
-            self.login()
+            # normally the background refresh keeps the token current; this is only
+            # reached without a saved password or if refreshing failed
+            with self._token_store.lock():
+                if not self._load_token():
+                    self.login()
+
+        endpoint = endpoint_template(url)
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            breaker = self._breakers.setdefault(endpoint, CircuitBreaker())
+        self._retry_budget.record_request()
+
+        cache = self._http_cache if method == METHOD_GET else None
+        cached = None
+        if cache is not None:
+            cache_key = cache.key(self._user_id, url, extra_params)
+            (cached, fresh) = cache.lookup(cache_key, revalidate)
+            if fresh:
+                return cached.body if not decode else loads(cached.body)
+
+        if method == METHOD_GET:
+            (params, body) = (extra_params, None)
+        else:
+            (params, body) = (None, extra_params if extra_params is not None else {})
+        (settings, auth) = self._transport(url)
+        session = self._session
 
+        metrics = self._metrics
+        debug = LOG.isEnabledFor(logging.DEBUG)
+        reauthenticated = False
         loop = 0
         while loop <= retry:
             loop += 1
 
-            # override request.body or request.headers dictionary
-            params = {}
-            if extra_params:
-                params.update(extra_params)
+            if not breaker.allow():
+                if metrics is not None:
+                    metrics.circuit_open(method, endpoint)
+                raise CircuitOpenError(
+                    f"{endpoint} is failing, not retrying for {breaker.retry_in:.0f}s"
+                )
 
+            # the client's headers are shared and immutable; merge into a new dict
             headers = self._headers
-            if extra_headers:
-                headers.update(extra_headers)
+            if extra_headers or cached is not None:
+                headers = {**headers, **(extra_headers or {})}
+                if cached is not None:
+                    headers.update(cache.conditional_headers(cached))
 
-            LOG.debug("Query: %s %s (attempt %s/%s)", method, url, loop, retry)
-            LOG.debug("... Params: %s", params)
-            LOG.debug("... Headers: %s", headers)
+            if debug:
+                LOG.debug("Query: %s %s (attempt %s/%s)", method, url, loop, retry)
+                LOG.debug("... Params: %s", extra_params)
+                LOG.debug("... Headers: %s", headers)
 
             # define connection method
             response = None
-            if method == METHOD_GET:
-                response = self._session.get(url, headers=headers, params=extra_params)
-            elif method == METHOD_PUT:
-                response = self._session.put(url, headers=headers, json=params)
-            elif method == METHOD_POST:
-                response = self._session.post(url, headers=headers, json=params)
-            else:
-                LOG.error(f"Invalid request method: {method}")
-                return None
-
-            if response.status_code == 200:
-                json = response.json()
-                LOG.debug(f"Received from {method} {url}: %s", json)
-                return json
+            retry_after = None
+            for limit in self._concurrency_limits:
+                limit.acquire()
+            if metrics is not None:
+                start = time.perf_counter()
+            try:
+                try:
+                    request = requests.Request(
+                        method, url, headers, params=params, json=body, auth=auth
+                    )
+                    response = session.send(
+                        session.prepare_request(request), **settings
+                    )
+                finally:
+                    for limit in self._concurrency_limits:
+                        limit.release()
+            except requests.RequestException as e:
+                breaker.record_failure()
+                LOG.debug("Failed %s %s: %s", method, url, e)
+                if metrics is not None:
+                    metrics.request(
+                        method, endpoint, None, time.perf_counter() - start, 0
+                    )
+                if loop > retry or not self._retry_budget.try_spend():
+                    raise
+                if metrics is not None:
+                    metrics.retry(method, endpoint, None)
             else:
-                LOG.debug(
-                    f"Received from {method} {url} code {response.status_code}: %s",
-                    response,
-                )
-
+                status = response.status_code
+                if metrics is not None:
+                    metrics.request(
+                        method,
+                        endpoint,
+                        status,
+                        time.perf_counter() - start,
+                        len(response.content),
+                    )
+
+                if status == 304 and cached is not None:
+                    breaker.record_success()
+                    cache.not_modified(cache_key, cached, response)
+                    return cached.body if not decode else loads(cached.body)
+
+                if status == 200:
+                    breaker.record_success()
+                    if cache is not None:
+                        cache.store(cache_key, response)
+                    if not decode:
+                        return response.content
+                    json = loads(response.content)
+                    if debug:
+                        LOG.debug("Received from %s %s: %s", method, url, json)
+                    return json
+
+                LOG.debug("Received from %s %s code %s", method, url, status)
+                if status == 401 and force_login and not reauthenticated:
+                    # token was rejected (e.g. revoked); log in again once and retry.
+                    # The endpoint is up, which also resolves a half-open trial so the
+                    # retry is let through.
+                    reauthenticated = True
+                    breaker.record_success()
+                    self._auth_token_expiry = 0
+                    with self._token_store.lock():
+                        self._forget_token()
+                        if not self._load_token():
+                            self.login()
+                    if metrics is not None:
+                        metrics.reauth(method, endpoint)
+                    continue
+
+                if not self._retry_policy.is_retryable(status):
+                    breaker.record_success()  # the endpoint is up, the request was bad
+                    break
+                breaker.record_failure()
+                if not self._retry_budget.try_spend():
+                    LOG.warning(
+                        "Retry budget exhausted, not retrying %s %s", method, url
+                    )
+                    break
+                if loop <= retry and metrics is not None:
+                    metrics.retry(method, endpoint, status)
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+
+            if loop <= retry:
+                time.sleep(self._retry_policy.delay(loop, retry_after))
+
+        LOG.warning("Failed %s %s after %s attempt(s)", method, endpoint, loop)
         return None
 
     def clear_cache(self):
         self._cached_data = None
         self._cached_locations = {}
+        self._device_cache.invalidate()
+
+    def invalidate_device(self, device_id=None):
+        """Drop the cached snapshot for device_id (or all devices if None)"""
+        self._device_cache.invalidate(device_id)
 
     def data(self, use_cached=True):
+        """Return the user and its expanded locations. With use_cached=False the
+        response is fetched again (revalidated, if there is an http_cache)."""
         if not self._cached_data or use_cached == False:
             # https://api-gw.meetflo.com/api/v2/users/<userId>?expand=locations
-            url = f"{FLO_V2_API_BASE}/users/{self._user_id}?expand=locations"
-            self._cached_data = self.query(url, method="GET")
+            url = f"{self._api_base}/users/{self._user_id}?expand=locations"
+            self._cached_data = self.query(url, method="GET", revalidate=not use_cached)
+            if self._cached_data:
+                self._device_index.rebuild(self._cached_data.get("locations"))
+                DEVICE_ID_TO_LOCATION_MAC_TUPLE.update(
+                    self._device_index.location_macs()
+                )
         return self._cached_data
 
     def alarms(self, use_cached=False):
         """Get all alarms for the Flo account"""
-        url = f"{FLO_V2_API_BASE}/alarms"
-        data = self.query(url, method=METHOD_GET)
-        return data.json()
+        url = f"{self._api_base}/alarms"
+        return self.query(url, method=METHOD_GET)
 
     def locations(self, use_cached=True):
         """Return all locations registered with the Flo account."""
@@ -206,8 +613,8 @@ class PyFlo:
         """Return details on all devices at a location"""
         # NOTE: since we always expand locations on the overall data, we could skip this call
         if not location_id in self._cached_locations or use_cached == False:
-            url = f"{FLO_V2_API_BASE}/locations/{location_id}?expand=devices"
-            data = self.query(url, method=METHOD_GET)
+            url = f"{self._api_base}/locations/{location_id}?expand=devices"
+            data = self.query(url, method=METHOD_GET, revalidate=not use_cached)
             if not data:
                 LOG.warning(f"Failed to load data from {url}")
                 return None
@@ -220,77 +627,188 @@ class PyFlo:
 
     def run_health_test(self, device_id):
         """Run the health test for the specified Flo device"""
-        url = f"{FLO_V2_API_BASE}/devices/{device_id}/healthTest/run"
+        url = f"{self._api_base}/devices/{device_id}/healthTest/run"
         return self.query(url, method=METHOD_POST)
 
-    def device(self, device_id):
-        url = f"{FLO_V2_API_BASE}/devices/{device_id}"
-        data = self.query(url, method=METHOD_GET)
-        return data
+    def device(self, device_id, use_cached=True):
+        """Return details for a device, reusing a snapshot younger than the cache TTL.
+        Concurrent calls for the same device share a single request."""
+        if use_cached == False:
+            self._device_cache.invalidate(device_id)
+            return self._device_cache.fetch(device_id, self._refetch_device)
+        return self._device_cache.fetch(device_id, self._fetch_device)
+
+    def _fetch_device(self, device_id, revalidate=False):
+        url = f"{self._api_base}/devices/{device_id}"
+        return self.query(url, method=METHOD_GET, revalidate=revalidate)
+
+    def _refetch_device(self, device_id):
+        return self._fetch_device(device_id, revalidate=True)
+
+    def streamed_device(self, device_id, key):
+        """Return the device state kept current by a healthy real-time listener if it
+        includes key, or None if the state must be fetched over HTTP (always None
+        unless the client was created with stream_staleness)"""
+        if not self._stream_staleness:
+            return None
+        data = self._device_cache.get_streamed(device_id, self._stream_staleness)
+        if data and key in data:
+            return data
+        return None
 
     def preset_mode(self, device_id):
-        data = self.device(device_id)
+        data = self.streamed_device(device_id, "systemMode")
+        if not data or "target" not in data["systemMode"]:
+            data = self.device(device_id)
         systemMode = data["systemMode"]
         return systemMode["target"]
 
+    @property
+    def telemetry_history(self):
+        """TelemetryHistory fed by telemetry() and real-time listeners, or None"""
+        return self._telemetry_history
+
+    @property
+    def leak_detector(self):
+        """LeakDetector fed by telemetry() and real-time listeners, or None"""
+        return self._leak_detector
+
     def telemetry(self, device_id):
-        data = self.device(device_id)
+        data = self.streamed_device(device_id, "telemetry") or self.device(device_id)
         telemetry = data["telemetry"]
+        if self._telemetry_history is not None:
+            self._telemetry_history.record(device_id, telemetry["current"])
+        if self._leak_detector is not None:
+            self._leak_detector.record_snapshot(device_id, data)
         return telemetry["current"]
 
     def valve_status(self, device_id):
-        data = self.device(device_id)
+        data = self.streamed_device(device_id, "valve") or self.device(device_id)
         valve = data["valve"]
         return valve["lastKnown"]
 
     def open_valve(self, device_id):
-        LOG.debug(f"Opening valve for device {device_id}")
-        url = f"{FLO_V2_API_BASE}/devices/{device_id}"
-        self.query(url, extra_params={"valve": {"target": "open"}}, method=METHOD_POST)
+        LOG.debug("Opening valve for device %s", device_id)
+        url = f"{self._api_base}/devices/{device_id}"
+        result = self.query(
+            url, extra_params={"valve": {"target": "open"}}, method=METHOD_POST
+        )
+        # the valve takes a while to actuate, so refetch rather than guess lastKnown
+        self._device_cache.invalidate(device_id)
+        return result
 
     def close_valve(self, device_id):
-        LOG.debug(f"Closing valve for device {device_id}")
-        url = f"{FLO_V2_API_BASE}/devices/{device_id}"
-        self.query(
+        LOG.debug("Closing valve for device %s", device_id)
+        url = f"{self._api_base}/devices/{device_id}"
+        result = self.query(
             url, extra_params={"valve": {"target": "closed"}}, method=METHOD_POST
         )
+        self._device_cache.invalidate(device_id)
+        return result
 
     def set_mode(self, location_id: str, mode: str, additional_params={}):
-        url = f"{FLO_V2_API_BASE}/locations/{location_id}/systemMode"
+        url = f"{self._api_base}/locations/{location_id}/systemMode"
+        params = _mode_params(mode, additional_params)
+        result = self.query(url, extra_params=params, method=METHOD_POST)
+        if result is not None:
+            self._device_cache.update_location(
+                location_id,
+                {"systemMode": {"target": mode}},
+                self._device_index.devices_at_location(location_id),
+            )
+        return result
+
+    def alerts(self, location_id):
+        """Return all triggered warning and critical alerts for a location, as
+        {"items": [...], "page": 1, "total": n}, or None if they could not be loaded"""
+        try:
+            items = list(self.iter_alerts(location_id, prefetch=False))
+        except FloError as e:
+            LOG.warning(f"Failed loading alerts for {location_id}: {e}")
+            return None
+        return {"items": items, "page": 1, "total": len(items)}
 
-        params = {"target": mode}
-        if mode == "sleep":
-            # Number of minutes to sleep (120=2 hours, 480=8 hours)
-            params["revertMinutes"] = 480
-            # Mode to set after sleep concludes ("away" or "home")
-            params["revertMode"] = "home"
+    def iter_alerts(
+        self,
+        location_ids=None,
+        severities=ALERT_SEVERITIES,
+        status="triggered",
+        page_size=ALERT_PAGE_SIZE,
+        prefetch=True,
+    ):
+        """Yield alerts lazily, newest first, a page at a time. While the caller
+        processes one page the next is fetched in the background (unless prefetch is
+        False). Raises FloError if a page fails to load, rather than ending early.
+        :param location_ids: location_id or list of them (default: every location)
+        :param severities: severity or list of them ("info", "warning", "critical")
+        :param status: alert status to filter on (None for any)
+        """
+        (location_ids, severities) = self._alert_filters(location_ids, severities)
+        if not location_ids:
+            return iter(())
+        url = f"{self._api_base}/alerts"
+
+        def fetch_page(page):
+            params = alert_params(location_ids, severities, status, page, page_size)
+            data = self.query(url, method=METHOD_GET, extra_params=params)
+            if data is None:
+                raise FloError(f"Failed to load page {page} of {url}")
+            return data
 
-        if additional_params:
-            params = {**params, **additional_params}
-        self.query(url, extra_params=params, method=METHOD_POST)
+        return paginate(fetch_page, page_size, prefetch)
+
+    def new_alerts(self, cursor, location_ids=None, **kwargs):
+        """Return the alerts not yet seen by cursor (an AlertCursor), newest first, and
+        advance it. Paging stops once alerts older than the cursor are reached, so
+        repeated sweeps across all locations only fetch what is new. Accepts the
+        iter_alerts() filters; the cursor is unchanged if a page fails to load."""
+        (location_ids, _) = self._alert_filters(location_ids, ())
+        since = cursor.since(location_ids)
+        new = []
+        for alert in self.iter_alerts(location_ids, **kwargs):
+            created = alert_time(alert)
+            if since is not None and created is not None and created < since:
+                break
+            if cursor.is_new(alert):
+                new.append(alert)
+        for alert in new:
+            cursor.advance(alert)
+        return new
+
+    def _alert_filters(self, location_ids, severities):
+        if location_ids is None:
+            location_ids = [location["id"] for location in self.locations()]
+        return _alert_filters(location_ids, severities)
 
-    def alerts(self, location_id):
-        """Return alerts for a location"""
-
-        params = {
-            "isInternalAlarm": "false",
-            "locationId": location_id,
-            "status": "triggered",
-            "severity": "warning",
-            "severity": "critical",
-            "page": 1,
-            "size": 100,
-        }
-        url = f"{FLO_V2_API_BASE}/alerts"
-        return self.query(url, method="GET", extra_params=params)
+    @property
+    def device_index(self):
+        """DeviceIndex of all devices in the account (built by data())"""
+        return self._device_index
+
+    def location_mac_for_device(self, device_id):
+        """Return (location_id, mac_address) for device_id, or None if unknown"""
+        if not self._cached_data:
+            self.data()
+        return self._device_index.location_mac(device_id)
+
+    def device_id_for_mac(self, mac_address):
+        """Return the device_id with the given MAC address, or None if unknown"""
+        if not self._cached_data:
+            self.data()
+        return self._device_index.device_for_mac(mac_address)
+
+    def device_ids_for_location(self, location_id):
+        """Return the device_ids installed at location_id"""
+        if not self._cached_data:
+            self.data()
+        return self._device_index.devices_at_location(location_id)
 
     def _get_locid_mac(self, device_id):
         """Find the location_id and MAC address for device_id"""
-        for location in self.locations():
-            for device in location["devices"]:
-                if device["id"] == device_id:
-                    return (location["id"], device["macAddress"])
-        raise FloError(f"no device with id {device_id}")
+        locid_mac = self.location_mac_for_device(device_id)
+        if locid_mac is None:
+            raise FloError(f"no device with id {device_id}")
+        return locid_mac
 
     def consumption(
         self, device_id, startDate=None, endDate=None, interval=INTERVAL_HOURLY
@@ -299,35 +817,27 @@ class PyFlo:
         (tzinfo is None), they are assumed to represent local time of the running system."""
 
         (location_id, mac_address) = self._get_locid_mac(device_id)
+        params = _consumption_params(
+            location_id, mac_address, startDate, endDate, interval
+        )
 
-        # calculate since beginning of day in LOCAL timezone
-        now = datetime.now()
-        if not startDate:
-            startDate = now.replace(hour=0, minute=0, second=0, microsecond=0)
-
-        if not endDate:
-            # Flo website queries for current data sets end timestamp as the last millisecond of the day, so do the same
-            endDate = now.replace(hour=23, minute=59, second=59, microsecond=999999)
-
-        # in a python 3.6-or-later world we could use startDate_utc = startDate.astimezone(timezone.utc).
-        # note that fromtimestamp(timestamp()) only works for times supported by the system gmtime().
-        # see https://docs.python.org/3/library/datetime.html#datetime.datetime.fromtimestamp
-        startDate_utc = datetime.fromtimestamp(startDate.timestamp(), timezone.utc)
-        endDate_utc = datetime.fromtimestamp(endDate.timestamp(), timezone.utc)
-
-        # in python 3.6 and later, consider startDate.isoformat(timespec='milliseconds')
-        params = {
-            "locationId": location_id,
-            "macAddress": mac_address,
-            "startDate": startDate_utc.strftime(FLO_TIME_FORMAT) + "Z",
-            "endDate": endDate_utc.strftime(FLO_TIME_FORMAT) + "Z",
-            "interval": interval,
-        }
+        url = f"{self._api_base}/water/consumption"
+        return self.query(url, method=METHOD_GET, extra_params=params)
+
+    def water_metrics(
+        self, device_id, startDate=None, endDate=None, interval=INTERVAL_HOURLY
+    ):
+        """Return the telemetry history of a device: items of averageGpm, averagePsi
+        and averageTempF per interval. Dates are handled as by consumption()."""
+        (_, mac_address) = self._get_locid_mac(device_id)
+        params = _metrics_params(mac_address, startDate, endDate, interval)
 
-        url = f"{FLO_V2_API_BASE}/water/consumption"
+        url = f"{self._api_base}/water/metrics"
         return self.query(url, method=METHOD_GET, extra_params=params)
 
-    def get_real_time_listener(self, device_id, callback, heartbeat=True):
+    def get_real_time_listener(
+        self, device_id, callback, heartbeat=True, dispatcher=None
+    ):
         """Begin listening for the specified device, sending results to the specified callback.
 
               Callback is a function that accepts a single argument containing the dictionary returned by the Flo service, of the form:
@@ -344,6 +854,10 @@ class PyFlo:
               Streaming telemetry (especially in the inefficient way Flo does it) is
               costly, so please don't do this willy-nilly or they will shut us off.
 
+              If a TelemetryDispatcher is given, snapshots are delivered through it
+              (off the firestore thread, as delta events keyed by device_id) instead
+              of to callback.
+
               Returns a FloListener. You must call start() on the returned
               instance to begin receiving callbacks.
 
@@ -351,23 +865,480 @@ class PyFlo:
         # we issue one heartbeat initially even if we won't issue any later,
         # since presumably we want one callback with the current data.
         self._do_heartbeat()
-        url = f"{FLO_V2_API_BASE}/session/firestore"
+        token = self._firestore_token()
+        (location_id, mac_address) = self._get_locid_mac(device_id)
+        return FloListener(
+            heartbeat and self._do_heartbeat,
+            token,
+            mac_address,
+            callback,
+            dispatcher,
+            self._snapshot_observers(),
+            device_id,
+            self._firestore_backend,
+        )
+
+    def get_listener_manager(self, heartbeat=True, dispatcher=None):
+        """Return the FloListenerManager for this account, which streams any number of
+        devices over one firestore client and one heartbeat. Subscribe devices with
+        manager.subscribe(device_id, callback); see get_real_time_listener() for the
+        callback argument and the costs of heartbeats. The dispatcher (a
+        TelemetryDispatcher) only applies when the manager is first created."""
+        if self._listener_manager is None:
+            self._listener_manager = FloListenerManager(
+                heartbeat and self._do_heartbeat,
+                self._firestore_token,
+                lambda device_id: self._get_locid_mac(device_id)[1],
+                dispatcher,
+                self._snapshot_observers(),
+                self._firestore_backend,
+            )
+        return self._listener_manager
+
+    def _snapshot_observers(self):
+        """Objects fed every real-time listener snapshot"""
+        observers = []
+        if self._telemetry_history is not None:
+            observers.append(self._telemetry_history)
+        if self._leak_detector is not None:
+            observers.append(self._leak_detector)
+        if self._stream_staleness:
+            observers.append(self._device_cache)
+        return observers
+
+    @retry(DataNotObtained, tries=3, delay=0.1)
+    def _firestore_token(self):
+        """Return a custom token for authenticating with Flo's firestore database"""
+        url = f"{self._api_base}/session/firestore"
+        try:
+            data = self.query(url, method=METHOD_POST)
+        except Exception as e:
+            raise DataNotObtained(f"Failed to load data from {url}: {e}")
+        if data == None:
+            raise DataNotObtained(f"Failed to load data from {url}: No Data")
+        return data["token"]
+
+    def _do_heartbeat(self):
+        self.query(f"{self._api_base}/presence/me", method=METHOD_POST)
+
+
+class AsyncPyFlo:
+    """Asyncio object for Flo.
+
+    All requests share a single pooled keep-alive connection to the Flo cloud, with at
+    most max_concurrency requests in flight at once. Requires aiohttp
+    (pip install pyflowater[async])."""
+
+    def __init__(
+        self,
+        username,
+        password=None,
+        session=None,
+        max_concurrency=FLO_MAX_CONCURRENCY,
+        device_cache_ttl=FLO_DEVICE_CACHE_TTL,
+        api_base=FLO_V2_API_BASE,
+        auth_url=FLO_AUTH_URL,
+        retry_policy=None,
+        retry_budget=None,
+    ):
+        """Create an AsyncPyFlo object. Authentication is deferred until the first
+        request (or an explicit call to login_with_password()).
+        :param username: Flo user email
+        :param password: Flo user password
+        :param session: optional aiohttp.ClientSession to share with the caller
+        :param max_concurrency: maximum number of concurrent requests to the Flo cloud
+        :param device_cache_ttl: seconds device() snapshots are reused (0 to disable)
+        :param api_base: base URL of the Flo v2 API
+        :param auth_url: URL of the Flo authentication endpoint
+        :param retry_policy: RetryPolicy deciding backoff between query() attempts
+        :param retry_budget: RetryBudget capping retries across all queries
+        :returns AsyncPyFlo base object
+        """
+        self._api_base = api_base
+        self._auth_url = auth_url
+        self._session = session
+        self._owns_session = session is None
+        self._max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._login_lock = asyncio.Lock()
+        self._retry_policy = retry_policy or RetryPolicy()
+        self._retry_budget = retry_budget or RetryBudget()
+        self._device_cache = DeviceCache(ttl=device_cache_ttl)
+        self._device_index = DeviceIndex()
+        self.clear_cache()
+
+        self._auth_token = None
+        self._auth_token_expiry = 0
+        self._headers = _BASE_HEADERS
+        self._user_id = None
+        self._username = username
+        self._password = None  # call save_password() if you want to save it
+        self._initial_password = password  # discarded after the first login
+
+    def __repr__(self):
+        """Object representation."""
+        return "<{0}: {1}>".format(self.__class__.__name__, self._username)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """Close the underlying HTTP session, if owned by this client."""
+        if self._session and self._owns_session:
+            await self._session.close()
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            import aiohttp
+
+            connector = aiohttp.TCPConnector(
+                limit=self._max_concurrency, keepalive_timeout=FLO_KEEPALIVE_TIMEOUT
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._owns_session = True
+        return self._session
+
+    async def login(self):
+        password = self._password or self._initial_password
+        if password:
+            self._initial_password = None
+            await self.login_with_password(password)
 
-        @retry(DataNotObtained, tries=3, delay=0.1)
-        def getdata(url):
+    def save_password(self, password):
+        """Client can save password to enable automatic reauthentication"""
+        self._password = password
+
+    async def login_with_password(self, password):
+        """Login to the Flo account and generate access token"""
+        payload = {"username": self._username, "password": password}
+
+        LOG.debug(
+            "Authenticating Flo account %s via %s", self._username, self._auth_url
+        )
+        async with self._semaphore:
+            async with self._get_session().post(
+                self._auth_url, json=payload, headers=_BASE_HEADERS
+            ) as response:
+                json_response = await response.json(content_type=None)
+
+        if json_response and "token" in json_response:
+            self._auth_token = json_response["token"]
+            self._headers = _client_headers(self._auth_token)
+            self._auth_token_expiry = time.time() + int(
+                int(json_response["tokenExpiration"]) / 2
+            )
+            self._user_id = json_response["tokenPayload"]["user"]["user_id"]
+        else:
+            LOG.error(f"Failed authenticating Flo user {self._username}")
+
+    async def _ensure_login(self):
+        if not self.is_connected:
+            # only one coroutine logs in, the rest wait for the new token
+            async with self._login_lock:
+                if not self.is_connected:
+                    await self.login()
+
+    @property
+    def is_connected(self):
+        """Connection status of client with Flo cloud service."""
+        return bool(self._auth_token) and time.time() < self._auth_token_expiry
+
+    @property
+    def user_id(self):
+        return self._user_id
+
+    async def query(
+        self,
+        url,
+        method=METHOD_POST,
+        extra_params=None,
+        extra_headers=None,
+        retry=3,
+        force_login=True,
+    ):
+        """
+        Returns a JSON object for an HTTP request (no caching included)
+        :param url: API URL
+        :param method: Specify the method GET, POST or PUT (default=POST)
+        :param extra_params: Dictionary to be appended on request.body
+        :param extra_headers: Dictionary to be apppended on request.headers
+        :param retry: Retry attempts for the query (default=3)
+
+        Retries back off as in PyFlo.query() and a 401 triggers one
+        re-authentication. Returns None once the request has failed for good, so that
+        one failing device does not fail an asyncio.gather() of many.
+        """
+        if method not in (METHOD_GET, METHOD_PUT, METHOD_POST):
+            LOG.error("Invalid request method: %s", method)
+            return None
+
+        if force_login:
+            await self._ensure_login()
+
+        if method == METHOD_GET:
+            kwargs = {"params": extra_params}
+        else:
+            kwargs = {"json": extra_params or {}}
+
+        session = self._get_session()
+        # aiohttp is an optional dependency, already imported by _get_session()
+        import aiohttp
+
+        self._retry_budget.record_request()
+        debug = LOG.isEnabledFor(logging.DEBUG)
+        reauthenticated = False
+        loop = 0
+        while loop <= retry:
+            loop += 1
+            if debug:
+                LOG.debug("Query: %s %s (attempt %s/%s)", method, url, loop, retry)
+
+            token = self._auth_token
+            headers = self._headers
+            if extra_headers:
+                headers = {**headers, **extra_headers}
+
+            retry_after = None
             try:
-                data = self.query(url, method=METHOD_POST)
-            except Exception as e:
-                raise DataNotObtained(f"Failed to load data from {url}: {e}")
-            if data == None:
-                raise DataNotObtained(f"Failed to load data from {url}: No Data")
+                async with self._semaphore:
+                    async with session.request(
+                        method, url, headers=headers, **kwargs
+                    ) as response:
+                        status = response.status
+                        if status == 200:
+                            json = loads(await response.read())
+                            if debug:
+                                LOG.debug("Received from %s %s: %s", method, url, json)
+                            return json
+                        retry_after = parse_retry_after(
+                            response.headers.get("Retry-After")
+                        )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                LOG.debug("Failed %s %s: %s", method, url, e)
+                if loop > retry or not self._retry_budget.try_spend():
+                    break
+            else:
+                LOG.debug("Received from %s %s code %s", method, url, status)
+                if status == 401 and force_login and not reauthenticated:
+                    # token was rejected (e.g. revoked); log in again once and retry,
+                    # unless another coroutine already replaced it
+                    reauthenticated = True
+                    if self._auth_token == token:
+                        self._auth_token_expiry = 0
+                    await self._ensure_login()
+                    continue
+
+                if not self._retry_policy.is_retryable(status):
+                    break
+                if not self._retry_budget.try_spend():
+                    LOG.warning(
+                        "Retry budget exhausted, not retrying %s %s", method, url
+                    )
+                    break
+
+            if loop <= retry:
+                await asyncio.sleep(self._retry_policy.delay(loop, retry_after))
+
+        LOG.warning(
+            "Failed %s %s after %s attempt(s)", method, endpoint_template(url), loop
+        )
+        return None
+
+    def clear_cache(self):
+        self._cached_data = None
+        self._cached_locations = {}
+        self._device_cache.invalidate()
+
+    def invalidate_device(self, device_id=None):
+        """Drop the cached snapshot for device_id (or all devices if None)"""
+        self._device_cache.invalidate(device_id)
+
+    async def data(self, use_cached=True):
+        if not self._cached_data or use_cached == False:
+            await self._ensure_login()
+            url = f"{self._api_base}/users/{self._user_id}?expand=locations"
+            self._cached_data = await self.query(url, method=METHOD_GET)
+            if self._cached_data:
+                self._device_index.rebuild(self._cached_data.get("locations"))
+                DEVICE_ID_TO_LOCATION_MAC_TUPLE.update(
+                    self._device_index.location_macs()
+                )
+        return self._cached_data
+
+    async def locations(self, use_cached=True):
+        """Return all locations registered with the Flo account."""
+        data = await self.data(use_cached=use_cached)
+        return data["locations"]
+
+    async def location(self, location_id, use_cached=True):
+        """Return details on all devices at a location"""
+        if not location_id in self._cached_locations or use_cached == False:
+            url = f"{self._api_base}/locations/{location_id}?expand=devices"
+            data = await self.query(url, method=METHOD_GET)
+            if not data:
+                LOG.warning(f"Failed to load data from {url}")
+                return None
+            self._cached_locations[location_id] = data
+
+        return self._cached_locations.get(location_id)
+
+    async def device(self, device_id, use_cached=True):
+        """Return details for a device, reusing a snapshot younger than the cache TTL.
+        Concurrent calls for the same device share a single request."""
+        if use_cached == False:
+            self._device_cache.invalidate(device_id)
+        return await self._device_cache.async_fetch(device_id, self._fetch_device)
+
+    async def _fetch_device(self, device_id):
+        url = f"{self._api_base}/devices/{device_id}"
+        return await self.query(url, method=METHOD_GET)
+
+    async def devices(self, device_ids):
+        """Return a dictionary of device_id to device details, fetched concurrently"""
+        results = await asyncio.gather(*[self.device(id) for id in device_ids])
+        return dict(zip(device_ids, results))
+
+    async def run_health_test(self, device_id):
+        """Run the health test for the specified Flo device"""
+        url = f"{self._api_base}/devices/{device_id}/healthTest/run"
+        return await self.query(url, method=METHOD_POST)
+
+    async def open_valve(self, device_id):
+        LOG.debug("Opening valve for device %s", device_id)
+        url = f"{self._api_base}/devices/{device_id}"
+        result = await self.query(
+            url, extra_params={"valve": {"target": "open"}}, method=METHOD_POST
+        )
+        self._device_cache.invalidate(device_id)
+        return result
+
+    async def close_valve(self, device_id):
+        LOG.debug("Closing valve for device %s", device_id)
+        url = f"{self._api_base}/devices/{device_id}"
+        result = await self.query(
+            url, extra_params={"valve": {"target": "closed"}}, method=METHOD_POST
+        )
+        self._device_cache.invalidate(device_id)
+        return result
+
+    async def set_mode(self, location_id: str, mode: str, additional_params={}):
+        url = f"{self._api_base}/locations/{location_id}/systemMode"
+        params = _mode_params(mode, additional_params)
+        result = await self.query(url, extra_params=params, method=METHOD_POST)
+        if result is not None:
+            self._device_cache.update_location(
+                location_id,
+                {"systemMode": {"target": mode}},
+                self._device_index.devices_at_location(location_id),
+            )
+        return result
+
+    async def alerts(self, location_id):
+        """Return all triggered warning and critical alerts for a location, as
+        {"items": [...], "page": 1, "total": n}, or None if they could not be loaded"""
+        try:
+            items = [
+                alert async for alert in self.iter_alerts(location_id, prefetch=False)
+            ]
+        except FloError as e:
+            LOG.warning(f"Failed loading alerts for {location_id}: {e}")
+            return None
+        return {"items": items, "page": 1, "total": len(items)}
+
+    async def iter_alerts(
+        self,
+        location_ids=None,
+        severities=ALERT_SEVERITIES,
+        status="triggered",
+        page_size=ALERT_PAGE_SIZE,
+        prefetch=True,
+    ):
+        """Asynchronously yield alerts, newest first; see PyFlo.iter_alerts()"""
+        if location_ids is None:
+            location_ids = [location["id"] for location in await self.locations()]
+        (location_ids, severities) = _alert_filters(location_ids, severities)
+        if not location_ids:
+            return
+        url = f"{self._api_base}/alerts"
+
+        async def fetch_page(page):
+            params = alert_params(location_ids, severities, status, page, page_size)
+            data = await self.query(url, method=METHOD_GET, extra_params=params)
+            if data is None:
+                raise FloError(f"Failed to load page {page} of {url}")
             return data
 
-        data = getdata(url)
-        (location_id, mac_address) = self._get_locid_mac(device_id)
-        return FloListener(
-            heartbeat and self._do_heartbeat, data["token"], mac_address, callback
+        alerts = async_paginate(fetch_page, page_size, prefetch)
+        try:
+            async for alert in alerts:
+                yield alert
+        finally:
+            # abandon any prefetch now rather than when the generator is collected
+            await alerts.aclose()
+
+    async def new_alerts(self, cursor, location_ids=None, **kwargs):
+        """Return the alerts not yet seen by cursor and advance it; see
+        PyFlo.new_alerts()"""
+        if location_ids is None:
+            location_ids = [location["id"] for location in await self.locations()]
+        (location_ids, _) = _alert_filters(location_ids, ())
+        since = cursor.since(location_ids)
+        new = []
+        alerts = self.iter_alerts(location_ids, **kwargs)
+        try:
+            async for alert in alerts:
+                created = alert_time(alert)
+                if since is not None and created is not None and created < since:
+                    break
+                if cursor.is_new(alert):
+                    new.append(alert)
+        finally:
+            await alerts.aclose()
+        for alert in new:
+            cursor.advance(alert)
+        return new
+
+    @property
+    def device_index(self):
+        """DeviceIndex of all devices in the account (built by data())"""
+        return self._device_index
+
+    async def location_mac_for_device(self, device_id):
+        """Return (location_id, mac_address) for device_id, or None if unknown"""
+        if not self._cached_data:
+            await self.data()
+        return self._device_index.location_mac(device_id)
+
+    async def _get_locid_mac(self, device_id):
+        """Find the location_id and MAC address for device_id"""
+        locid_mac = await self.location_mac_for_device(device_id)
+        if locid_mac is None:
+            raise FloError(f"no device with id {device_id}")
+        return locid_mac
+
+    async def consumption(
+        self, device_id, startDate=None, endDate=None, interval=INTERVAL_HOURLY
+    ):
+        """Return consumption data for a given device id. If startDate or endDate are naive
+        (tzinfo is None), they are assumed to represent local time of the running system."""
+        (location_id, mac_address) = await self._get_locid_mac(device_id)
+        params = _consumption_params(
+            location_id, mac_address, startDate, endDate, interval
         )
 
-    def _do_heartbeat(self):
-        self.query(FLO_PRESENCE_HEARTBEAT, method=METHOD_POST)
+        url = f"{self._api_base}/water/consumption"
+        return await self.query(url, method=METHOD_GET, extra_params=params)
+
+    async def water_metrics(
+        self, device_id, startDate=None, endDate=None, interval=INTERVAL_HOURLY
+    ):
+        """Return the telemetry history of a device (see PyFlo.water_metrics())"""
+        (_, mac_address) = await self._get_locid_mac(device_id)
+        params = _metrics_params(mac_address, startDate, endDate, interval)
+
+        url = f"{self._api_base}/water/metrics"
+        return await self.query(url, method=METHOD_GET, extra_params=params)
@@ -0,0 +1,5 @@
+import sys
+
+from pyflowater.cli import main
+
+sys.exit(main())
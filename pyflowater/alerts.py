@@ -0,0 +1,144 @@
+"""Paginated retrieval of Flo alerts.
+
+The /alerts endpoint returns one page ({"items", "page", "total"}) at a time, newest
+alert first. paginate() and async_paginate() yield the items of consecutive pages
+lazily, requesting the next page while the caller is still processing the current
+one. AlertCursor remembers the newest alert seen at each location so that repeated
+sweeps only fetch (and yield) alerts that are new since the last one.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from pyflowater.timeutil import parse_flo_time
+
+ALERT_SEVERITIES = ("warning", "critical")
+ALERT_PAGE_SIZE = 100
+
+
+def alert_params(location_ids, severities, status, page, size):
+    """Build the /alerts query parameters. Multiple locations and severities are sent
+    as repeated parameters, so this returns a list of (name, value) pairs."""
+    params = [("isInternalAlarm", "false")]
+    params.extend(("locationId", location_id) for location_id in location_ids)
+    if status:
+        params.append(("status", status))
+    params.extend(("severity", severity) for severity in severities)
+    params.extend((("page", page), ("size", size)))
+    return params
+
+
+def alert_time(alert):
+    """Epoch seconds an alert was created, or None if unknown"""
+    created = alert.get("createAt") or alert.get("created")
+    if not created:
+        return None
+    try:
+        return parse_flo_time(created)
+    except ValueError:
+        return None
+
+
+def _has_more(response, items, page, size):
+    if len(items) < size:
+        return False
+    total = response.get("total")
+    return total is None or page * size < total
+
+
+def paginate(fetch_page, size, prefetch=True):
+    """Yield the items of pages 1, 2, ... returned by fetch_page(page) until a short
+    or empty page (or the reported total) is reached, or fetch_page returns None.
+
+    With prefetch, page n + 1 is fetched on a background thread while the items of
+    page n are consumed. Closing the generator early abandons any prefetch."""
+    executor = ThreadPoolExecutor(1, "pyflowater-alerts") if prefetch else None
+    upcoming = None
+    try:
+        page = 1
+        response = fetch_page(page)
+        while response:
+            items = response.get("items") or []
+            more = _has_more(response, items, page, size)
+            upcoming = None
+            if more and executor:
+                upcoming = executor.submit(fetch_page, page + 1)
+            yield from items
+            if not more:
+                return
+            page += 1
+            response = upcoming.result() if upcoming else fetch_page(page)
+    finally:
+        if executor:
+            # abandon a prefetch not yet begun (shutdown(cancel_futures=True) needs
+            # Python 3.9)
+            if upcoming:
+                upcoming.cancel()
+            executor.shutdown(wait=False)
+
+
+async def async_paginate(fetch_page, size, prefetch=True):
+    """Asynchronous paginate(): fetch_page(page) is a coroutine function, and the next
+    page is requested in a task while the current one is consumed."""
+    page = 1
+    response = await fetch_page(page)
+    upcoming = None
+    try:
+        while response:
+            items = response.get("items") or []
+            more = _has_more(response, items, page, size)
+            if more and prefetch:
+                upcoming = asyncio.ensure_future(fetch_page(page + 1))
+            for item in items:
+                yield item
+            if not more:
+                return
+            page += 1
+            if upcoming:
+                response = await upcoming
+                upcoming = None
+            else:
+                response = await fetch_page(page)
+    finally:
+        if upcoming and not upcoming.done():
+            upcoming.cancel()
+
+
+class AlertCursor:
+    """Newest alert seen at each location, for incremental ("since last seen") alert
+    sweeps with PyFlo.new_alerts().
+
+    last_seen is a plain dictionary {location_id: [epoch seconds, [alert ids]]} so it
+    can be saved as JSON and restored with AlertCursor(last_seen)."""
+
+    def __init__(self, last_seen=None):
+        self.last_seen = dict(last_seen or {})
+
+    def since(self, location_ids):
+        """Oldest watermark of location_ids; older alerts need not be fetched. None if
+        any location has not been swept yet."""
+        times = [self.last_seen.get(location_id) for location_id in location_ids]
+        if not times or None in times:
+            return None
+        return min(seen[0] for seen in times)
+
+    def is_new(self, alert):
+        seen = self.last_seen.get(alert.get("locationId"))
+        if seen is None:
+            return True
+        created = alert_time(alert)
+        if created is None or created > seen[0]:
+            return True
+        return created == seen[0] and alert.get("id") not in seen[1]
+
+    def advance(self, alert):
+        """Record alert as seen"""
+        created = alert_time(alert)
+        location_id = alert.get("locationId")
+        if created is None or location_id is None:
+            return
+        seen = self.last_seen.get(location_id)
+        if seen is None or created > seen[0]:
+            self.last_seen[location_id] = [created, [alert.get("id")]]
+        elif created == seen[0] and alert.get("id") not in seen[1]:
+            seen[1].append(alert.get("id"))
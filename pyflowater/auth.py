@@ -0,0 +1,151 @@
+"""Persistence of Flo authentication tokens across processes."""
+
+import logging
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_TOKEN_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "pyflowater",
+    "tokens.json",
+)
+
+
+def token_key(auth_url, username):
+    """Key of the tokens of username issued by auth_url, so that tokens of a test
+    server (e.g. benchmarks/flostub.py) are never sent to another"""
+    return f"{username} {auth_url}"
+
+
+class TokenStore:
+    """Stores the auth token of each Flo account, keyed by token_key().
+
+    Token info is a dictionary with token, user_id, issued and expires (epoch seconds).
+    Subclass to keep tokens elsewhere (e.g. a shared cache)."""
+
+    def load(self, key):
+        """Return the token info saved for key, or None"""
+        raise NotImplementedError
+
+    def save(self, key, token_info):
+        """Save the token info for key"""
+        raise NotImplementedError
+
+    def clear(self, key):
+        """Forget any token saved for key"""
+        raise NotImplementedError
+
+    @contextmanager
+    def lock(self):
+        """Hold exclusive access while checking and refreshing a token, so only one
+        client (or process) logs in at a time"""
+        yield
+
+
+class MemoryTokenStore(TokenStore):
+    """Keeps tokens in memory, shared by all clients in this process."""
+
+    def __init__(self):
+        self._tokens = {}
+        self._lock = threading.RLock()
+
+    def load(self, key):
+        return self._tokens.get(key)
+
+    def save(self, key, token_info):
+        self._tokens[key] = token_info
+
+    def clear(self, key):
+        self._tokens.pop(key, None)
+
+    @contextmanager
+    def lock(self):
+        with self._lock:
+            yield
+
+
+class FileTokenStore(TokenStore):
+    """Keeps tokens in a JSON file (readable only by the owner), locked so that
+    multiple processes can share it."""
+
+    def __init__(self, path=DEFAULT_TOKEN_PATH):
+        self._path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._lock_file = None
+
+    def _read(self):
+        try:
+            with open(self._path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, tokens):
+        os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+        tmp = f"{self._path}.{os.getpid()}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(tokens, f)
+        os.replace(tmp, self._path)
+
+    def load(self, key):
+        return self._read().get(key)
+
+    def save(self, key, token_info):
+        with self.lock():
+            tokens = self._read()
+            tokens[key] = token_info
+            self._write(tokens)
+
+    def clear(self, key):
+        with self.lock():
+            tokens = self._read()
+            if tokens.pop(key, None) is not None:
+                self._write(tokens)
+
+    @contextmanager
+    def lock(self):
+        with self._thread_lock:
+            # reentrant within a thread; the file lock is held by the outermost caller
+            if self._depth == 0 and fcntl:
+                os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+                self._lock_file = open(f"{self._path}.lock", "a")
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0 and self._lock_file:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+
+def token_info_from_response(json_response, now=None):
+    """Convert a successful FLO_AUTH_URL response into token info"""
+    if now is None:
+        now = time.time()
+    return {
+        "token": json_response["token"],
+        "user_id": json_response["tokenPayload"]["user"]["user_id"],
+        "issued": now,
+        "expires": now + int(json_response["tokenExpiration"]),
+    }
+
+
+def refresh_time(token_info):
+    """Epoch seconds after which token_info should be refreshed (half its lifetime,
+    as PyFlo has always done)"""
+    return token_info["issued"] + (token_info["expires"] - token_info["issued"]) / 2
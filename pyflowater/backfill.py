@@ -0,0 +1,150 @@
+"""Parallel backfill of consumption data for many devices over long date ranges."""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+from pyflowater.const import (
+    FLO_BACKFILL_RATE,
+    FLO_BACKFILL_WORKERS,
+    FLO_CONSUMPTION_CHUNK_DAYS,
+    INTERVAL_HOURLY,
+)
+from pyflowater.ratelimit import RateLimiter
+
+LOG = logging.getLogger(__name__)
+
+
+class ConsumptionChunk:
+    """Result of fetching one window of consumption data for one device."""
+
+    __slots__ = (
+        "device_id",
+        "index",
+        "startDate",
+        "endDate",
+        "data",
+        "error",
+        "attempts",
+    )
+
+    def __init__(self, device_id, index, startDate, endDate):
+        self.device_id = device_id
+        self.index = index  # position of this chunk within the device's date range
+        self.startDate = startDate
+        self.endDate = endDate
+        self.data = None  # /water/consumption response on success
+        self.error = None  # last exception (or None) once all attempts failed
+        self.attempts = 0
+
+    @property
+    def ok(self):
+        return self.data is not None
+
+    def __repr__(self):
+        return "<{0}: {1} #{2} {3} - {4} ({5})>".format(
+            self.__class__.__name__,
+            self.device_id,
+            self.index,
+            self.startDate,
+            self.endDate,
+            "ok" if self.ok else f"failed: {self.error}",
+        )
+
+
+def split_range(startDate, endDate, chunk_size):
+    """Split [startDate, endDate] into consecutive (start, end) windows of at most
+    chunk_size. Each end is the last millisecond before the next start, since Flo
+    treats endDate as inclusive."""
+    windows = []
+    start = startDate
+    while start <= endDate:
+        end = min(start + chunk_size, endDate + timedelta(milliseconds=1))
+        windows.append((start, end - timedelta(milliseconds=1)))
+        start = end
+    return windows
+
+
+def backfill_consumption(
+    flo,
+    device_ids,
+    startDate,
+    endDate=None,
+    interval=INTERVAL_HOURLY,
+    chunk_size=None,
+    max_workers=FLO_BACKFILL_WORKERS,
+    rate=FLO_BACKFILL_RATE,
+    retries=3,
+    retry_delay=1.0,
+):
+    """Fetch consumption for every device in device_ids over [startDate, endDate],
+    yielding ConsumptionChunk results as they complete.
+
+    The range is split into chunks the Flo service accepts and fetched on a bounded
+    thread pool, no faster than rate requests per second. Chunks of different devices
+    are interleaved, but the chunks of each device are yielded in date order. A failing
+    chunk is retried on its own with exponential backoff; if it still fails it is
+    yielded with ok == False and the rest of the backfill carries on.
+
+    Dates follow PyFlo.consumption(): naive datetimes are local time of the running
+    system, and endDate defaults to now.
+    """
+    if endDate is None:
+        endDate = datetime.now(startDate.tzinfo)
+    if chunk_size is None:
+        chunk_size = timedelta(days=FLO_CONSUMPTION_CHUNK_DAYS.get(interval, 7))
+    windows = split_range(startDate, endDate, chunk_size)
+    limiter = RateLimiter(rate)
+
+    def fetch(chunk):
+        for attempt in range(retries + 1):
+            chunk.attempts += 1
+            limiter.acquire()
+            try:
+                chunk.data = flo.consumption(
+                    chunk.device_id,
+                    startDate=chunk.startDate,
+                    endDate=chunk.endDate,
+                    interval=interval,
+                )
+                chunk.error = None
+            except Exception as e:
+                chunk.error = e
+            if chunk.data is not None:
+                break
+            LOG.debug(
+                "Consumption chunk %s failed (attempt %s/%s)",
+                chunk,
+                attempt + 1,
+                retries + 1,
+            )
+            if attempt < retries:
+                time.sleep(retry_delay * 2**attempt)
+        return chunk
+
+    next_index = {device_id: 0 for device_id in device_ids}
+    completed = {device_id: {} for device_id in device_ids}
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = []
+    try:
+        futures = [
+            executor.submit(fetch, ConsumptionChunk(device_id, i, start, end))
+            for device_id in device_ids
+            for i, (start, end) in enumerate(windows)
+        ]
+        for future in as_completed(futures):
+            chunk = future.result()
+            pending = completed[chunk.device_id]
+            pending[chunk.index] = chunk
+
+            # release this device's chunks that are now contiguous
+            while next_index[chunk.device_id] in pending:
+                yield pending.pop(next_index[chunk.device_id])
+                next_index[chunk.device_id] += 1
+    finally:
+        # if the caller stops iterating early, don't keep fetching
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
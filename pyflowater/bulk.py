@@ -0,0 +1,219 @@
+"""Concurrent valve and mode commands across many devices or locations."""
+
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from pyflowater import FloError
+from pyflowater.const import FLO_BULK_TIMEOUT, FLO_BULK_WORKERS, FLO_CONFIRM_INTERVAL
+
+LOG = logging.getLogger(__name__)
+
+SUCCESS = "success"
+FAILURE = "failure"
+TIMEOUT = "timeout"
+
+
+class CommandResult:
+    """Outcome of one command of a bulk operation."""
+
+    __slots__ = ("target_id", "status", "response", "error", "confirmed", "elapsed")
+
+    def __init__(
+        self,
+        target_id,
+        status,
+        response=None,
+        error=None,
+        confirmed=False,
+        elapsed=0.0,
+    ):
+        self.target_id = target_id  # device_id or location_id
+        self.status = status  # SUCCESS, FAILURE or TIMEOUT
+        self.response = response  # Flo response to the command, if any
+        self.error = error  # exception sending or confirming the command, if any
+        self.confirmed = confirmed  # lastKnown reached the target (when confirming)
+        self.elapsed = elapsed  # seconds from sending the command to this result
+
+    @property
+    def ok(self):
+        return self.status == SUCCESS
+
+    def __repr__(self):
+        return "<{0}: {1} {2} in {3:.2f}s>".format(
+            self.__class__.__name__, self.target_id, self.status, self.elapsed
+        )
+
+
+def _known_state(flo, device_id, key):
+    """Current lastKnown of the valve or systemMode of a device, read from a healthy
+    real-time stream if there is one, otherwise fetched"""
+    data = flo.streamed_device(device_id, key) or flo.device(
+        device_id, use_cached=False
+    )
+    return ((data or {}).get(key) or {}).get("lastKnown")
+
+
+def _run(target_ids, command, reached, max_workers, timeout, poll_interval):
+    """Send command(target_id) for every target on a bounded thread pool, yielding a
+    CommandResult per target as it completes. If reached is given, each command
+    succeeds only once reached(target_id) returns True, and fails if it returns None
+    (there is nothing to confirm the command with)."""
+
+    def execute(target_id):
+        started[target_id] = start = time.monotonic()
+        deadline = start + timeout
+        try:
+            response = command(target_id)
+        except Exception as e:
+            return CommandResult(
+                target_id, FAILURE, error=e, elapsed=time.monotonic() - start
+            )
+        if response is None:
+            return CommandResult(target_id, FAILURE, elapsed=time.monotonic() - start)
+        if reached is None:
+            return CommandResult(
+                target_id, SUCCESS, response, elapsed=time.monotonic() - start
+            )
+
+        while True:
+            try:
+                confirmed = reached(target_id)
+                if confirmed is None:
+                    return CommandResult(
+                        target_id,
+                        FAILURE,
+                        response,
+                        error=FloError(f"nothing to confirm {target_id} with"),
+                        elapsed=time.monotonic() - start,
+                    )
+                if confirmed:
+                    return CommandResult(
+                        target_id,
+                        SUCCESS,
+                        response,
+                        confirmed=True,
+                        elapsed=time.monotonic() - start,
+                    )
+            except Exception as e:
+                LOG.debug("Failed confirming command for %s: %s", target_id, e)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return CommandResult(target_id, TIMEOUT, response, elapsed=timeout)
+            time.sleep(min(poll_interval, remaining))
+
+    started = {}  # target_id -> monotonic time its command was sent
+    executor = ThreadPoolExecutor(max_workers, "pyflowater-bulk")
+    futures = {}
+    try:
+        futures = {
+            executor.submit(execute, target_id): target_id for target_id in target_ids
+        }
+        pending = set(futures)
+        while pending:
+            # wake up in time to report the earliest running command as timed out
+            now = time.monotonic()
+            expiries = [
+                started[futures[future]] + timeout
+                for future in pending
+                if futures[future] in started
+            ]
+            wait_for = max(0.0, min(expiries) - now) if expiries else None
+            (done, pending) = wait(pending, wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+            # commands stuck in a request are reported now; their threads finish later
+            now = time.monotonic()
+            for future in list(pending):
+                start = started.get(futures[future])
+                if start is not None and now - start >= timeout:
+                    pending.discard(future)
+                    yield CommandResult(futures[future], TIMEOUT, elapsed=now - start)
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def set_valves(
+    flo,
+    device_ids,
+    target,
+    confirm=False,
+    max_workers=FLO_BULK_WORKERS,
+    timeout=FLO_BULK_TIMEOUT,
+    poll_interval=FLO_CONFIRM_INTERVAL,
+):
+    """Open or close the valves of many devices concurrently, yielding a CommandResult
+    per device as each completes.
+
+    A command that fails (or raises) is a FAILURE; one still running after timeout
+    seconds is a TIMEOUT. With confirm, a command only succeeds once the device's
+    valve.lastKnown reports target, polling every poll_interval seconds (or reading a
+    healthy real-time stream, see PyFlo(stream_staleness=...)) until the timeout.
+    :param target: "open" or "closed"
+    """
+    if target not in ("open", "closed"):
+        raise ValueError(f"invalid valve target {target}")
+    command = flo.open_valve if target == "open" else flo.close_valve
+
+    def reached(device_id):
+        return _known_state(flo, device_id, "valve") == target
+
+    return _run(
+        list(device_ids),
+        command,
+        reached if confirm else None,
+        max_workers,
+        timeout,
+        poll_interval,
+    )
+
+
+def close_valves(flo, device_ids, **kwargs):
+    """Close the valves of many devices concurrently; see set_valves()"""
+    return set_valves(flo, device_ids, "closed", **kwargs)
+
+
+def open_valves(flo, device_ids, **kwargs):
+    """Open the valves of many devices concurrently; see set_valves()"""
+    return set_valves(flo, device_ids, "open", **kwargs)
+
+
+def set_modes(
+    flo,
+    location_ids,
+    mode,
+    additional_params=None,
+    confirm=False,
+    max_workers=FLO_BULK_WORKERS,
+    timeout=FLO_BULK_TIMEOUT,
+    poll_interval=FLO_CONFIRM_INTERVAL,
+):
+    """Set the system mode of many locations concurrently, yielding a CommandResult
+    per location as each completes. With confirm, a location succeeds once the
+    systemMode.lastKnown of every device there reports mode (a location without
+    devices fails, as it cannot be confirmed); see set_valves() for failures and
+    timeouts."""
+
+    def command(location_id):
+        return flo.set_mode(location_id, mode, additional_params or {})
+
+    def reached(location_id):
+        device_ids = flo.device_ids_for_location(location_id)
+        if not device_ids:
+            return None
+        return all(
+            _known_state(flo, device_id, "systemMode") == mode
+            for device_id in device_ids
+        )
+
+    return _run(
+        list(location_ids),
+        command,
+        reached if confirm else None,
+        max_workers,
+        timeout,
+        poll_interval,
+    )
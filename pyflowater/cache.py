@@ -0,0 +1,209 @@
+"""Caching of Flo device snapshots."""
+
+import asyncio
+import threading
+import time
+
+from pyflowater.const import FLO_DEVICE_CACHE_TTL
+from pyflowater.dispatch import get_field
+
+# top-level device fields streamed by the real-time listener
+STREAMED_FIELDS = ("valve", "systemMode", "telemetry")
+
+
+def _merged(target, changes):
+    """Return a copy of target with the changes dictionary recursively merged in.
+    target is left untouched, since callers may still hold the snapshots cached."""
+    merged = dict(target)
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merged[key] = _merged(target[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+class _InFlight:
+    """A device fetch shared by every thread asking for the same device."""
+
+    __slots__ = ("done", "result", "error", "generation")
+
+    def __init__(self, generation):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.generation = generation  # of the device when the fetch began
+
+
+class DeviceCache:
+    """Per-device snapshot cache with a time-to-live.
+
+    Concurrent callers fetching the same device share a single in-flight request."""
+
+    def __init__(self, ttl=FLO_DEVICE_CACHE_TTL):
+        """
+        :param ttl: seconds a device snapshot is served from the cache (0 disables caching)
+        """
+        self.ttl = ttl
+        self._entries = {}  # device_id -> (monotonic time fetched, data)
+        self._inflight = {}  # device_id -> _InFlight
+        self._async_inflight = {}  # device_id -> (asyncio.Future, generation)
+        self._streamed = {}  # device_id -> monotonic time of the last streamed update
+        # bumped by invalidate(), so fetches begun before it do not store stale data
+        self._generation = 0
+        self._generations = {}  # device_id -> generation
+        self._lock = threading.Lock()
+
+    def get(self, device_id, max_age=None):
+        """Return the cached snapshot for device_id if younger than max_age (default ttl)"""
+        entry = self._entries.get(device_id)
+        if entry is None:
+            return None
+        if max_age is None:
+            max_age = self.ttl
+        fetched, data = entry
+        if time.monotonic() - fetched > max_age:
+            return None
+        return data
+
+    def generation(self, device_id):
+        """Token that changes whenever device_id is invalidated; capture it before
+        fetching and pass it to set()"""
+        return (self._generation, self._generations.get(device_id, 0))
+
+    def set(self, device_id, data, generation=None):
+        """Store a freshly fetched snapshot for device_id, unless device_id was
+        invalidated since generation was captured (e.g. by a valve command)"""
+        if data is None:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation(device_id):
+                return
+            self._entries[device_id] = (time.monotonic(), data)
+
+    def update(self, device_id, changes):
+        """Optimistically merge changes into the cached snapshot for device_id, if any"""
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry is not None:
+                self._entries[device_id] = (entry[0], _merged(entry[1], changes))
+
+    def update_location(self, location_id, changes, device_ids=()):
+        """Optimistically merge changes into every cached device at location_id.
+        Fetches in flight for those devices, or for device_ids (the devices known to
+        be at location_id), are not cached since they may predate the changes."""
+        with self._lock:
+            for device_id in device_ids:
+                self._bump(device_id)
+            for (device_id, (fetched, data)) in list(self._entries.items()):
+                if data.get("location", {}).get("id") == location_id:
+                    self._entries[device_id] = (fetched, _merged(data, changes))
+                    self._bump(device_id)
+
+    def record_snapshot(self, device_id, snapshot):
+        """Merge the streamed fields of a real-time listener snapshot (a firestore
+        DocumentSnapshot or dictionary) into the cached state of device_id"""
+        changes = {}
+        for field in STREAMED_FIELDS:
+            value = get_field(snapshot, field)
+            if value is not None:
+                changes[field] = value
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry is not None:
+                # swap in a merged copy; callers may hold the previous snapshot
+                self._entries[device_id] = (entry[0], _merged(entry[1], changes))
+            else:
+                # streamed state alone is partial, so device() must still fetch it
+                self._entries[device_id] = (float("-inf"), changes)
+            self._streamed[device_id] = now
+
+    def get_streamed(self, device_id, max_age):
+        """Return the cached state of device_id if a real-time listener updated it
+        within max_age seconds, otherwise None"""
+        streamed = self._streamed.get(device_id)
+        if streamed is None or time.monotonic() - streamed > max_age:
+            return None
+        entry = self._entries.get(device_id)
+        return entry[1] if entry is not None else None
+
+    def invalidate(self, device_id=None):
+        """Drop the cached snapshot for device_id (or all devices if None)"""
+        with self._lock:
+            if device_id is None:
+                self._entries.clear()
+                self._generation += 1
+            else:
+                self._entries.pop(device_id, None)
+                self._bump(device_id)
+
+    def _bump(self, device_id):
+        self._generations[device_id] = self._generations.get(device_id, 0) + 1
+
+    def fetch(self, device_id, loader):
+        """Return the snapshot for device_id, calling loader(device_id) on a cache miss.
+
+        Only one loader call per device is in flight at a time; other threads asking
+        for the same device wait for and share its result, unless it began before the
+        device was last invalidated (e.g. by device(use_cached=False))."""
+        data = self.get(device_id)
+        if data is not None:
+            return data
+
+        with self._lock:
+            generation = self.generation(device_id)
+            inflight = self._inflight.get(device_id)
+            owner = inflight is None or inflight.generation != generation
+            if owner:
+                inflight = self._inflight[device_id] = _InFlight(generation)
+
+        if not owner:
+            inflight.done.wait()
+            if inflight.error:
+                raise inflight.error
+            return inflight.result
+
+        try:
+            inflight.result = loader(device_id)
+            self.set(device_id, inflight.result, generation)
+            return inflight.result
+        except Exception as e:
+            inflight.error = e
+            raise
+        finally:
+            with self._lock:
+                # a newer fetch may have taken the slot after an invalidation
+                if self._inflight.get(device_id) is inflight:
+                    del self._inflight[device_id]
+            inflight.done.set()
+
+    async def async_fetch(self, device_id, loader):
+        """Coroutine version of fetch(), where loader(device_id) returns an awaitable."""
+        data = self.get(device_id)
+        if data is not None:
+            return data
+
+        generation = self.generation(device_id)
+        (future, started) = self._async_inflight.get(device_id, (None, None))
+        if future is not None and started == generation:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        entry = self._async_inflight[device_id] = (future, generation)
+        try:
+            result = await loader(device_id)
+            self.set(device_id, result, generation)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # mark retrieved so an unobserved failure doesn't log a warning
+            future.exception()
+            raise
+        finally:
+            if self._async_inflight.get(device_id) is entry:
+                del self._async_inflight[device_id]
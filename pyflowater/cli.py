@@ -0,0 +1,187 @@
+"""The pyflowater command line.
+
+    pyflowater export OUTPUT --start 2021-01-01 [--end 2021-07-01] [--format parquet]
+
+Credentials are read from the FLO_USER and FLO_PASSWORD environment variables (the
+password is prompted for if only the user is set).
+"""
+
+import logging
+import argparse
+import getpass
+import os
+import sys
+from datetime import datetime
+
+from pyflowater import FloError, PyFlo
+from pyflowater.const import (
+    FLO_EXPORT_CHECKPOINT_SECONDS,
+    FLO_EXPORT_PART_ROWS,
+    FLO_EXPORT_RATE,
+    FLO_EXPORT_WORKERS,
+    INTERVAL_DAILY,
+    INTERVAL_HOURLY,
+    INTERVAL_MONTHLY,
+)
+from pyflowater.export import DATASETS, FORMAT_CSV, FORMATS, export_account
+
+
+def _date(value):
+    """A date or datetime in ISO 8601 format; without a timezone it is local time"""
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date: {value}")
+
+
+def _datasets(value):
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = set(names) - set(DATASETS)
+    if unknown or not names:
+        raise argparse.ArgumentTypeError(
+            f"datasets must be a comma separated list of {', '.join(DATASETS)}"
+        )
+    return names
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog="pyflowater", description="Flo by Moen command line tools"
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="log debug output")
+    parser.add_argument("--api-base", help=argparse.SUPPRESS)
+    parser.add_argument("--auth-url", help=argparse.SUPPRESS)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser(
+        "export",
+        help="export consumption, telemetry history and alerts of the whole account",
+        description="Export consumption, telemetry history and alerts of every device "
+        "of the account into OUTPUT, one directory of part files per dataset. "
+        "Running the same export again resumes it from its checkpoint.",
+    )
+    export.add_argument("output", help="directory to write into")
+    export.add_argument("--start", type=_date, required=True, help="first date")
+    export.add_argument("--end", type=_date, help="last date (default: now)")
+    export.add_argument("--format", choices=FORMATS, default=FORMAT_CSV)
+    export.add_argument(
+        "--datasets",
+        type=_datasets,
+        default=list(DATASETS),
+        help=f"comma separated datasets to export (default: {','.join(DATASETS)})",
+    )
+    export.add_argument(
+        "--interval",
+        choices=(INTERVAL_HOURLY, INTERVAL_DAILY, INTERVAL_MONTHLY),
+        default=INTERVAL_HOURLY,
+    )
+    export.add_argument(
+        "--workers",
+        type=int,
+        default=FLO_EXPORT_WORKERS,
+        help="requests in flight at once",
+    )
+    export.add_argument(
+        "--rate",
+        type=float,
+        default=FLO_EXPORT_RATE,
+        help="maximum requests per second",
+    )
+    export.add_argument(
+        "--part-rows",
+        type=int,
+        default=FLO_EXPORT_PART_ROWS,
+        help="rows per part file",
+    )
+    export.add_argument(
+        "--checkpoint-interval",
+        type=float,
+        default=FLO_EXPORT_CHECKPOINT_SECONDS,
+        help="seconds between checkpoints (each completes the part files)",
+    )
+    export.add_argument("-q", "--quiet", action="store_true", help="no progress output")
+    return parser
+
+
+def _client(args):
+    user = os.getenv("FLO_USER")
+    if not user:
+        raise FloError("FLO_USER (and FLO_PASSWORD) must be set")
+    password = os.getenv("FLO_PASSWORD") or getpass.getpass(
+        f"Flo password for {user}: "
+    )
+    kwargs = {}
+    if args.api_base:
+        kwargs["api_base"] = args.api_base
+    if args.auth_url:
+        kwargs["auth_url"] = args.auth_url
+    return PyFlo(user, password, refresh_in_background=False, **kwargs)
+
+
+def _export(args):
+    def progress(summary):
+        rows = sum(summary.rows.values())
+        print(
+            f"\r{summary.requests} requests, {rows} rows, {len(summary.failed)} failed",
+            end="",
+            file=sys.stderr,
+        )
+
+    flo = _client(args)
+    try:
+        summary = export_account(
+            flo,
+            args.output,
+            args.start,
+            args.end,
+            datasets=args.datasets,
+            file_format=args.format,
+            interval=args.interval,
+            max_workers=args.workers,
+            rate=args.rate,
+            part_rows=args.part_rows,
+            checkpoint_interval=args.checkpoint_interval,
+            progress=None if args.quiet else progress,
+        )
+    finally:
+        flo.close()
+
+    if not args.quiet:
+        print(file=sys.stderr)
+        for (dataset, rows) in summary.rows.items():
+            print(f"{dataset}: {rows} rows", file=sys.stderr)
+        print(
+            f"{summary.requests} requests in {summary.elapsed:.1f}s, "
+            f"{summary.skipped} already exported",
+            file=sys.stderr,
+        )
+    if summary.failed:
+        print(
+            f"{len(summary.failed)} requests failed; run the export again to retry them",
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
+_COMMANDS = {"export": _export}
+
+
+def main(argv=None):
+    args = _parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.WARNING,
+        format="%(name)s - %(levelname)s - %(message)s",
+    )
+    try:
+        return _COMMANDS[args.command](args)
+    except FloError as e:
+        print(f"pyflowater: {e}", file=sys.stderr)
+        return 2
+    except KeyboardInterrupt:
+        print("\ninterrupted; run the same command again to resume", file=sys.stderr)
+        return 130
+
+
+if __name__ == "__main__":
+    sys.exit(main())
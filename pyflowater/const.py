@@ -10,6 +10,24 @@ FLO_USERTOKENS_URL = FLO_V1_API_BASE + "/usertokens/me"
 
 FLO_PRESENCE_HEARTBEAT = FLO_V2_API_BASE + "/presence/me"
 FLO_HEARTBEAT_DELAY = 60.0  # their timeout appears to be 2 minutes, so half that
+FLO_FIRESTORE_REFRESH_MARGIN = 300.0  # refresh firestore credentials this early
+
+FLO_MAX_CONCURRENCY = 20  # default limit on concurrent requests from AsyncPyFlo
+FLO_KEEPALIVE_TIMEOUT = 30.0  # seconds an idle pooled connection is kept open
+
+FLO_DEVICE_CACHE_TTL = 10.0  # seconds a device snapshot is reused by device()
+FLO_HTTP_CACHE_BYTES = 32 * 1024 * 1024  # response bytes kept by an HTTP MemoryCache
+
+FLO_TOKEN_REFRESH_MARGIN = 300.0  # refresh auth tokens this many seconds early
+
+FLO_TELEMETRY_HISTORY_SIZE = 8640  # telemetry samples kept per device (~24h at 10s)
+
+FLO_LEAK_FLOW_GPM = 0.1  # flow rate regarded as water flowing by leak detection rules
+FLO_LEAK_FLOW_SECONDS = 30 * 60  # continuous flow before a sustained flow is reported
+FLO_LEAK_AWAY_SECONDS = 2 * 60  # flow in away mode before it is reported
+FLO_LEAK_PSI_DROP_RATE = 3.0  # psi per minute of pressure drop that is reported
+FLO_LEAK_PSI_SMOOTHING = 60.0  # time constant (seconds) of the smoothed pressure drop
+FLO_LEAK_MAX_GAP = 600.0  # seconds between readings after which a drop rate restarts
 
 """
 V1 APIs
@@ -40,6 +58,35 @@ INTERVAL_HOURLY = "1h"
 INTERVAL_DAILY = "1d"
 INTERVAL_MONTHLY = "1m"
 
+# largest window of consumption data requested at once when backfilling, by interval
+FLO_CONSUMPTION_CHUNK_DAYS = {
+    INTERVAL_HOURLY: 7,
+    INTERVAL_DAILY: 90,
+    INTERVAL_MONTHLY: 366,
+}
+FLO_BACKFILL_WORKERS = 4  # concurrent consumption requests during a backfill
+FLO_BACKFILL_RATE = 5.0  # maximum consumption requests per second during a backfill
+
+FLO_BULK_WORKERS = 20  # concurrent commands sent by bulk valve and mode operations
+FLO_BULK_TIMEOUT = 30.0  # seconds each bulk command (and its confirmation) may take
+FLO_CONFIRM_INTERVAL = 2.0  # seconds between polls while confirming a command
+
+FLO_POLL_INTERVAL = 60.0  # seconds between scheduled polls of a device
+FLO_POLL_ACTIVE_INTERVAL = 10.0  # ... while water flows or an alert is pending
+FLO_POLL_IDLE_INTERVAL = 600.0  # ... at most, backing off while a device stays idle
+FLO_POLL_JITTER = 0.1  # fraction by which each poll interval is randomized
+FLO_POLL_RATE = 2.0  # maximum scheduled polls per second per account
+FLO_POLL_WORKERS = 4  # concurrent scheduled polls
+
+FLO_EXPORT_WORKERS = 8  # concurrent requests during an export
+FLO_EXPORT_RATE = 10.0  # maximum requests per second during an export
+FLO_EXPORT_PART_ROWS = 1000000  # rows written to each part file of an export
+FLO_EXPORT_CHECKPOINT_SECONDS = 30  # seconds between commits of an export's parts
+
+FLO_POOL_CONCURRENCY = 50  # requests in flight at once across an AccountPool
+FLO_ACCOUNT_CONCURRENCY = 4  # requests in flight at once for each pooled account
+FLO_LOGIN_RATE = 1.0  # password logins per second across an AccountPool
+
 FLO_UNIT_SYSTEMS = {
     "imperial_us": {
         "system": "imperial_us",
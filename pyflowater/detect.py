@@ -0,0 +1,407 @@
+"""Client-side leak and anomaly detection over streamed and polled telemetry.
+
+LeakDetector evaluates rules incrementally as samples arrive, from real-time listeners
+(it is a snapshot observer like TelemetryHistory), from telemetry(), or from anything
+else calling record()/record_snapshot(), such as the device() results of a
+PollScheduler. Each rule keeps a few numbers of state per device, so evaluating a
+sample costs the same however long a device has been streaming, and an event is
+emitted on the very sample that crosses a threshold rather than after Flo's
+server-side alert round trip.
+
+    detector = LeakDetector(callback=print, shutoff=(RULE_SUSTAINED_FLOW,))
+    flo = PyFlo(username, password, leak_detector=detector)
+    flo.get_real_time_listener(device_id, callback).start()
+
+Rules emit an active DetectionEvent when their condition starts and an inactive one
+when it clears. Rules named in shutoff close the device's valve when they trigger,
+unless the latest snapshot of the device shows it closed (or closing) already.
+"""
+
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pyflowater.const import (
+    FLO_AWAY,
+    FLO_LEAK_AWAY_SECONDS,
+    FLO_LEAK_FLOW_GPM,
+    FLO_LEAK_FLOW_SECONDS,
+    FLO_LEAK_MAX_GAP,
+    FLO_LEAK_PSI_DROP_RATE,
+    FLO_LEAK_PSI_SMOOTHING,
+)
+from pyflowater.dispatch import get_field
+from pyflowater.timeutil import parse_flo_time
+
+LOG = logging.getLogger(__name__)
+
+RULE_SUSTAINED_FLOW = "sustained_flow"
+RULE_PRESSURE_DROP = "pressure_drop"
+RULE_AWAY_FLOW = "away_flow"
+
+
+class Sample:
+    """One telemetry reading of a device, as seen by the rules."""
+
+    __slots__ = ("time", "gpm", "psi", "mode")
+
+    def __init__(self, time, gpm=None, psi=None, mode=None):
+        self.time = time  # epoch seconds of the reading
+        self.gpm = gpm
+        self.psi = psi
+        self.mode = mode  # last known system mode of the device ("home", "away", ...)
+
+
+class DetectionEvent:
+    """A rule starting (active) or ceasing (not active) to match a device."""
+
+    __slots__ = ("rule", "device_id", "active", "time", "value", "message", "shutoff")
+
+    def __init__(self, rule, device_id, active, time, value, message):
+        self.rule = rule  # name of the rule
+        self.device_id = device_id
+        self.active = active
+        self.time = time  # epoch seconds of the sample that changed the state
+        self.value = value  # the measure compared by the rule (minutes, psi/min, ...)
+        self.message = message
+        self.shutoff = False  # whether the valve is being closed in response
+
+    def __repr__(self):
+        return "<{0}: {1} {2} {3}: {4}>".format(
+            self.__class__.__name__,
+            self.rule,
+            self.device_id,
+            "active" if self.active else "cleared",
+            self.message,
+        )
+
+
+class Rule:
+    """Base of detection rules. A rule's per-device state is a small object created
+    by new_state(); update() returns an event when the state changes, else None."""
+
+    name = None
+
+    def new_state(self):
+        raise NotImplementedError
+
+    def update(self, device_id, state, sample):
+        raise NotImplementedError
+
+
+class _FlowState:
+    __slots__ = ("since", "active")
+
+    def __init__(self):
+        self.since = None  # time the current run of flow began
+        self.active = False
+
+
+class SustainedFlowRule(Rule):
+    """Water flowing at min_gpm or more, without a break, for at least duration
+    seconds (a running toilet, a burst pipe, an open hose)."""
+
+    name = RULE_SUSTAINED_FLOW
+
+    def __init__(self, min_gpm=FLO_LEAK_FLOW_GPM, duration=FLO_LEAK_FLOW_SECONDS):
+        """
+        :param min_gpm: flow rate regarded as water flowing
+        :param duration: seconds of continuous flow before the rule triggers
+        """
+        self.min_gpm = min_gpm
+        self.duration = duration
+
+    def new_state(self):
+        return _FlowState()
+
+    def matches(self, sample):
+        return sample.gpm >= self.min_gpm
+
+    def update(self, device_id, state, sample):
+        if sample.gpm is None:
+            return None
+        if not self.matches(sample):
+            state.since = None
+            if state.active:
+                state.active = False
+                return DetectionEvent(
+                    self.name, device_id, False, sample.time, 0, "stopped"
+                )
+            return None
+        if state.since is None:
+            state.since = sample.time
+        minutes = (sample.time - state.since) / 60
+        if not state.active and sample.time - state.since >= self.duration:
+            state.active = True
+            return DetectionEvent(
+                self.name,
+                device_id,
+                True,
+                sample.time,
+                minutes,
+                f"{sample.gpm} gpm for {minutes:.0f} minutes",
+            )
+        return None
+
+
+class AwayFlowRule(SustainedFlowRule):
+    """Water flowing while the device is in one of modes (by default "away") for at
+    least duration seconds."""
+
+    name = RULE_AWAY_FLOW
+
+    def __init__(
+        self,
+        min_gpm=FLO_LEAK_FLOW_GPM,
+        duration=FLO_LEAK_AWAY_SECONDS,
+        modes=(FLO_AWAY,),
+    ):
+        """
+        :param modes: system modes in which no water should flow
+        """
+        super().__init__(min_gpm, duration)
+        self.modes = frozenset(modes)
+
+    def matches(self, sample):
+        return sample.mode in self.modes and sample.gpm >= self.min_gpm
+
+
+class _PressureState:
+    __slots__ = ("time", "psi", "rate", "active")
+
+    def __init__(self):
+        self.time = None  # time of the previous reading
+        self.psi = None
+        self.rate = 0.0  # smoothed pressure drop, psi per minute
+        self.active = False
+
+
+class PressureDropRule(Rule):
+    """Pressure falling faster than max_rate psi per minute. The rate between
+    consecutive readings is smoothed exponentially with time constant smoothing
+    seconds, so one noisy reading does not trigger the rule; it clears once the
+    smoothed rate is back under half of max_rate."""
+
+    name = RULE_PRESSURE_DROP
+
+    def __init__(
+        self,
+        max_rate=FLO_LEAK_PSI_DROP_RATE,
+        smoothing=FLO_LEAK_PSI_SMOOTHING,
+        max_gap=FLO_LEAK_MAX_GAP,
+    ):
+        """
+        :param max_rate: psi per minute of pressure drop that triggers the rule
+        :param smoothing: time constant (seconds) of the smoothed drop rate
+        :param max_gap: seconds between readings beyond which the rate starts afresh
+        """
+        self.max_rate = max_rate
+        self.smoothing = smoothing
+        self.max_gap = max_gap
+
+    def new_state(self):
+        return _PressureState()
+
+    def update(self, device_id, state, sample):
+        if sample.psi is None:
+            return None
+        (previous_time, previous_psi) = (state.time, state.psi)
+        (state.time, state.psi) = (sample.time, sample.psi)
+        if previous_time is None or sample.time - previous_time > self.max_gap:
+            state.rate = 0.0
+            return None
+        elapsed = sample.time - previous_time
+        if elapsed <= 0:
+            return None
+
+        rate = (previous_psi - sample.psi) * 60 / elapsed
+        weight = 1 - math.exp(-elapsed / self.smoothing)
+        state.rate += weight * (rate - state.rate)
+
+        if not state.active and state.rate >= self.max_rate:
+            state.active = True
+            return DetectionEvent(
+                self.name,
+                device_id,
+                True,
+                sample.time,
+                state.rate,
+                f"pressure falling {state.rate:.1f} psi/min to {sample.psi} psi",
+            )
+        if state.active and state.rate < self.max_rate / 2:
+            state.active = False
+            return DetectionEvent(
+                self.name, device_id, False, sample.time, state.rate, "pressure steady"
+            )
+        return None
+
+
+def default_rules():
+    return [SustainedFlowRule(), PressureDropRule(), AwayFlowRule()]
+
+
+_VALVE_CLOSED = "closed"
+
+
+class _Device:
+    __slots__ = ("last_time", "mode", "valve", "states")
+
+    def __init__(self, states):
+        self.last_time = None
+        self.mode = None
+        self.valve = None  # (target, lastKnown) of the valve in the latest snapshot
+        self.states = states  # one state per rule, in rule order
+
+
+class LeakDetector:
+    """Evaluates rules over the telemetry of every device it is fed.
+
+    Events are passed to callback(DetectionEvent) on the thread that recorded the
+    sample (e.g. the firestore watch thread), so callbacks should be quick; use a
+    TelemetryDispatcher-style queue for slow work. Valve shutoffs run on a separate
+    thread."""
+
+    def __init__(self, rules=None, callback=None, shutoff=(), flo=None):
+        """
+        :param rules: list of Rule (default: default_rules())
+        :param callback: function called with each DetectionEvent
+        :param shutoff: names of rules that close the device's valve when triggered
+        :param flo: PyFlo used to close valves (set automatically when the detector
+            is passed to PyFlo(leak_detector=...))
+        """
+        self.rules = list(rules) if rules is not None else default_rules()
+        self.callback = callback
+        self.shutoff = frozenset(shutoff)
+        self.flo = flo
+        self._devices = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def record(self, device_id, current, mode=None):
+        """Evaluate a telemetry["current"] dictionary (as returned by
+        PyFlo.telemetry()). Readings not newer than the last one are skipped."""
+        return self._evaluate(
+            device_id,
+            current.get("updated"),
+            current.get("gpm"),
+            current.get("psi"),
+            mode,
+            None,
+        )
+
+    def record_snapshot(self, device_id, snapshot):
+        """Evaluate a device document: a firestore DocumentSnapshot from a listener, or
+        a dictionary such as a device() response"""
+        return self._evaluate(
+            device_id,
+            get_field(snapshot, "telemetry.current.updated"),
+            get_field(snapshot, "telemetry.current.gpm"),
+            get_field(snapshot, "telemetry.current.psi"),
+            get_field(snapshot, "systemMode.lastKnown"),
+            (
+                get_field(snapshot, "valve.target"),
+                get_field(snapshot, "valve.lastKnown"),
+            ),
+        )
+
+    def set_mode(self, device_id, mode):
+        """Set the system mode of device_id, e.g. after PyFlo.set_mode() or from a
+        location; readings without a mode use the last one known"""
+        with self._lock:
+            self._device(device_id).mode = mode
+
+    def reset(self, device_id=None):
+        """Forget the state of device_id (or of all devices)"""
+        with self._lock:
+            if device_id is None:
+                self._devices.clear()
+            else:
+                self._devices.pop(device_id, None)
+
+    def active(self, device_id):
+        """Names of the rules currently triggered for device_id"""
+        with self._lock:
+            device = self._devices.get(device_id)
+            if device is None:
+                return []
+            return [
+                rule.name
+                for (rule, state) in zip(self.rules, device.states)
+                if getattr(state, "active", False)
+            ]
+
+    def close(self):
+        """Wait for any valve shutoffs in progress"""
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _device(self, device_id):
+        device = self._devices.get(device_id)
+        if device is None:
+            device = self._devices[device_id] = _Device(
+                [rule.new_state() for rule in self.rules]
+            )
+        return device
+
+    def _evaluate(self, device_id, updated, gpm, psi, mode, valve):
+        timestamp = time.time()
+        if updated:
+            try:
+                timestamp = parse_flo_time(updated)
+            except ValueError:
+                pass
+
+        events = []
+        with self._lock:
+            device = self._device(device_id)
+            # the valve may change without a new reading (e.g. a snapshot of the
+            # shutoff itself), so track it before skipping repeated readings
+            if valve is not None and valve != (None, None):
+                device.valve = valve
+            if device.last_time is not None and timestamp <= device.last_time:
+                return events
+            device.last_time = timestamp
+            if mode is not None:
+                device.mode = mode
+            valve_closed = device.valve is not None and _VALVE_CLOSED in device.valve
+            sample = Sample(timestamp, gpm, psi, device.mode)
+            for (rule, state) in zip(self.rules, device.states):
+                event = rule.update(device_id, state, sample)
+                if event is not None:
+                    events.append(event)
+
+        for event in events:
+            if event.active and event.rule in self.shutoff:
+                if valve_closed:
+                    LOG.info("Valve of %s already closed for %s", device_id, event)
+                else:
+                    self._close_valve(event)
+            if self.callback:
+                try:
+                    self.callback(event)
+                except Exception:
+                    LOG.exception("Error in leak detector callback")
+        return events
+
+    def _close_valve(self, event):
+        if self.flo is None:
+            LOG.warning(
+                "No PyFlo to close the valve of %s for %s", event.device_id, event
+            )
+            return
+        event.shutoff = True
+        LOG.warning("Closing valve of %s: %s", event.device_id, event)
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(1, "pyflowater-shutoff")
+        self._executor.submit(self._shutoff, event.device_id)
+
+    def _shutoff(self, device_id):
+        try:
+            if self.flo.close_valve(device_id) is None:
+                LOG.error("Failed closing the valve of %s", device_id)
+        except Exception:
+            LOG.exception("Failed closing the valve of %s", device_id)
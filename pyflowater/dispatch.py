@@ -0,0 +1,234 @@
+"""Off-thread dispatch of real-time Flo device snapshots to slow consumers.
+
+Firestore delivers snapshots on its watch thread, so a slow callback there stalls the
+whole stream. TelemetryDispatcher instead queues snapshots (cheaply) and delivers
+them from a pool of worker threads. Under backpressure, coalescing keeps only the
+latest snapshot of each device, and delta events carry only the fields that changed.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+# event field name -> firestore field path of the tracked device state
+TRACKED_FIELDS = {
+    "psi": "telemetry.current.psi",
+    "gpm": "telemetry.current.gpm",
+    "tempF": "telemetry.current.tempF",
+    "valve": "valve.lastKnown",
+    "systemMode": "systemMode.lastKnown",
+}
+
+
+def get_field(snapshot, path):
+    """Read a dotted field path from a firestore DocumentSnapshot or a dictionary,
+    returning None if it is missing"""
+    if isinstance(snapshot, dict):
+        value = snapshot
+        for key in path.split("."):
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        return value
+    try:
+        return snapshot.get(path)
+    except KeyError:
+        return None
+
+
+class TelemetryEvent:
+    """A device update delivered by TelemetryDispatcher."""
+
+    __slots__ = ("device_id", "changes", "received", "lag", "_snapshot", "_data")
+
+    def __init__(self, device_id, changes, snapshot, received, lag):
+        self.device_id = device_id
+        self.changes = changes  # tracked fields that changed (all of them at first)
+        self.received = received  # time.time() the snapshot arrived
+        self.lag = lag  # seconds between arrival and dispatch
+        self._snapshot = snapshot
+        self._data = None
+
+    def to_dict(self):
+        """The complete device document, converted on first use"""
+        if self._data is None:
+            if isinstance(self._snapshot, dict):
+                self._data = self._snapshot
+            else:
+                self._data = self._snapshot.to_dict()
+        return self._data
+
+    def __repr__(self):
+        return "<{0}: {1} {2}>".format(
+            self.__class__.__name__, self.device_id, self.changes
+        )
+
+
+class TelemetryDispatcher:
+    """Delivers device snapshots to callback(TelemetryEvent) from worker threads.
+
+    With coalesce=True (the default) at most one snapshot per device waits in the queue
+    and newer ones replace it, so a slow consumer sees the latest state rather than a
+    growing backlog; each device is also handled by one worker at a time, preserving
+    its order. With coalesce=False every snapshot is queued, on the queue of the one
+    worker each device is pinned to (so its order is preserved too), and snapshots
+    beyond maxsize are dropped.
+
+    With deltas=True, snapshots that don't change any TRACKED_FIELDS are skipped and
+    events carry only the changed fields; the full document is converted lazily by
+    TelemetryEvent.to_dict(), on the worker thread."""
+
+    def __init__(self, callback, workers=1, maxsize=1000, coalesce=True, deltas=True):
+        self._callback = callback
+        self._workers = workers
+        self._coalesce = coalesce
+        self._deltas = deltas
+        # coalescing shares one queue; otherwise each worker has its own
+        queues = 1 if coalesce else max(1, workers)
+        self._queues = [
+            queue.Queue(max(1, maxsize // queues) if maxsize else 0)
+            for _ in range(queues)
+        ]
+        self._lock = threading.Lock()
+        self._pending = {}  # device_id -> (snapshot, received) awaiting a worker
+        self._active = set()  # device_ids being handled by a worker
+        self._last = {}  # device_id -> {field: value} last dispatched
+        self._threads = []
+
+        self.submitted = 0
+        self.dispatched = 0
+        self.coalesced = 0  # snapshots replaced by a newer one before dispatch
+        self.dropped = 0  # snapshots discarded because the queue was full
+        self.unchanged = 0  # snapshots skipped since no tracked field changed
+        self.errors = 0  # exceptions raised by the callback
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    @property
+    def stats(self):
+        """Counters for sizing the queue and worker pool"""
+        return {
+            "submitted": self.submitted,
+            "dispatched": self.dispatched,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "unchanged": self.unchanged,
+            "errors": self.errors,
+            "queued": sum(q.qsize() for q in self._queues),
+            "last_lag": self.last_lag,
+            "max_lag": self.max_lag,
+        }
+
+    def start(self):
+        """Start the worker threads (done automatically by the first submit())"""
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self._workers):
+                thread = threading.Thread(
+                    target=self._run,
+                    args=(self._queues[i % len(self._queues)],),
+                    name=f"TelemetryDispatcher-{i}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Stop the workers once the queued snapshots have been dispatched"""
+        threads, self._threads = self._threads, []
+        for i in range(len(threads)):
+            self._queues[i % len(self._queues)].put(None)
+        for thread in threads:
+            thread.join(timeout)
+
+    def submit(self, device_id, snapshot):
+        """Queue a DocumentSnapshot (or dictionary) for device_id; never blocks"""
+        if not self._threads:
+            self.start()
+        received = time.time()
+        with self._lock:
+            self.submitted += 1
+            if not self._coalesce:
+                # pinning each device to one worker keeps its snapshots (and the
+                # deltas computed against _last) in order
+                pinned = self._queues[hash(device_id) % len(self._queues)]
+                try:
+                    pinned.put_nowait((device_id, snapshot, received))
+                except queue.Full:
+                    self.dropped += 1
+                return
+
+            if device_id in self._pending:
+                self.coalesced += 1
+                self._pending[device_id] = (snapshot, received)
+                return
+            self._pending[device_id] = (snapshot, received)
+            if device_id not in self._active:
+                self._enqueue(device_id)
+
+    def _enqueue(self, device_id):
+        try:
+            self._queues[0].put_nowait(device_id)
+        except queue.Full:
+            self.dropped += 1
+            del self._pending[device_id]
+
+    def _run(self, work):
+        while True:
+            item = work.get()
+            if item is None:
+                return
+
+            if self._coalesce:
+                device_id = item
+                with self._lock:
+                    (snapshot, received) = self._pending.pop(device_id)
+                    self._active.add(device_id)
+            else:
+                (device_id, snapshot, received) = item
+
+            try:
+                self._dispatch(device_id, snapshot, received)
+            finally:
+                if self._coalesce:
+                    with self._lock:
+                        self._active.discard(device_id)
+                        # a newer snapshot arrived while this one was handled
+                        if device_id in self._pending:
+                            self._enqueue(device_id)
+
+    def _dispatch(self, device_id, snapshot, received):
+        values = {
+            field: get_field(snapshot, path) for field, path in TRACKED_FIELDS.items()
+        }
+        if self._deltas:
+            last = self._last.get(device_id, {})
+            changes = {
+                field: value
+                for field, value in values.items()
+                if field not in last or last[field] != value
+            }
+            self._last[device_id] = values
+            if not changes:
+                with self._lock:
+                    self.unchanged += 1
+                return
+        else:
+            changes = values
+
+        lag = time.time() - received
+        try:
+            self._callback(TelemetryEvent(device_id, changes, snapshot, received, lag))
+        except Exception:
+            LOG.exception(f"Error dispatching Flo update for {device_id}")
+            with self._lock:
+                self.errors += 1
+            return
+        with self._lock:
+            self.dispatched += 1
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
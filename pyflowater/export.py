@@ -0,0 +1,567 @@
+"""Streaming export of an account's consumption, telemetry history and alerts.
+
+export_account() walks the account's locations() and devices, fetches consumption()
+and water_metrics() one date window at a time (and the alerts of each location) on a
+bounded thread pool, and writes rows as responses arrive, so memory stays bounded by
+the requests in flight whatever the size of the account or date range.
+
+Each dataset is written to numbered part files in its own directory:
+
+    OUTPUT/consumption/part-00000.csv
+    OUTPUT/telemetry/part-00000.csv
+    OUTPUT/alerts/part-00000.csv
+    OUTPUT/checkpoint.json
+
+A part is written under a temporary name and renamed once complete (when it reaches
+part_rows rows, or checkpoint_interval seconds after it was begun); only then are the
+requests whose rows it holds recorded in the checkpoint. Running the same export again
+resumes it: completed requests are skipped, and the rows of an interrupted part are
+fetched again into a new part, so every row is exported exactly once and at most
+checkpoint_interval seconds of work is repeated.
+
+Parquet output requires pyarrow (pip3 install pyflowater[parquet]).
+"""
+
+import logging
+import csv
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+
+from pyflowater import FloError
+from pyflowater.alerts import alert_time
+from pyflowater.backfill import split_range
+from pyflowater.const import (
+    FLO_CONSUMPTION_CHUNK_DAYS,
+    FLO_EXPORT_CHECKPOINT_SECONDS,
+    FLO_EXPORT_PART_ROWS,
+    FLO_EXPORT_RATE,
+    FLO_EXPORT_WORKERS,
+    INTERVAL_HOURLY,
+)
+from pyflowater.ratelimit import RateLimiter
+from pyflowater.timeutil import format_flo_time, parse_flo_time, to_utc
+
+LOG = logging.getLogger(__name__)
+
+FORMAT_CSV = "csv"
+FORMAT_NDJSON = "ndjson"
+FORMAT_PARQUET = "parquet"
+FORMATS = (FORMAT_CSV, FORMAT_NDJSON, FORMAT_PARQUET)
+
+DATASET_CONSUMPTION = "consumption"
+DATASET_TELEMETRY = "telemetry"
+DATASET_ALERTS = "alerts"
+
+# columns of each dataset as (name, type); time columns hold UTC epoch seconds
+COLUMNS = {
+    DATASET_CONSUMPTION: (
+        ("device_id", "string"),
+        ("location_id", "string"),
+        ("time", "time"),
+        ("gallons", "float"),
+    ),
+    DATASET_TELEMETRY: (
+        ("device_id", "string"),
+        ("location_id", "string"),
+        ("time", "time"),
+        ("gpm", "float"),
+        ("psi", "float"),
+        ("tempF", "float"),
+    ),
+    DATASET_ALERTS: (
+        ("id", "string"),
+        ("location_id", "string"),
+        ("device_id", "string"),
+        ("status", "string"),
+        ("severity", "string"),
+        ("alarm_id", "string"),
+        ("title", "string"),
+        ("message", "string"),
+        ("created", "time"),
+    ),
+}
+DATASETS = tuple(COLUMNS)
+
+CHECKPOINT_FILE = "checkpoint.json"
+_ALL_SEVERITIES = ("info", "warning", "critical")
+
+
+def _float(value):
+    return float(value) if value is not None else None
+
+
+def _iso_time(epoch):
+    if epoch is None:
+        return None
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class _Part:
+    """A part file being written; renamed into place by commit()"""
+
+    extension = None
+
+    def __init__(self, path, columns):
+        self.path = path
+        (directory, name) = os.path.split(path)
+        self.tmp = os.path.join(directory, f".{name}.tmp")
+        self.columns = columns
+        self.rows = 0
+        self.begun = time.monotonic()
+
+    def write(self, rows):
+        raise NotImplementedError
+
+    def _close(self):
+        raise NotImplementedError
+
+    def commit(self):
+        self._close()
+        os.replace(self.tmp, self.path)
+
+    def abort(self):
+        self._close()
+        os.remove(self.tmp)
+
+    def _formatted(self, row):
+        """row with time columns as ISO 8601 UTC strings"""
+        return [
+            _iso_time(value) if kind == "time" else value
+            for ((_, kind), value) in zip(self.columns, row)
+        ]
+
+
+class _CsvPart(_Part):
+    extension = "csv"
+
+    def __init__(self, path, columns):
+        super().__init__(path, columns)
+        self._file = open(self.tmp, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow([name for (name, _) in columns])
+
+    def write(self, rows):
+        self._writer.writerows(self._formatted(row) for row in rows)
+        self.rows += len(rows)
+
+    def _close(self):
+        self._file.close()
+
+
+class _NdjsonPart(_Part):
+    extension = "ndjson"
+
+    def __init__(self, path, columns):
+        super().__init__(path, columns)
+        self._file = open(self.tmp, "w", encoding="utf-8")
+        self._names = [name for (name, _) in columns]
+
+    def write(self, rows):
+        for row in rows:
+            record = dict(zip(self._names, self._formatted(row)))
+            self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.rows += len(rows)
+
+    def _close(self):
+        self._file.close()
+
+
+class _ParquetPart(_Part):
+    """Rows are buffered into row groups of at most row_group rows"""
+
+    extension = "parquet"
+    row_group = 64 * 1024
+
+    def __init__(self, path, columns):
+        super().__init__(path, columns)
+        # pyarrow is an optional dependency
+        import pyarrow
+        import pyarrow.parquet
+
+        types = {
+            "string": pyarrow.string(),
+            "float": pyarrow.float64(),
+            "time": pyarrow.timestamp("ms", tz="UTC"),
+        }
+        self._pa = pyarrow
+        self._schema = pyarrow.schema([(name, types[kind]) for (name, kind) in columns])
+        self._writer = pyarrow.parquet.ParquetWriter(self.tmp, self._schema)
+        self._buffer = []
+
+    def write(self, rows):
+        self._buffer.extend(rows)
+        self.rows += len(rows)
+        if len(self._buffer) >= self.row_group:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        arrays = []
+        for (values, (_, kind), field) in zip(
+            zip(*self._buffer), self.columns, self._schema
+        ):
+            if kind == "time":
+                values = [None if v is None else int(v * 1000) for v in values]
+            arrays.append(self._pa.array(values, type=field.type))
+        self._writer.write_table(
+            self._pa.Table.from_arrays(arrays, schema=self._schema)
+        )
+        self._buffer = []
+
+    def _close(self):
+        self._flush()
+        self._writer.close()
+
+
+_PARTS = {
+    FORMAT_CSV: _CsvPart,
+    FORMAT_NDJSON: _NdjsonPart,
+    FORMAT_PARQUET: _ParquetPart,
+}
+
+
+class Checkpoint:
+    """Progress of an export: its settings, the requests whose rows are committed, and
+    the next part number of each dataset. Saved atomically as JSON."""
+
+    def __init__(self, path):
+        self.path = path
+        self.settings = None
+        self.done = set()
+        self.parts = {}
+        try:
+            with open(path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        self.settings = saved["settings"]
+        self.done = set(saved["done"])
+        self.parts = saved["parts"]
+
+    def next_part(self, dataset):
+        number = self.parts.get(dataset, 0)
+        self.parts[dataset] = number + 1
+        return number
+
+    def save(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "settings": self.settings,
+                    "done": sorted(self.done),
+                    "parts": self.parts,
+                },
+                f,
+            )
+        os.replace(tmp, self.path)
+
+
+class ExportSummary:
+    """Outcome of export_account()."""
+
+    __slots__ = ("rows", "requests", "skipped", "failed", "elapsed")
+
+    def __init__(self):
+        self.rows = {}  # dataset -> rows written
+        self.requests = 0  # requests completed by this run
+        self.skipped = 0  # requests already completed by an earlier run
+        self.failed = {}  # request key -> exception, fetched again on resume
+        self.elapsed = 0.0
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    def __repr__(self):
+        return "<{0}: {1} rows, {2} requests, {3} skipped, {4} failed>".format(
+            self.__class__.__name__,
+            sum(self.rows.values()),
+            self.requests,
+            self.skipped,
+            len(self.failed),
+        )
+
+
+def _items(response, what):
+    """Items of a response, raising FloError if the request failed (query() returns
+    None) so that it is retried rather than recorded as empty"""
+    if response is None:
+        raise FloError(f"Failed to load {what}")
+    return response.get("items") or []
+
+
+def _consumption_rows(device_id, location_id, response):
+    return [
+        (
+            device_id,
+            location_id,
+            parse_flo_time(item["time"]),
+            _float(item.get("gallonsConsumed") or 0),
+        )
+        for item in _items(response, f"consumption of {device_id}")
+    ]
+
+
+def _telemetry_rows(device_id, location_id, response):
+    return [
+        (
+            device_id,
+            location_id,
+            parse_flo_time(item["time"]),
+            _float(item.get("averageGpm")),
+            _float(item.get("averagePsi")),
+            _float(item.get("averageTempF")),
+        )
+        for item in _items(response, f"telemetry history of {device_id}")
+    ]
+
+
+def _alert_rows(alerts, start, end):
+    """Rows of the alerts (newest first) created within [start, end] epoch seconds"""
+    rows = []
+    for alert in alerts:
+        created = alert_time(alert)
+        if created is not None and created > end:
+            continue
+        if created is not None and created < start:
+            break
+        alarm = alert.get("alarm") or {}
+        rows.append(
+            (
+                alert.get("id"),
+                alert.get("locationId"),
+                alert.get("deviceId"),
+                alert.get("status"),
+                alarm.get("severity"),
+                None if alarm.get("id") is None else str(alarm.get("id")),
+                alert.get("displayTitle"),
+                alert.get("displayMessage"),
+                created,
+            )
+        )
+    return rows
+
+
+def _requests(flo, datasets, startDate, endDate, interval):
+    """Yield (key, dataset, fetch) for every request of the export, where fetch()
+    returns the rows of the request"""
+    windows = split_range(
+        startDate, endDate, timedelta(days=FLO_CONSUMPTION_CHUNK_DAYS.get(interval, 7))
+    )
+    if flo.data() is None:
+        raise FloError("Failed to load the locations of the account")
+    for location in flo.locations():
+        location_id = location["id"]
+        if DATASET_ALERTS in datasets:
+            yield (
+                f"{DATASET_ALERTS}/{location_id}",
+                DATASET_ALERTS,
+                lambda location_id=location_id: _alert_rows(
+                    flo.iter_alerts(location_id, _ALL_SEVERITIES, status=None),
+                    startDate.timestamp(),
+                    endDate.timestamp(),
+                ),
+            )
+        for device in location.get("devices", []):
+            device_id = device["id"]
+            for (start, end) in windows:
+                window = format_flo_time(start)
+                if DATASET_CONSUMPTION in datasets:
+                    yield (
+                        f"{DATASET_CONSUMPTION}/{device_id}/{window}",
+                        DATASET_CONSUMPTION,
+                        lambda d=device_id, loc=location_id, s=start, e=end: (
+                            _consumption_rows(
+                                d, loc, flo.consumption(d, s, e, interval)
+                            )
+                        ),
+                    )
+                if DATASET_TELEMETRY in datasets:
+                    yield (
+                        f"{DATASET_TELEMETRY}/{device_id}/{window}",
+                        DATASET_TELEMETRY,
+                        lambda d=device_id, loc=location_id, s=start, e=end: (
+                            _telemetry_rows(
+                                d, loc, flo.water_metrics(d, s, e, interval)
+                            )
+                        ),
+                    )
+
+
+def export_account(
+    flo,
+    output,
+    startDate,
+    endDate=None,
+    datasets=DATASETS,
+    file_format=FORMAT_CSV,
+    interval=INTERVAL_HOURLY,
+    max_workers=FLO_EXPORT_WORKERS,
+    rate=FLO_EXPORT_RATE,
+    part_rows=FLO_EXPORT_PART_ROWS,
+    checkpoint_interval=FLO_EXPORT_CHECKPOINT_SECONDS,
+    retries=2,
+    progress=None,
+):
+    """Export datasets of every device in flo's account over [startDate, endDate] into
+    the directory output, resuming from its checkpoint if it holds an earlier run of
+    the same export. Returns an ExportSummary; failed requests are left out of the
+    checkpoint so that running the export again retries them.
+
+    :param startDate: datetime to export from (naive means local time)
+    :param endDate: datetime to export to (default: now, fixed by the first run)
+    :param datasets: names of the datasets to export (default: all of DATASETS)
+    :param file_format: FORMAT_CSV, FORMAT_NDJSON or FORMAT_PARQUET
+    :param max_workers: requests in flight at once
+    :param rate: maximum requests per second
+    :param part_rows: rows after which a part file is completed and a new one begun
+    :param checkpoint_interval: seconds after which a part file is completed anyway
+        and the checkpoint saved, bounding the work an interruption loses
+    :param progress: function called with the ExportSummary after each request
+    """
+    if file_format not in _PARTS:
+        raise ValueError(f"unknown export format {file_format}")
+    unknown = set(datasets) - set(DATASETS)
+    if unknown:
+        raise ValueError(f"unknown datasets {sorted(unknown)}")
+    if file_format == FORMAT_PARQUET:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise FloError("Parquet export requires pyarrow (pip install pyarrow)")
+
+    startDate = to_utc(startDate)
+    if endDate is not None:
+        endDate = to_utc(endDate)
+    os.makedirs(output, exist_ok=True)
+    checkpoint = Checkpoint(os.path.join(output, CHECKPOINT_FILE))
+    settings = {
+        "user_id": flo.user_id,
+        "startDate": format_flo_time(startDate),
+        "endDate": format_flo_time(endDate) if endDate else None,
+        "datasets": sorted(datasets),
+        "format": file_format,
+        "interval": interval,
+    }
+    if checkpoint.settings is not None:
+        if endDate is None:
+            settings["endDate"] = checkpoint.settings["endDate"]
+        if checkpoint.settings != settings:
+            raise FloError(
+                f"{output} holds a different export ({checkpoint.settings}); "
+                "use another directory"
+            )
+    elif endDate is None:
+        settings["endDate"] = format_flo_time(datetime.now(timezone.utc))
+    checkpoint.settings = settings
+    endDate = datetime.fromtimestamp(parse_flo_time(settings["endDate"]), timezone.utc)
+
+    summary = ExportSummary()
+    parts = {}  # dataset -> _Part being written
+    uncommitted = {dataset: [] for dataset in datasets}  # keys of rows in parts
+    for dataset in datasets:
+        summary.rows[dataset] = 0
+        directory = os.path.join(output, dataset)
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.endswith(".tmp"):  # a part interrupted by an earlier run
+                os.remove(os.path.join(directory, name))
+
+    def write(dataset, key, rows):
+        part = parts.get(dataset)
+        if part is None:
+            cls = _PARTS[file_format]
+            number = checkpoint.next_part(dataset)
+            filename = f"part-{number:05d}.{cls.extension}"
+            part = parts[dataset] = cls(
+                os.path.join(output, dataset, filename), COLUMNS[dataset]
+            )
+        part.write(rows)
+        summary.rows[dataset] += len(rows)
+        uncommitted[dataset].append(key)
+        if part.rows >= part_rows:
+            commit(dataset)
+        # also complete parts of datasets that no longer receive rows
+        now = time.monotonic()
+        for (name, open_part) in list(parts.items()):
+            if now - open_part.begun >= checkpoint_interval:
+                commit(name)
+
+    def commit(dataset):
+        part = parts.pop(dataset, None)
+        if part is None:
+            return
+        if part.rows:
+            part.commit()
+        else:
+            part.abort()
+            checkpoint.parts[dataset] -= 1
+        checkpoint.done.update(uncommitted[dataset])
+        uncommitted[dataset] = []
+        checkpoint.save()
+
+    limiter = RateLimiter(rate)
+
+    def fetch(key, fetch_rows):
+        for attempt in range(retries + 1):
+            limiter.acquire()
+            try:
+                return fetch_rows()
+            except Exception as e:
+                error = e
+            LOG.debug(
+                "Export request %s failed (attempt %s): %s", key, attempt + 1, error
+            )
+            if attempt < retries:
+                time.sleep(2**attempt)
+        raise error
+
+    start = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers, "pyflowater-export")
+    pending = {}  # future -> (key, dataset)
+
+    def drain(block):
+        (done, _) = wait(pending, None if block else 0, FIRST_COMPLETED)
+        for future in done:
+            (key, dataset) = pending.pop(future)
+            try:
+                rows = future.result()
+            except Exception as e:
+                LOG.warning("Failed exporting %s: %s", key, e)
+                summary.failed[key] = e
+                continue
+            write(dataset, key, rows)
+            summary.requests += 1
+            if progress:
+                progress(summary)
+
+    try:
+        for (key, dataset, fetch_rows) in _requests(
+            flo, datasets, startDate, endDate, interval
+        ):
+            if key in checkpoint.done:
+                summary.skipped += 1
+                continue
+            # bound the responses held in memory to those in flight
+            while len(pending) >= 2 * max_workers:
+                drain(block=True)
+            pending[executor.submit(fetch, key, fetch_rows)] = (key, dataset)
+            drain(block=False)
+        while pending:
+            drain(block=True)
+        for dataset in datasets:
+            commit(dataset)
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+        for part in parts.values():  # interrupted: leave rows for the next run
+            part.abort()
+
+    summary.elapsed = time.monotonic() - start
+    return summary
@@ -1,19 +1,44 @@
 """Code relating to the firestore API Flo use to stream live data."""
 
+import logging
 import json
 import threading
+import time
+from datetime import datetime, timezone
 
 import requests
-from google.cloud import firestore
-from google.oauth2.credentials import Credentials
 
 from pyflowater.const import (
     FIREBASE_REST_API,
     FLO_FIRESTORE_PROJECT,
+    FLO_FIRESTORE_REFRESH_MARGIN,
     FLO_GOOGLE_API_KEY,
     FLO_HEARTBEAT_DELAY,
 )
 
+LOG = logging.getLogger(__name__)
+
+
+def _firestore_client(tinfo):
+    """Return (client, credentials) for Flo's firestore database given token info.
+
+    google-cloud-firestore pulls in the whole gRPC/protobuf stack, so it is only
+    imported once a real-time listener is actually started."""
+    try:
+        from google.cloud import firestore
+        from google.oauth2.credentials import Credentials
+    except ImportError as e:
+        from pyflowater import FloError  # imported here; pyflowater imports this module
+
+        raise FloError(
+            "Real-time listeners require google-cloud-firestore "
+            "(pip install pyflowater[firestore])"
+        ) from e
+
+    credentials = Credentials(tinfo["idToken"], refresh_token=tinfo["refreshToken"])
+    client = firestore.Client(project=FLO_FIRESTORE_PROJECT, credentials=credentials)
+    return (client, credentials)
+
 
 def _get_token_info(token):
     url = f"{FIREBASE_REST_API}/verifyCustomToken?key={FLO_GOOGLE_API_KEY}"
@@ -23,14 +48,49 @@ def _get_token_info(token):
     return resp.json()
 
 
+class FirestoreBackend:
+    """Exchanges Flo custom tokens and creates firestore clients. Replaceable (e.g. by
+    the FakeFirestore of benchmarks/flostub.py) to stream without Google's servers."""
+
+    def token_info(self, token):
+        """Exchange a Flo custom token for firebase token info (idToken, refreshToken,
+        expiresIn)"""
+        return _get_token_info(token)
+
+    def client(self, tinfo):
+        """Return (client, credentials) given token info"""
+        return _firestore_client(tinfo)
+
+
 class FloListener:
     """Flo firestore listener class."""
 
-    def __init__(self, heartbeat, token, deviceId, callback):
+    def __init__(
+        self,
+        heartbeat,
+        token,
+        deviceId,
+        callback,
+        dispatcher=None,
+        observers=(),
+        key=None,
+        backend=None,
+    ):
+        """
+        If a TelemetryDispatcher is given, snapshots are handed to it instead of
+        calling callback on the firestore watch thread. Every snapshot is also passed
+        to observer.record_snapshot(key, snapshot) of each observer (such as a
+        TelemetryHistory or DeviceCache). key defaults to deviceId, the firestore
+        document id. backend is the FirestoreBackend used to connect.
+        """
+        self._backend = backend or FirestoreBackend()
         self._heartbeat_func = heartbeat
         self._token = token
         self._deviceId = deviceId
         self._callback = callback
+        self._dispatcher = dispatcher
+        self._observers = list(observers)
+        self._key = key or deviceId
         self._watch = None
         self._client = None
         self._doc_ref = None
@@ -47,10 +107,8 @@ class FloListener:
         if self._watch:
             return
         if not self._client:
-            tinfo = _get_token_info(self._token)
-            creds = Credentials(tinfo["idToken"], refresh_token=tinfo["refreshToken"])
-            self._client = firestore.Client(
-                project=FLO_FIRESTORE_PROJECT, credentials=creds
+            (self._client, _) = self._backend.client(
+                self._backend.token_info(self._token)
             )
         if not self._doc_ref:
             self._doc_ref = self._client.collection("devices").document(self._deviceId)
@@ -72,7 +130,12 @@ class FloListener:
             self._heartbeat = None
 
     def _handle(self, document, changes, timestamp):
-        self._callback(document[0].to_dict())
+        for observer in self._observers:
+            observer.record_snapshot(self._key, document[0])
+        if self._dispatcher:
+            self._dispatcher.submit(self._key, document[0])
+        else:
+            self._callback(document[0].to_dict())
 
     def _do_heartbeat(self):
         if not self._watch:
@@ -81,3 +144,171 @@ class FloListener:
         self._heartbeat_func()
         self._heartbeat = threading.Timer(FLO_HEARTBEAT_DELAY, self._do_heartbeat)
         self._heartbeat.start()
+
+
+class FloListenerManager:
+    """Streams many devices of one Flo account over a single firestore client.
+
+    The firestore token exchange, the client and the presence heartbeat are shared by
+    every subscribed device and handled by one background thread, which also refreshes
+    the firestore credentials shortly before they expire."""
+
+    def __init__(
+        self,
+        heartbeat,
+        get_token,
+        get_mac,
+        dispatcher=None,
+        observers=(),
+        backend=None,
+    ):
+        """
+        :param heartbeat: function sending the account presence heartbeat, or None
+        :param get_token: function returning a new firestore custom token
+        :param get_mac: function returning the MAC address of a device_id
+        :param dispatcher: optional TelemetryDispatcher receiving every snapshot (keyed
+            by device_id) off the firestore watch thread, in place of callbacks
+        :param observers: objects whose record_snapshot(device_id, snapshot) is called
+            for every snapshot (such as a TelemetryHistory or DeviceCache)
+        :param backend: FirestoreBackend used to connect (default: Flo's firestore)
+        """
+        self._backend = backend or FirestoreBackend()
+        self._dispatcher = dispatcher
+        self._observers = list(observers)
+        self._heartbeat_func = heartbeat
+        self._get_token = get_token
+        self._get_mac = get_mac
+        self._client = None
+        self._credentials = None
+        self._next_refresh = 0
+        self._subscriptions = {}  # device_id -> [watch, [callbacks]]
+        self._lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._next_heartbeat = 0
+
+    @property
+    def device_ids(self):
+        """device_ids currently subscribed"""
+        return list(self._subscriptions)
+
+    def _connect(self):
+        tinfo = self._backend.token_info(self._get_token())
+        expiry = time.time() + int(tinfo.get("expiresIn", 3600))
+        self._next_refresh = expiry - FLO_FIRESTORE_REFRESH_MARGIN
+        if self._credentials is None:
+            (self._client, self._credentials) = self._backend.client(tinfo)
+        else:
+            # existing watches share this credentials object, so updating it in place
+            # refreshes every subscription at once
+            self._credentials.token = tinfo["idToken"]
+        # google-auth expects a naive UTC expiry
+        self._credentials.expiry = datetime.fromtimestamp(expiry, timezone.utc).replace(
+            tzinfo=None
+        )
+
+    def subscribe(self, device_id, callback=None):
+        """Start streaming device_id to callback, which is called with the dictionary of
+        device state described in PyFlo.get_real_time_listener().
+
+        Note that each new device immediately receives its current state, which incurs
+        server-side costs, so avoid subscribing and unsubscribing on a whim.
+
+        callback may be None if the manager has a dispatcher."""
+        with self._lock:
+            subscription = self._subscriptions.get(device_id)
+            if subscription:
+                if callback and callback not in subscription[1]:
+                    subscription[1].append(callback)
+                return
+
+            if self._client is None:
+                self._connect()
+            callbacks = [callback] if callback else []
+            doc_ref = self._client.collection("devices").document(
+                self._get_mac(device_id)
+            )
+            watch = doc_ref.on_snapshot(
+                lambda document, changes, timestamp: self._handle(
+                    device_id, callbacks, document
+                )
+            )
+            self._subscriptions[device_id] = [watch, callbacks]
+            self._start()
+
+    def unsubscribe(self, device_id, callback=None):
+        """Stop sending device_id updates to callback (or to all callbacks if None)"""
+        with self._lock:
+            subscription = self._subscriptions.get(device_id)
+            if not subscription:
+                return
+            if callback is not None and callback in subscription[1]:
+                subscription[1].remove(callback)
+            if callback is None or not subscription[1]:
+                subscription[0].close()
+                del self._subscriptions[device_id]
+            if not self._subscriptions:
+                self._wakeup.set()
+
+    def stop(self):
+        """Unsubscribe every device and stop the background thread."""
+        with self._lock:
+            for device_id in list(self._subscriptions):
+                self.unsubscribe(device_id)
+
+    def _handle(self, device_id, callbacks, document):
+        if not document:
+            return
+        for observer in self._observers:
+            observer.record_snapshot(device_id, document[0])
+        if self._dispatcher:
+            self._dispatcher.submit(device_id, document[0])
+            return
+        data = document[0].to_dict()
+        for callback in list(callbacks):
+            try:
+                callback(data)
+            except Exception:
+                LOG.exception("Error in Flo listener callback")
+
+    def _start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        # heartbeat right away so the first subscription gets current data promptly
+        self._next_heartbeat = time.time()
+        self._wakeup.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="FloListenerManager", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._subscriptions:
+                    self._thread = None
+                    return
+
+            now = time.time()
+            # subscribe() and unsubscribe() use the client and credentials under the
+            # same lock, so they never see them half refreshed
+            with self._lock:
+                try:
+                    if now >= self._next_refresh:
+                        self._connect()
+                except Exception:
+                    LOG.exception("Failed refreshing Flo firestore credentials")
+                    self._next_refresh = now + FLO_HEARTBEAT_DELAY
+            try:
+                if self._heartbeat_func and now >= self._next_heartbeat:
+                    self._heartbeat_func()
+            except Exception:
+                LOG.exception("Failed sending Flo heartbeat")
+            if now >= self._next_heartbeat:
+                self._next_heartbeat = now + FLO_HEARTBEAT_DELAY
+
+            wake = self._next_refresh
+            if self._heartbeat_func:
+                wake = min(wake, self._next_heartbeat)
+            self._wakeup.wait(max(1.0, wake - time.time()))
+            self._wakeup.clear()
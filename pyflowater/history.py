@@ -0,0 +1,239 @@
+"""Bounded in-memory history of device telemetry with rolling statistics.
+
+Samples are stored column-wise in fixed-size, array-backed ring buffers (one per
+device), so memory use is constant however long a process streams. Mean, min, max
+and continuous flow duration over the buffered window are maintained incrementally
+as samples arrive and are evicted.
+"""
+
+import math
+import threading
+import time
+from array import array
+from collections import deque
+
+from pyflowater.const import FLO_TELEMETRY_HISTORY_SIZE
+from pyflowater.dispatch import get_field
+from pyflowater.timeutil import parse_flo_time
+
+FIELDS = ("psi", "gpm", "tempF")
+
+
+class _RollingField:
+    """Running sum and monotonic min/max queues of one column of a ring."""
+
+    __slots__ = ("values", "total", "count", "min_seqs", "max_seqs")
+
+    def __init__(self, capacity):
+        self.values = array("d", bytes(8 * capacity))
+        self.total = 0.0
+        self.count = 0  # samples in the window with a value (not NaN)
+        self.min_seqs = deque()  # sequence numbers with increasing values
+        self.max_seqs = deque()  # sequence numbers with decreasing values
+
+
+class TelemetryRing:
+    """Fixed-capacity ring buffer of one device's telemetry samples."""
+
+    def __init__(self, capacity=FLO_TELEMETRY_HISTORY_SIZE):
+        self.capacity = capacity
+        self.times = array("d", bytes(8 * capacity))  # epoch seconds
+        self._fields = {field: _RollingField(capacity) for field in FIELDS}
+        self._seq = 0  # sequence number of the next sample
+        self._flow_since = None  # time continuous flow began, if flowing
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self._seq, self.capacity)
+
+    @property
+    def last_time(self):
+        if not self._seq:
+            return None
+        return self.times[(self._seq - 1) % self.capacity]
+
+    def append(self, timestamp, psi=math.nan, gpm=math.nan, tempF=math.nan):
+        """Add a sample, evicting the oldest once full. Missing values are NaN."""
+        with self._lock:
+            seq = self._seq
+            slot = seq % self.capacity
+            evicted = seq - self.capacity  # sequence number leaving the window
+
+            self.times[slot] = timestamp
+            for (field, value) in (("psi", psi), ("gpm", gpm), ("tempF", tempF)):
+                rolling = self._fields[field]
+                if evicted >= 0:
+                    old = rolling.values[slot]
+                    if not math.isnan(old):
+                        rolling.total -= old
+                        rolling.count -= 1
+                    if rolling.min_seqs and rolling.min_seqs[0] == evicted:
+                        rolling.min_seqs.popleft()
+                    if rolling.max_seqs and rolling.max_seqs[0] == evicted:
+                        rolling.max_seqs.popleft()
+
+                value = math.nan if value is None else float(value)
+                rolling.values[slot] = value
+                if math.isnan(value):
+                    continue
+                rolling.total += value
+                rolling.count += 1
+                values = rolling.values
+                capacity = self.capacity
+                while (
+                    rolling.min_seqs
+                    and values[rolling.min_seqs[-1] % capacity] >= value
+                ):
+                    rolling.min_seqs.pop()
+                rolling.min_seqs.append(seq)
+                while (
+                    rolling.max_seqs
+                    and values[rolling.max_seqs[-1] % capacity] <= value
+                ):
+                    rolling.max_seqs.pop()
+                rolling.max_seqs.append(seq)
+
+            if gpm is not None and not math.isnan(gpm):
+                if gpm > 0:
+                    if self._flow_since is None:
+                        self._flow_since = timestamp
+                else:
+                    self._flow_since = None
+            self._seq = seq + 1
+
+    def mean(self, field):
+        rolling = self._fields[field]
+        return rolling.total / rolling.count if rolling.count else math.nan
+
+    def min(self, field):
+        rolling = self._fields[field]
+        if not rolling.min_seqs:
+            return math.nan
+        return rolling.values[rolling.min_seqs[0] % self.capacity]
+
+    def max(self, field):
+        rolling = self._fields[field]
+        if not rolling.max_seqs:
+            return math.nan
+        return rolling.values[rolling.max_seqs[0] % self.capacity]
+
+    @property
+    def continuous_flow(self):
+        """Seconds water has been flowing without a zero gpm sample (0 if not flowing)"""
+        if self._flow_since is None:
+            return 0.0
+        return self.last_time - self._flow_since
+
+    def stats(self):
+        """Rolling statistics over the buffered window"""
+        result = {"samples": len(self), "continuous_flow": self.continuous_flow}
+        for field in FIELDS:
+            result[field] = {
+                "mean": self.mean(field),
+                "min": self.min(field),
+                "max": self.max(field),
+            }
+        return result
+
+    def views(self, column):
+        """Return the chronologically ordered memoryview segments (one, or two when the
+        ring has wrapped) of a column ("times" or a field), without copying"""
+        values = self.times if column == "times" else self._fields[column].values
+        view = memoryview(values)
+        if self._seq <= self.capacity:
+            return [view[: self._seq]]
+        start = self._seq % self.capacity
+        return [view[start:], view[:start]]
+
+    def window(self, seconds, now=None):
+        """Return {column: [segments]} for samples in the last seconds, without copying"""
+        if now is None:
+            now = time.time()
+        cutoff = now - seconds
+        n = len(self)
+        # samples are in time order, so binary search the logical index of the cutoff
+        first = self._seq - n
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.times[(first + mid) % self.capacity] < cutoff:
+                lo = mid + 1
+            else:
+                hi = mid
+        result = {}
+        for column in ("times",) + FIELDS:
+            segments = self.views(column)
+            skip = lo
+            trimmed = []
+            for segment in segments:
+                if skip >= len(segment):
+                    skip -= len(segment)
+                    continue
+                trimmed.append(segment[skip:])
+                skip = 0
+            result[column] = trimmed
+        return result
+
+
+class TelemetryHistory:
+    """TelemetryRing per device, fed from real-time listeners and polled telemetry()."""
+
+    def __init__(self, capacity=FLO_TELEMETRY_HISTORY_SIZE):
+        self.capacity = capacity
+        self._rings = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, device_id):
+        return device_id in self._rings
+
+    def ring(self, device_id):
+        """Return the TelemetryRing of device_id, creating it if needed"""
+        ring = self._rings.get(device_id)
+        if ring is None:
+            with self._lock:
+                ring = self._rings.setdefault(device_id, TelemetryRing(self.capacity))
+        return ring
+
+    def record(self, device_id, current):
+        """Record a telemetry["current"] dictionary (as returned by PyFlo.telemetry()).
+        Samples not newer than the last recorded one (e.g. repeated polls) are skipped."""
+        self._record(
+            device_id,
+            current.get("updated"),
+            current.get("psi"),
+            current.get("gpm"),
+            current.get("tempF"),
+        )
+
+    def record_snapshot(self, device_id, snapshot):
+        """Record a device document from a listener: a firestore DocumentSnapshot or a
+        dictionary. Only the telemetry fields are read."""
+        self._record(
+            device_id,
+            get_field(snapshot, "telemetry.current.updated"),
+            get_field(snapshot, "telemetry.current.psi"),
+            get_field(snapshot, "telemetry.current.gpm"),
+            get_field(snapshot, "telemetry.current.tempF"),
+        )
+
+    def _record(self, device_id, updated, psi, gpm, tempF):
+        timestamp = time.time()
+        if updated:
+            try:
+                timestamp = parse_flo_time(updated)
+            except ValueError:
+                pass
+        ring = self.ring(device_id)
+        last = ring.last_time
+        if last is not None and timestamp <= last:
+            return
+        ring.append(
+            timestamp,
+            math.nan if psi is None else psi,
+            math.nan if gpm is None else gpm,
+            math.nan if tempF is None else tempF,
+        )
+
+    def stats(self, device_id):
+        """Rolling statistics of device_id (see TelemetryRing.stats())"""
+        return self.ring(device_id).stats()
@@ -0,0 +1,267 @@
+"""HTTP response cache for GET requests to the Flo cloud.
+
+Responses carrying an ETag or Last-Modified validator, or a Cache-Control max-age,
+are stored. A stored response is reused without a request while it is fresh, and
+is otherwise revalidated with If-None-Match/If-Modified-Since so that an unchanged
+resource costs a 304 with no body instead of a full download. Entries are keyed by
+user id, URL and query parameters, so one cache can be shared by many accounts.
+
+Compression needs no help from the cache: requests negotiates gzip (and br, if the
+brotli package is installed) and transparently decodes it.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlencode
+
+from pyflowater.const import FLO_HTTP_CACHE_BYTES
+
+
+class CacheEntry:
+    """A cached response body and its validators."""
+
+    __slots__ = ("body", "etag", "last_modified", "expires")
+
+    def __init__(self, body, etag=None, last_modified=None, expires=0.0):
+        self.body = body  # decoded (uncompressed) response bytes
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires  # epoch seconds the entry is fresh until
+
+    @property
+    def size(self):
+        return len(self.body)
+
+    def to_dict(self):
+        return {
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "expires": self.expires,
+        }
+
+
+class CacheBackend:
+    """Storage of CacheEntry by key. Subclass to keep responses elsewhere."""
+
+    def get(self, key):
+        """Return the entry stored for key, or None"""
+        raise NotImplementedError
+
+    def set(self, key, entry):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class MemoryCache(CacheBackend):
+    """Least recently used entries in memory, evicted beyond max_bytes of bodies."""
+
+    def __init__(self, max_bytes=FLO_HTTP_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0  # bytes of bodies held
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        if entry.size > self.max_bytes:
+            self.delete(key)
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous.size
+            self._entries[key] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                (_, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted.size
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry.size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class DiskCache(CacheBackend):
+    """Entries stored as files in a directory (readable only by the owner), so they
+    survive restarts. Each file holds a JSON header line followed by the body."""
+
+    def __init__(self, path):
+        self._path = path
+        os.makedirs(path, mode=0o700, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self._path, hashlib.sha256(key.encode()).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._file(key), "rb") as f:
+                header = json.loads(f.readline())
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        if header.get("key") != key:
+            return None
+        return CacheEntry(
+            body, header.get("etag"), header.get("last_modified"), header["expires"]
+        )
+
+    def set(self, key, entry):
+        filename = self._file(key)
+        tmp = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+        header = json.dumps({"key": key, **entry.to_dict()}).encode()
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(header + b"\n")
+            f.write(entry.body)
+        os.replace(tmp, filename)
+
+    def delete(self, key):
+        try:
+            os.remove(self._file(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self._path):
+            try:
+                os.remove(os.path.join(self._path, name))
+            except OSError:
+                pass
+
+
+def _cache_control(value):
+    """Parse a Cache-Control header into {directive: value or True}"""
+    directives = {}
+    for part in (value or "").split(","):
+        (name, _, arg) = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('"') or True
+    return directives
+
+
+def _expires(headers, now):
+    """Epoch seconds a response is fresh until (now if it must be revalidated)"""
+    directives = _cache_control(headers.get("Cache-Control"))
+    if "no-cache" in directives:
+        return now
+    try:
+        return now + int(directives["max-age"])
+    except (KeyError, ValueError):
+        pass
+    try:
+        return parsedate_to_datetime(headers["Expires"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return now
+
+
+class HttpCache:
+    """Conditional request cache used by PyFlo.query() for GET requests.
+
+    Counters: hits (fresh responses reused without a request), revalidated (304
+    responses), misses (full downloads) and bytes_saved (body bytes not downloaded
+    thanks to hits and 304s)."""
+
+    def __init__(self, backend=None):
+        """:param backend: CacheBackend (default: MemoryCache())"""
+        self.backend = backend if backend is not None else MemoryCache()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "bytes_saved": self.bytes_saved,
+        }
+
+    def key(self, user_id, url, params=None):
+        """Cache key of a request; params is a dictionary or a list of pairs"""
+        if params:
+            items = params.items() if isinstance(params, dict) else params
+            query = urlencode(sorted(items, key=lambda item: item[0]))
+            url = f"{url}{'&' if '?' in url else '?'}{query}"
+        return f"{user_id} {url}"
+
+    def lookup(self, key, revalidate=False):
+        """Return (entry, fresh) for key; entry is None if nothing is cached, and
+        fresh is True if it may be used without a request"""
+        entry = self.backend.get(key)
+        if entry is None:
+            return (None, False)
+        if not revalidate and time.time() < entry.expires:
+            with self._lock:
+                self.hits += 1
+                self.bytes_saved += entry.size
+            return (entry, True)
+        return (entry, False)
+
+    def conditional_headers(self, entry):
+        headers = {}
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def not_modified(self, key, entry, response):
+        """Record a 304 response to a conditional request for entry"""
+        entry.expires = _expires(response.headers, time.time())
+        entry.etag = response.headers.get("ETag", entry.etag)
+        self.backend.set(key, entry)
+        with self._lock:
+            self.revalidated += 1
+            self.bytes_saved += entry.size
+
+    def store(self, key, response):
+        """Record a 200 response, caching it if it can be reused or revalidated"""
+        with self._lock:
+            self.misses += 1
+        headers = response.headers
+        if "no-store" in _cache_control(headers.get("Cache-Control")):
+            self.backend.delete(key)
+            return
+        now = time.time()
+        entry = CacheEntry(
+            response.content,
+            headers.get("ETag"),
+            headers.get("Last-Modified"),
+            _expires(headers, now),
+        )
+        if entry.etag or entry.last_modified or entry.expires > now:
+            self.backend.set(key, entry)
+
+    def clear(self):
+        self.backend.clear()
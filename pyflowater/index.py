@@ -0,0 +1,67 @@
+"""Lookup index of the devices registered with a Flo account."""
+
+
+class DeviceIndex:
+    """Maps device ids, MAC addresses and locations to each other in O(1).
+
+    Built from the locations list of the users/<id>?expand=locations payload."""
+
+    def __init__(self, locations=None):
+        self._by_device = {}  # device_id -> (location_id, mac_address)
+        self._by_mac = {}  # mac_address -> device_id
+        self._by_location = {}  # location_id -> [device_id, ...]
+        if locations is not None:
+            self.rebuild(locations)
+
+    def __len__(self):
+        return len(self._by_device)
+
+    def __contains__(self, device_id):
+        return device_id in self._by_device
+
+    def rebuild(self, locations):
+        """Replace the index contents with the devices in locations"""
+        by_device = {}
+        by_mac = {}
+        by_location = {}
+        for location in locations or []:
+            location_id = location["id"]
+            device_ids = by_location.setdefault(location_id, [])
+            for device in location.get("devices", []):
+                device_id = device["id"]
+                mac_address = device.get("macAddress")
+                by_device[device_id] = (location_id, mac_address)
+                if mac_address:
+                    by_mac[mac_address] = device_id
+                device_ids.append(device_id)
+
+        # swap in whole so concurrent readers never see a partial index
+        self._by_device, self._by_mac, self._by_location = (
+            by_device,
+            by_mac,
+            by_location,
+        )
+
+    def location_mac(self, device_id):
+        """Return (location_id, mac_address) for device_id, or None if unknown"""
+        return self._by_device.get(device_id)
+
+    def location_macs(self):
+        """Return a dict of device_id -> (location_id, mac_address)"""
+        return dict(self._by_device)
+
+    def device_for_mac(self, mac_address):
+        """Return the device_id with the given MAC address, or None if unknown"""
+        return self._by_mac.get(mac_address)
+
+    def devices_at_location(self, location_id):
+        """Return the device_ids installed at location_id"""
+        return list(self._by_location.get(location_id, ()))
+
+    def device_ids(self):
+        """Return all indexed device_ids"""
+        return list(self._by_device)
+
+    def location_ids(self):
+        """Return all indexed location_ids"""
+        return list(self._by_location)
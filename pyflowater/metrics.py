@@ -0,0 +1,98 @@
+"""Instrumentation hooks for requests made to the Flo cloud.
+
+Pass a FloMetrics subclass as PyFlo(metrics=...) to observe every request. Endpoints
+are reported as normalized templates (e.g. /api/v2/devices/{id}) so they can be used
+as metric labels. With no metrics object (the default) query() does no extra work.
+
+An adapter for a metrics library only needs to override the hooks it cares about:
+
+    class PrometheusMetrics(FloMetrics):
+        def request(self, method, endpoint, status, latency, size):
+            REQUESTS.labels(method, endpoint, status).inc()
+            LATENCY.labels(method, endpoint).observe(latency)
+"""
+
+import threading
+from bisect import bisect_left
+
+# upper bounds (seconds) of the latency histogram buckets kept by InMemoryMetrics
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+
+class FloMetrics:
+    """Receives measurements from PyFlo.query(); every hook is a no-op by default."""
+
+    def request(self, method, endpoint, status, latency, size):
+        """An HTTP attempt completed. status is None if the request raised (e.g. a
+        connection error); latency is in seconds and size is the body length in bytes."""
+
+    def retry(self, method, endpoint, status):
+        """An attempt is about to be retried after failing with status (None on error)."""
+
+    def reauth(self, method, endpoint):
+        """The auth token was rejected and the client logged in again."""
+
+    def circuit_open(self, method, endpoint):
+        """A request was refused because the endpoint's circuit breaker is open."""
+
+
+class InMemoryMetrics(FloMetrics):
+    """Aggregates measurements in memory, keyed by (method, endpoint)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def _stats(self, method, endpoint):
+        key = (method, endpoint)
+        stats = self._endpoints.get(key)
+        if stats is None:
+            stats = self._endpoints[key] = {
+                "requests": 0,
+                "latency_sum": 0.0,
+                "latency_buckets": [0] * len(self.buckets),
+                "bytes": 0,
+                "statuses": {},
+                "retries": 0,
+                "reauths": 0,
+                "circuit_open": 0,
+            }
+        return stats
+
+    def request(self, method, endpoint, status, latency, size):
+        with self._lock:
+            stats = self._stats(method, endpoint)
+            stats["requests"] += 1
+            stats["latency_sum"] += latency
+            stats["latency_buckets"][bisect_left(self.buckets, latency)] += 1
+            stats["bytes"] += size
+            stats["statuses"][status] = stats["statuses"].get(status, 0) + 1
+
+    def retry(self, method, endpoint, status):
+        with self._lock:
+            self._stats(method, endpoint)["retries"] += 1
+
+    def reauth(self, method, endpoint):
+        with self._lock:
+            self._stats(method, endpoint)["reauths"] += 1
+
+    def circuit_open(self, method, endpoint):
+        with self._lock:
+            self._stats(method, endpoint)["circuit_open"] += 1
+
+    def snapshot(self):
+        """Return a copy of the statistics, {(method, endpoint): {...}}"""
+        with self._lock:
+            return {
+                key: {
+                    **stats,
+                    "latency_buckets": list(stats["latency_buckets"]),
+                    "statuses": dict(stats["statuses"]),
+                }
+                for key, stats in self._endpoints.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
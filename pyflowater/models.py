@@ -0,0 +1,266 @@
+"""Optional typed models of Flo API responses.
+
+Each model is a slotted object built from a response, either the raw JSON (bytes or
+str, as returned by PyFlo.query(..., decode=False)) or an already decoded
+dictionary. Nothing is parsed until an attribute is first read; then every field of
+the model is extracted into its slots at once. Models built from raw JSON keep only
+the (compact) bytes and their fields, never the decoded dictionary, so large numbers
+of snapshots take a fraction of the memory of plain dicts. (Models nested in another,
+such as Location.devices, keep their part of the decoded parent.)
+
+The PyFlo methods returning dicts are unchanged; wrap their results, or use
+FloModels to fetch models directly:
+
+    models = FloModels(flo)
+    device = models.device(device_id)
+    device.telemetry.gpm, device.valve.is_open
+"""
+
+from pyflowater import METHOD_GET, _consumption_params, loads
+from pyflowater.alerts import ALERT_PAGE_SIZE, ALERT_SEVERITIES, alert_params
+from pyflowater.const import INTERVAL_HOURLY
+from pyflowater.dispatch import get_field
+from pyflowater.store import ConsumptionSeries
+from pyflowater.timeutil import parse_flo_time
+
+
+def _flo_time(value):
+    try:
+        return parse_flo_time(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _model_list(model):
+    return lambda items: [model(item) for item in items]
+
+
+class Model:
+    """Base of the response models: fields are declared in _FIELDS as
+    {attribute: (dotted JSON path, converter or None)} and must also be __slots__."""
+
+    __slots__ = ("_raw",)
+    _FIELDS = {}
+
+    def __init__(self, raw):
+        """:param raw: JSON bytes or str, or a decoded dictionary"""
+        self._raw = raw
+
+    def __getattr__(self, name):
+        # only called while the slot is unset, i.e. before the first parse
+        if name not in self._FIELDS:
+            raise AttributeError(name)
+        self._parse()
+        return object.__getattribute__(self, name)
+
+    def _parse(self):
+        data = self.to_dict()
+        for (name, (path, convert)) in self._FIELDS.items():
+            value = get_field(data, path)
+            if convert is not None and value is not None:
+                value = convert(value)
+            object.__setattr__(self, name, value)
+
+    def to_dict(self):
+        """The complete response as a dictionary (decoded anew from raw JSON)"""
+        if isinstance(self._raw, dict):
+            return self._raw
+        return loads(self._raw) if self._raw else {}
+
+    def __repr__(self):
+        return "<{0}: {1}>".format(self.__class__.__name__, getattr(self, "id", ""))
+
+
+class Telemetry(Model):
+    """Current telemetry of a device (telemetry.current)."""
+
+    __slots__ = ("gpm", "psi", "tempF", "updated")
+    _FIELDS = {
+        "gpm": ("gpm", None),
+        "psi": ("psi", None),
+        "tempF": ("tempF", None),
+        "updated": ("updated", _flo_time),  # epoch seconds
+    }
+
+    def __repr__(self):
+        return "<{0}: {1} gpm {2} psi {3} F>".format(
+            self.__class__.__name__, self.gpm, self.psi, self.tempF
+        )
+
+
+class Valve(Model):
+    """State of a device's shutoff valve."""
+
+    __slots__ = ("target", "last_known")
+    _FIELDS = {"target": ("target", None), "last_known": ("lastKnown", None)}
+
+    @property
+    def is_open(self):
+        return self.last_known == "open"
+
+    def __repr__(self):
+        return "<{0}: {1}>".format(self.__class__.__name__, self.last_known)
+
+
+class Device(Model):
+    """A Flo device (GET /devices/{id})."""
+
+    __slots__ = (
+        "id",
+        "mac_address",
+        "nickname",
+        "device_type",
+        "device_model",
+        "is_connected",
+        "location_id",
+        "firmware_version",
+        "system_mode",
+        "system_mode_target",
+        "valve",
+        "telemetry",
+        "pending_alerts",
+    )
+    _FIELDS = {
+        "id": ("id", None),
+        "mac_address": ("macAddress", None),
+        "nickname": ("nickname", None),
+        "device_type": ("deviceType", None),
+        "device_model": ("deviceModel", None),
+        "is_connected": ("isConnected", None),
+        "location_id": ("location.id", None),
+        "firmware_version": ("fwVersion", None),
+        "system_mode": ("systemMode.lastKnown", None),
+        "system_mode_target": ("systemMode.target", None),
+        "valve": ("valve", Valve),
+        "telemetry": ("telemetry.current", Telemetry),
+        "pending_alerts": ("notifications.pending", None),
+    }
+
+
+class Location(Model):
+    """A location of the account (GET /locations/{id}?expand=devices)."""
+
+    __slots__ = (
+        "id",
+        "nickname",
+        "address",
+        "city",
+        "state",
+        "postal_code",
+        "timezone",
+        "system_mode",
+        "devices",
+    )
+    _FIELDS = {
+        "id": ("id", None),
+        "nickname": ("nickname", None),
+        "address": ("address", None),
+        "city": ("city", None),
+        "state": ("state", None),
+        "postal_code": ("postalCode", None),
+        "timezone": ("timezone", None),
+        "system_mode": ("systemMode.target", None),
+        "devices": ("devices", _model_list(Device)),
+    }
+
+
+class User(Model):
+    """The account's user (GET /users/{id}?expand=locations)."""
+
+    __slots__ = ("id", "email", "first_name", "last_name", "locations")
+    _FIELDS = {
+        "id": ("id", None),
+        "email": ("email", None),
+        "first_name": ("firstName", None),
+        "last_name": ("lastName", None),
+        "locations": ("locations", _model_list(Location)),
+    }
+
+
+class Alert(Model):
+    """An alert (an item of GET /alerts)."""
+
+    __slots__ = (
+        "id",
+        "location_id",
+        "device_id",
+        "status",
+        "severity",
+        "alarm_id",
+        "title",
+        "message",
+        "created",
+    )
+    _FIELDS = {
+        "id": ("id", None),
+        "location_id": ("locationId", None),
+        "device_id": ("deviceId", None),
+        "status": ("status", None),
+        "severity": ("alarm.severity", None),
+        "alarm_id": ("alarm.id", None),
+        "title": ("displayTitle", None),
+        "message": ("displayMessage", None),
+        "created": ("createAt", _flo_time),  # epoch seconds
+    }
+
+
+class FloModels:
+    """Fetches models through a PyFlo client, decoding each response straight from
+    its raw JSON. Bypasses the client's dict caches."""
+
+    def __init__(self, flo):
+        self._flo = flo
+
+    def _get(self, path, params=None):
+        return self._flo.query(
+            f"{self._flo._api_base}{path}",
+            method=METHOD_GET,
+            extra_params=params,
+            decode=False,
+        )
+
+    def user(self):
+        raw = self._get(f"/users/{self._flo.user_id}?expand=locations")
+        return User(raw) if raw is not None else None
+
+    def location(self, location_id):
+        raw = self._get(f"/locations/{location_id}?expand=devices")
+        return Location(raw) if raw is not None else None
+
+    def device(self, device_id):
+        raw = self._get(f"/devices/{device_id}")
+        return Device(raw) if raw is not None else None
+
+    def consumption(
+        self, device_id, startDate=None, endDate=None, interval=INTERVAL_HOURLY
+    ):
+        """ConsumptionSeries of a device; see PyFlo.consumption()"""
+        (location_id, mac_address) = self._flo._get_locid_mac(device_id)
+        params = _consumption_params(
+            location_id, mac_address, startDate, endDate, interval
+        )
+        raw = self._get("/water/consumption", params)
+        if raw is None:
+            return None
+        return ConsumptionSeries.from_response(device_id, loads(raw), interval)
+
+    def alerts(
+        self,
+        location_ids,
+        severities=ALERT_SEVERITIES,
+        status="triggered",
+        page=1,
+        size=ALERT_PAGE_SIZE,
+    ):
+        """One page of alerts at location_ids as a list of Alert (see
+        PyFlo.iter_alerts() to page through all of them)"""
+        if isinstance(location_ids, str):
+            location_ids = [location_ids]
+        if isinstance(severities, str):
+            severities = [severities]
+        raw = self._get(
+            "/alerts", alert_params(location_ids, severities, status, page, size)
+        )
+        if raw is None:
+            return None
+        return [Alert(item) for item in loads(raw).get("items", [])]
@@ -0,0 +1,144 @@
+"""A pool of PyFlo clients for many Flo accounts sharing one HTTP transport."""
+
+import threading
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+
+from pyflowater import PyFlo
+from pyflowater.auth import FileTokenStore
+from pyflowater.const import (
+    FLO_ACCOUNT_CONCURRENCY,
+    FLO_LOGIN_RATE,
+    FLO_POOL_CONCURRENCY,
+)
+from pyflowater.ratelimit import RateLimiter
+
+
+def pooled_session(max_connections=FLO_POOL_CONCURRENCY):
+    """Return a requests.Session suitable for sharing between accounts: keep-alive
+    connections pooled up to max_connections per host, and no cookie jar, so that no
+    state other than the per-request auth header can cross accounts.
+
+    requests only speaks HTTP/1.1, so rather than multiplexing requests over one
+    HTTP/2 connection, each request in flight holds its own pooled keep-alive
+    connection; the saving is in reused connections and TLS handshakes."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=4, pool_maxsize=max_connections
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+class AccountPool:
+    """PyFlo clients for many accounts, keyed by username.
+
+    All clients send requests over one pooled keep-alive session, so connections
+    (and TLS handshakes) are reused across accounts, while tokens and caches stay
+    separate per client. At most max_concurrency requests are in flight across the
+    pool and account_concurrency per account, and password logins are spaced at
+    login_rate per second so that a restart doesn't burst the auth endpoint."""
+
+    def __init__(
+        self,
+        max_concurrency=FLO_POOL_CONCURRENCY,
+        account_concurrency=FLO_ACCOUNT_CONCURRENCY,
+        login_rate=FLO_LOGIN_RATE,
+        token_store=None,
+        session=None,
+        **client_kwargs,
+    ):
+        """
+        :param max_concurrency: requests in flight at once across all accounts
+        :param account_concurrency: requests in flight at once for each account
+        :param login_rate: password logins per second across all accounts
+        :param token_store: TokenStore shared by all accounts (default FileTokenStore)
+        :param session: requests.Session to share (default pooled_session())
+        :param client_kwargs: further PyFlo arguments applied to every account
+        """
+        self._session = session or pooled_session(max_concurrency)
+        self._owns_session = session is None
+        self._token_store = token_store if token_store is not None else FileTokenStore()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._account_concurrency = account_concurrency
+        self._login_limiter = RateLimiter(login_rate, burst=1)
+        self._client_kwargs = client_kwargs
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def add(self, username, password=None, **kwargs):
+        """Return the client of username, creating it if needed. A new client reuses
+        a stored token if it is still valid, and otherwise logs in (waiting its turn
+        behind other logins); a given password is saved for later re-logins. kwargs
+        override the pool's PyFlo arguments."""
+        with self._lock:
+            client = self._clients.get(username)
+        if client is not None:
+            return client
+
+        client = PyFlo(
+            username,
+            password,
+            **{
+                **self._client_kwargs,
+                **kwargs,
+                "token_store": self._token_store,
+                "session": self._session,
+                "concurrency_limits": (
+                    threading.BoundedSemaphore(self._account_concurrency),
+                    self._slots,
+                ),
+                "login_limiter": self._login_limiter,
+            },
+        )
+        if password is not None:
+            client.save_password(password)
+        with self._lock:
+            # another thread may have added the same account meanwhile
+            existing = self._clients.setdefault(username, client)
+        if existing is not client:
+            client.close()
+        return existing
+
+    def remove(self, username):
+        """Stop and forget the client of username"""
+        with self._lock:
+            client = self._clients.pop(username, None)
+        if client is not None:
+            client.close()
+
+    def __getitem__(self, username):
+        return self._clients[username]
+
+    def __contains__(self, username):
+        return username in self._clients
+
+    def __iter__(self):
+        return iter(list(self._clients.values()))
+
+    def __len__(self):
+        return len(self._clients)
+
+    @property
+    def usernames(self):
+        return list(self._clients)
+
+    def close(self):
+        """Stop every client (their background token refreshes) and close the shared
+        session if the pool created it"""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            client.close()
+        if self._owns_session:
+            self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
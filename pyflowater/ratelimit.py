@@ -0,0 +1,48 @@
+"""Client-side rate limiting of requests to the Flo cloud."""
+
+import threading
+import time
+
+
+class RateLimiter:
+    """Thread-safe token bucket allowing rate requests per second, with bursts of up to
+    burst requests."""
+
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: sustained requests per second
+        :param burst: maximum requests issued back to back (default max(1, rate))
+        """
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        """Take a token if one is available without waiting; returns True on success"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def delay(self):
+        """Reserve a token and return the seconds to wait before using it"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        """Block until a request may be issued"""
+        wait = self.delay()
+        if wait > 0:
+            time.sleep(wait)
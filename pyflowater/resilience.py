@@ -0,0 +1,163 @@
+"""Retry policy, retry budget and circuit breaker for requests to the Flo cloud."""
+
+import logging
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+LOG = logging.getLogger(__name__)
+
+# path segments that are ids (UUIDs, MAC addresses, numbers) rather than resources
+_ID_SEGMENT = re.compile(r"^(?=.*\d)[0-9a-fA-F:-]{6,}$")
+
+
+@lru_cache(maxsize=4096)  # called for every request, with few distinct URLs
+def endpoint_template(url):
+    """Normalize a request URL into an endpoint template, e.g.
+    https://api-gw.meetflo.com/api/v2/devices/0123...?x=1 -> /api/v2/devices/{id}"""
+    path = urlsplit(url).path
+    return "/".join(
+        "{id}" if _ID_SEGMENT.match(segment) else segment for segment in path.split("/")
+    )
+
+
+def parse_retry_after(value):
+    """Return the seconds to wait given a Retry-After header value, or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """Decides which responses are retried and how long to wait in between:
+    exponential backoff with full jitter, honoring Retry-After when sent."""
+
+    def __init__(
+        self,
+        base_delay=0.5,
+        max_delay=30.0,
+        retry_statuses=(429, 500, 502, 503, 504),
+    ):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = frozenset(retry_statuses)
+
+    def is_retryable(self, status_code):
+        return status_code in self.retry_statuses
+
+    def delay(self, attempt, retry_after=None):
+        """Seconds to wait before retry number attempt (starting at 1)"""
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        )
+
+
+class RetryBudget:
+    """Caps retries to a fraction of requests made, so that retries can't multiply
+    load on an API that is already struggling.
+
+    Each request deposits ratio tokens and each retry spends one; min_per_second
+    tokens trickle in regardless so that a quiet client can still retry."""
+
+    def __init__(self, ratio=0.2, min_per_second=0.5, max_tokens=10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _deposit(self, amount):
+        now = time.monotonic()
+        self._tokens = min(
+            self.max_tokens,
+            self._tokens + amount + (now - self._updated) * self.min_per_second,
+        )
+        self._updated = now
+
+    def record_request(self):
+        with self._lock:
+            self._deposit(self.ratio)
+
+    def try_spend(self):
+        """Take a retry token; returns False if the budget is exhausted"""
+        with self._lock:
+            self._deposit(0)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class CircuitBreaker:
+    """Fails fast after failure_threshold consecutive failures of an endpoint.
+
+    After reset_timeout seconds open, a single trial request is let through
+    (half-open); its success closes the circuit and its failure reopens it. Should no
+    outcome be recorded for the trial, another is let through reset_timeout seconds
+    later."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def retry_in(self):
+        """Seconds until an open circuit lets a trial request through"""
+        return max(0.0, self._opened + self.reset_timeout - time.monotonic())
+
+    def allow(self):
+        """Return True if a request may be sent now"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self.retry_in == 0:
+                # open long enough, or a half-open trial never reported back
+                self._state = self.HALF_OPEN
+                self._opened = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if (
+                self._state == self.HALF_OPEN
+                or self._failures >= self.failure_threshold
+            ):
+                if self._state != self.OPEN:
+                    LOG.warning(
+                        "Circuit opened after %s consecutive failures", self._failures
+                    )
+                self._state = self.OPEN
+                self._opened = time.monotonic()
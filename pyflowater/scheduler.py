@@ -0,0 +1,342 @@
+"""Scheduled polling of many Flo devices, spread out in time and adapted to activity.
+
+Rather than polling every device at the same instant, PollScheduler gives each
+device a random offset within the poll interval and jitters every later poll. Each
+device is polled every active_interval seconds while water is flowing or an alert is
+pending, and backs off towards idle_interval while it stays idle. Polls of one
+account share a single RateLimiter, so however many devices are scheduled the
+account never exceeds its request rate.
+"""
+
+import logging
+import asyncio
+import heapq
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pyflowater.auth import token_key
+from pyflowater.const import (
+    FLO_POLL_ACTIVE_INTERVAL,
+    FLO_POLL_IDLE_INTERVAL,
+    FLO_POLL_INTERVAL,
+    FLO_POLL_JITTER,
+    FLO_POLL_RATE,
+    FLO_POLL_WORKERS,
+)
+from pyflowater.dispatch import get_field
+from pyflowater.ratelimit import RateLimiter
+
+LOG = logging.getLogger(__name__)
+
+POLL_DEVICE = "device"
+POLL_CONSUMPTION = "consumption"
+
+POLLERS = {
+    POLL_DEVICE: lambda flo, device_id: flo.device(device_id, use_cached=False),
+    POLL_CONSUMPTION: lambda flo, device_id: flo.consumption(device_id),
+}
+
+
+def is_active(device):
+    """True if a device() response shows water flowing or a pending alert"""
+    gpm = get_field(device, "telemetry.current.gpm")
+    if gpm and gpm > 0:
+        return True
+    pending = get_field(device, "notifications.pending") or {}
+    return bool(pending.get("criticalCount") or pending.get("warningCount"))
+
+
+class PollResult:
+    """One completed poll, delivered to the scheduler's callback and results()."""
+
+    __slots__ = ("device_id", "kind", "data", "error", "polled", "active", "interval")
+
+    def __init__(self, device_id, kind, data, error, polled, active, interval):
+        self.device_id = device_id
+        self.kind = kind  # POLL_DEVICE or POLL_CONSUMPTION
+        self.data = data  # response, or None if the poll failed
+        self.error = error  # exception raised by the poll, if any
+        self.polled = polled  # time.time() the poll completed
+        self.active = active  # whether the device was considered active
+        self.interval = interval  # seconds (before jitter) until the next poll
+
+    @property
+    def ok(self):
+        return self.data is not None
+
+    def __repr__(self):
+        return "<{0}: {1} {2} {3}>".format(
+            self.__class__.__name__,
+            self.device_id,
+            self.kind,
+            "ok" if self.ok else f"failed: {self.error}",
+        )
+
+
+class _Job:
+    __slots__ = (
+        "flo",
+        "device_id",
+        "kind",
+        "interval",
+        "active_interval",
+        "idle_interval",
+        "current",
+        "seq",
+        "polling",
+        "removed",
+    )
+
+    def __init__(self, flo, device_id, kind, interval, active_interval, idle_interval):
+        self.flo = flo
+        self.device_id = device_id
+        self.kind = kind
+        self.interval = interval
+        self.active_interval = active_interval
+        self.idle_interval = idle_interval
+        self.current = interval  # interval before jitter, adapted after each poll
+        self.seq = None  # sequence number of the heap entry of the next poll
+        self.polling = False
+        self.removed = False
+
+
+class PollScheduler:
+    """Polls device() or consumption() of many devices, across one or more PyFlo
+    accounts, on a background thread and a small worker pool.
+
+    Results are passed to callback(PollResult) on a worker thread and to any
+    `async for result in scheduler.results()` iterators."""
+
+    def __init__(
+        self,
+        callback=None,
+        interval=FLO_POLL_INTERVAL,
+        active_interval=FLO_POLL_ACTIVE_INTERVAL,
+        idle_interval=FLO_POLL_IDLE_INTERVAL,
+        jitter=FLO_POLL_JITTER,
+        backoff=2.0,
+        rate=FLO_POLL_RATE,
+        workers=FLO_POLL_WORKERS,
+    ):
+        """
+        :param callback: function called with each PollResult
+        :param interval: seconds between polls of a device with unknown activity
+        :param active_interval: seconds between polls while a device is active
+        :param idle_interval: longest interval an idle device backs off to
+        :param jitter: fraction (0-1) by which each interval is randomized
+        :param backoff: factor the interval grows by with each idle poll
+        :param rate: polls per second allowed per account (a RateLimiter may be
+            shared with other schedulers through limiter_for())
+        :param workers: maximum polls in flight at once
+        """
+        self._callback = callback
+        self.interval = interval
+        self.active_interval = active_interval
+        self.idle_interval = idle_interval
+        self.jitter = jitter
+        self.backoff = backoff
+        self.rate = rate
+        self._workers = workers
+        self._jobs = {}  # (device_id, kind) -> _Job
+        self._heap = []  # (monotonic due time, sequence, _Job)
+        self._sequence = itertools.count()
+        self._active = {}  # device_id -> bool, from the latest device poll
+        self._limiters = {}  # token_key() of the account -> RateLimiter
+        self._sinks = []  # (event loop, asyncio.Queue) of results() iterators
+        self._cond = threading.Condition()
+        self._thread = None
+        self._executor = None
+        self._stopped = False
+        self.dropped = 0  # results discarded because a results() queue was full
+
+    def limiter_for(self, flo, limiter=None):
+        """Return the RateLimiter shared by polls of flo's account, first setting it to
+        limiter if given (e.g. one shared with other code using the same account).
+        Clients logged in to the same account share one limiter."""
+        account = token_key(flo._auth_url, flo._username)
+        with self._cond:
+            if limiter is not None:
+                self._limiters[account] = limiter
+            elif account not in self._limiters:
+                self._limiters[account] = RateLimiter(self.rate)
+            return self._limiters[account]
+
+    def add(
+        self,
+        flo,
+        device_id,
+        kind=POLL_DEVICE,
+        interval=None,
+        active_interval=None,
+        idle_interval=None,
+    ):
+        """Schedule polls of device_id through flo (a PyFlo). The first poll happens
+        at a random time within the interval. Intervals default to the scheduler's."""
+        if kind not in POLLERS:
+            raise ValueError(f"unknown poll kind {kind}")
+        job = _Job(
+            flo,
+            device_id,
+            kind,
+            interval or self.interval,
+            active_interval or self.active_interval,
+            idle_interval or self.idle_interval,
+        )
+        self.limiter_for(flo)
+        with self._cond:
+            previous = self._jobs.get((device_id, kind))
+            if previous:
+                previous.removed = True
+            self._jobs[(device_id, kind)] = job
+            self._push(job, random.uniform(0, job.interval))
+
+    def remove(self, device_id, kind=None):
+        """Stop polling device_id (only polls of kind, if given)"""
+        with self._cond:
+            for key in list(self._jobs):
+                if key[0] == device_id and kind in (None, key[1]):
+                    self._jobs.pop(key).removed = True
+
+    @property
+    def device_ids(self):
+        with self._cond:
+            return list({device_id for (device_id, _) in self._jobs})
+
+    def is_active(self, device_id):
+        return self._active.get(device_id, False)
+
+    def set_active(self, device_id, active=True):
+        """Override the activity of device_id (e.g. from a real-time listener or an
+        alert); its polls switch to the active interval from their next poll"""
+        with self._cond:
+            self._active[device_id] = active
+            if not active:
+                return
+            # bring forward polls that were backed off while idle
+            now = time.monotonic()
+            for job in self._jobs.values():
+                if job.device_id == device_id and job.current > job.active_interval:
+                    job.current = job.active_interval
+                    if not job.polling:
+                        self._push(job, random.uniform(0, job.active_interval), now)
+
+    def start(self):
+        """Start polling in the background"""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._executor = ThreadPoolExecutor(self._workers, "pyflowater-poll")
+            self._thread = threading.Thread(
+                target=self._run, name="PollScheduler", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop scheduling polls; polls already running are allowed to finish"""
+        with self._cond:
+            self._stopped = True
+            thread, self._thread = self._thread, None
+            executor, self._executor = self._executor, None
+            self._cond.notify_all()
+        if thread:
+            thread.join(timeout)
+        if executor:
+            # polls not yet begun return at once (see _poll)
+            executor.shutdown(wait=False)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    async def results(self, maxsize=0):
+        """Asynchronously iterate over poll results completed from now on. If maxsize
+        results are waiting, further ones are dropped (and counted in dropped)."""
+        loop = asyncio.get_running_loop()
+        sink = (loop, asyncio.Queue(maxsize))
+        with self._cond:
+            self._sinks.append(sink)
+        try:
+            while True:
+                yield await sink[1].get()
+        finally:
+            with self._cond:
+                self._sinks.remove(sink)
+
+    def _push(self, job, delay, now=None):
+        """Schedule job's next poll delay seconds from now, replacing any earlier
+        schedule (call with the lock held)"""
+        job.seq = next(self._sequence)
+        due = (now or time.monotonic()) + delay
+        heapq.heappush(self._heap, (due, job.seq, job))
+        self._cond.notify()
+
+    def _run(self):
+        with self._cond:
+            while not self._stopped:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due = self._heap[0][0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                (_, seq, job) = heapq.heappop(self._heap)
+                if job.removed or seq != job.seq:
+                    continue  # stale entry of a removed or rescheduled job
+                job.seq = None
+                job.polling = True
+                self._executor.submit(self._poll, job)
+
+    def _poll(self, job):
+        with self._cond:
+            if self._stopped:
+                job.polling = False
+                return
+        self.limiter_for(job.flo).acquire()
+        data = error = None
+        try:
+            data = POLLERS[job.kind](job.flo, job.device_id)
+        except Exception as e:
+            error = e
+            LOG.debug("Failed polling %s %s: %s", job.kind, job.device_id, e)
+
+        with self._cond:
+            job.polling = False
+            if job.kind == POLL_DEVICE and data:
+                self._active[job.device_id] = is_active(data)
+            active = self._active.get(job.device_id, False)
+            if active:
+                job.current = job.active_interval
+            elif job.current < job.interval:
+                job.current = job.interval  # just went idle
+            elif data is not None:
+                job.current = min(job.idle_interval, job.current * self.backoff)
+            if not job.removed and not self._stopped:
+                spread = random.uniform(1 - self.jitter, 1 + self.jitter)
+                self._push(job, job.current * spread)
+            sinks = list(self._sinks)
+
+        result = PollResult(
+            job.device_id, job.kind, data, error, time.time(), active, job.current
+        )
+        if self._callback:
+            try:
+                self._callback(result)
+            except Exception:
+                LOG.exception("Error in poll scheduler callback")
+        for (loop, queue) in sinks:
+            loop.call_soon_threadsafe(self._offer, queue, result)
+
+    def _offer(self, queue, result):
+        try:
+            queue.put_nowait(result)
+        except asyncio.QueueFull:
+            self.dropped += 1
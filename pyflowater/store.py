@@ -0,0 +1,337 @@
+"""Incremental, persistent store of Flo water consumption time series.
+
+Each (device, interval) series is kept as two array-backed columns (UTC epoch seconds
+and gallons) along with the time spans already fetched from Flo. Buckets that have
+closed never change, so only the missing spans, plus the still-open bucket(s) at the
+end of the series, are requested from /water/consumption.
+
+On disk each series is a single file: a small header, the covered spans, then the two
+columns in native byte order. Files are memory-mapped on load so reading history does
+not copy it into Python objects.
+"""
+
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone
+
+from pyflowater import FloError
+from pyflowater.const import INTERVAL_HOURLY
+from pyflowater.resample import _bucket
+from pyflowater.timeutil import day_window, parse_flo_time
+
+LOG = logging.getLogger(__name__)
+
+_MAGIC = b"FLOC"
+_VERSION = 1
+_HEADER = struct.Struct("=4sIqq")  # magic, version, item count, span count
+
+
+def _epoch(date):
+    """Seconds since the epoch for a datetime (naive means local time) or number"""
+    if isinstance(date, datetime):
+        return date.timestamp()
+    return float(date)
+
+
+def _closed_before(interval, now):
+    """Return the epoch time before which every bucket of interval is closed: the
+    start of the LOCAL bucket (as in pyflowater.resample) containing now"""
+    return _bucket(now, interval, None)[0]
+
+
+def _align(start, end, interval):
+    """Widen [start, end) epoch seconds to whole LOCAL buckets of interval"""
+    return (_bucket(start, interval, None)[0], _bucket(end - 1, interval, None)[1])
+
+
+def _subtract_spans(start, end, spans):
+    """Return the parts of [start, end) not covered by the sorted, disjoint spans"""
+    missing = []
+    for (span_start, span_end) in spans:
+        if span_end <= start:
+            continue
+        if span_start >= end:
+            break
+        if span_start > start:
+            missing.append((start, span_start))
+        start = max(start, span_end)
+        if start >= end:
+            break
+    if start < end:
+        missing.append((start, end))
+    return missing
+
+
+def _add_span(spans, start, end):
+    """Return the sorted, disjoint spans with [start, end) merged in"""
+    merged = []
+    for (span_start, span_end) in sorted(spans + [(start, end)]):
+        if merged and span_start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], span_end))
+        else:
+            merged.append((span_start, span_end))
+    return merged
+
+
+def _parse_items(response):
+    """Return the sorted [(epoch seconds, gallons), ...] of a consumption response"""
+    return sorted(
+        (int(parse_flo_time(item["time"])), float(item.get("gallonsConsumed") or 0))
+        for item in (response or {}).get("items", [])
+    )
+
+
+class ConsumptionSeries:
+    """Column view over a consumption time series.
+
+    timestamps (UTC epoch seconds) and gallons are array('q')/array('d') or memoryviews
+    over them; window() slices without copying."""
+
+    __slots__ = ("device_id", "interval", "timestamps", "gallons")
+
+    def __init__(self, device_id, interval, timestamps, gallons):
+        self.device_id = device_id
+        self.interval = interval
+        self.timestamps = timestamps
+        self.gallons = gallons
+
+    @classmethod
+    def from_response(cls, device_id, response, interval=INTERVAL_HOURLY):
+        """Build a series from a PyFlo.consumption() response"""
+        items = _parse_items(response)
+        return cls(
+            device_id,
+            interval,
+            array("q", (t for (t, _) in items)),
+            array("d", (g for (_, g) in items)),
+        )
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __iter__(self):
+        """Iterate over (epoch seconds, gallons) tuples"""
+        return zip(self.timestamps, self.gallons)
+
+    def __repr__(self):
+        return "<{0}: {1} {2} ({3} items)>".format(
+            self.__class__.__name__, self.device_id, self.interval, len(self)
+        )
+
+    def window(self, start, end):
+        """Return the items with start <= timestamp < end, sharing the same memory"""
+        i = bisect_left(self.timestamps, int(_epoch(start)))
+        j = bisect_left(self.timestamps, int(_epoch(end)))
+        return ConsumptionSeries(
+            self.device_id,
+            self.interval,
+            memoryview(self.timestamps)[i:j],
+            memoryview(self.gallons)[i:j],
+        )
+
+    def total(self):
+        """Total gallons consumed over the series"""
+        return sum(self.gallons)
+
+
+class _Entry:
+    """Mutable state of one stored series."""
+
+    __slots__ = ("timestamps", "gallons", "spans", "mapping")
+
+    def __init__(self, timestamps=None, gallons=None, spans=None, mapping=None):
+        self.timestamps = timestamps if timestamps is not None else array("q")
+        self.gallons = gallons if gallons is not None else array("d")
+        self.spans = spans or []  # sorted, disjoint [(start, end), ...] epoch seconds
+        self.mapping = mapping  # mmap backing the columns when loaded from disk
+
+
+class ConsumptionStore:
+    """Local store of consumption series keyed by (device_id, interval).
+
+    If path is None, series are only kept in memory."""
+
+    def __init__(self, path=None):
+        self._path = path
+        self._entries = {}  # (device_id, interval) -> _Entry
+        self._retired = []  # mmaps of replaced entries still used by exported views
+        self._lock = threading.RLock()
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    def _filename(self, device_id, interval):
+        safe = re.sub(r"[^\w.-]", "_", f"{device_id}-{interval}")
+        return os.path.join(self._path, f"{safe}.floc")
+
+    def _entry(self, device_id, interval):
+        key = (device_id, interval)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._load(device_id, interval) or _Entry()
+            self._entries[key] = entry
+        return entry
+
+    def _load(self, device_id, interval):
+        if not self._path:
+            return None
+        filename = self._filename(device_id, interval)
+        if not os.path.exists(filename) or os.path.getsize(filename) < _HEADER.size:
+            return None
+
+        with open(filename, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, count, nspans) = _HEADER.unpack_from(mapping)
+        if magic != _MAGIC or version != _VERSION:
+            LOG.warning(f"Ignoring unrecognized consumption store file {filename}")
+            mapping.close()
+            return None
+
+        view = memoryview(mapping)
+        offset = _HEADER.size
+        span_values = view[offset : offset + 16 * nspans].cast("q")
+        spans = [
+            (span_values[i], span_values[i + 1]) for i in range(0, len(span_values), 2)
+        ]
+        offset += 16 * nspans
+        timestamps = view[offset : offset + 8 * count].cast("q")
+        offset += 8 * count
+        gallons = view[offset : offset + 8 * count].cast("d")
+        return _Entry(timestamps, gallons, spans, mapping)
+
+    def _save(self, device_id, interval, entry):
+        if not self._path:
+            return
+        filename = self._filename(device_id, interval)
+        spans = array("q", [value for span in entry.spans for value in span])
+        tmp = f"{filename}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(
+                _HEADER.pack(_MAGIC, _VERSION, len(entry.timestamps), len(entry.spans))
+            )
+            f.write(spans)
+            f.write(entry.timestamps)
+            f.write(entry.gallons)
+        os.replace(tmp, filename)
+
+    def series(self, device_id, interval=INTERVAL_HOURLY):
+        """Return the whole stored series for device_id"""
+        with self._lock:
+            entry = self._entry(device_id, interval)
+            return ConsumptionSeries(
+                device_id, interval, entry.timestamps, entry.gallons
+            )
+
+    def missing_ranges(self, device_id, startDate, endDate, interval=INTERVAL_HOURLY):
+        """Return the [(start, end), ...] epoch spans within [startDate, endDate) that must
+        be fetched from Flo: those never fetched or not yet closed at fetch time."""
+        start = int(_epoch(startDate))
+        end = int(_epoch(endDate))
+        with self._lock:
+            entry = self._entry(device_id, interval)
+            return _subtract_spans(start, end, entry.spans)
+
+    def merge(
+        self, device_id, start, end, response, interval=INTERVAL_HOURLY, now=None
+    ):
+        """Merge a /water/consumption response that covered [start, end) epoch seconds,
+        replacing any stored items in that span."""
+        if not response or "items" not in response:
+            return
+        if now is None:
+            now = time.time()
+
+        items = _parse_items(response)
+        new_timestamps = array("q", (t for (t, _) in items if start <= t < end))
+        new_gallons = array("d", (g for (t, g) in items if start <= t < end))
+
+        with self._lock:
+            entry = self._entry(device_id, interval)
+            i = bisect_left(entry.timestamps, start)
+            j = bisect_left(entry.timestamps, end)
+
+            # build new columns (rather than resizing in place) so that existing views
+            # handed out by series()/window() stay valid
+            timestamps = array("q", entry.timestamps[:i])
+            timestamps.extend(new_timestamps)
+            timestamps.extend(entry.timestamps[j:])
+            gallons = array("d", entry.gallons[:i])
+            gallons.extend(new_gallons)
+            gallons.extend(entry.gallons[j:])
+
+            spans = entry.spans
+            closed_end = min(end, int(_closed_before(interval, now)))
+            if start < closed_end:
+                spans = _add_span(spans, start, closed_end)
+
+            if entry.mapping is not None:
+                self._retired.append(entry.mapping)
+            entry = _Entry(timestamps, gallons, spans)
+            self._entries[(device_id, interval)] = entry
+            self._save(device_id, interval, entry)
+            self._close_retired()
+
+    def _close_retired(self):
+        """Close the mmaps of replaced entries that no series()/window() view still
+        uses (call with the lock held). Those still in use are retried on the next
+        merge; a mapping is in any case unmapped once it is garbage collected."""
+        retired = []
+        for mapping in self._retired:
+            try:
+                mapping.close()
+            except BufferError:
+                retired.append(mapping)
+        self._retired = retired
+
+    def sync(
+        self, flo, device_id, startDate=None, endDate=None, interval=INTERVAL_HOURLY
+    ):
+        """Fetch only the missing or still-open parts of [startDate, endDate] for device_id
+        via flo.consumption() and return the stored series for that window.
+
+        Ranges are fetched in whole LOCAL buckets of interval, so a partial bucket is
+        never stored as closed. Raises FloError if any range failed to load (the
+        ranges that did load are kept).
+
+        Defaults to the current day in LOCAL time, like PyFlo.consumption()."""
+        (today_start, today_end) = day_window()
+        start = int(_epoch(startDate or today_start))
+        end = int(_epoch(endDate or today_end)) + 1  # Flo endDate is inclusive
+
+        failed = []
+        (aligned_start, aligned_end) = _align(start, end, interval)
+        for (fetch_start, fetch_end) in self.missing_ranges(
+            device_id, aligned_start, aligned_end, interval
+        ):
+            (fetch_start, fetch_end) = _align(fetch_start, fetch_end, interval)
+            LOG.debug(
+                "Fetching %s consumption for %s from %s to %s",
+                interval,
+                device_id,
+                fetch_start,
+                fetch_end,
+            )
+            response = flo.consumption(
+                device_id,
+                startDate=datetime.fromtimestamp(fetch_start, timezone.utc),
+                # the last millisecond before fetch_end, matching Flo's inclusive endDate
+                endDate=datetime.fromtimestamp(fetch_end - 0.001, timezone.utc),
+                interval=interval,
+            )
+            if response is None:
+                failed.append((fetch_start, fetch_end))
+                continue
+            self.merge(device_id, fetch_start, fetch_end, response, interval)
+
+        if failed:
+            raise FloError(
+                f"Failed fetching {interval} consumption of {device_id} for "
+                f"{len(failed)} range(s): {failed}"
+            )
+        return self.series(device_id, interval).window(start, end)
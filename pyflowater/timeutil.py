@@ -0,0 +1,41 @@
+"""Time conversions between local datetimes and the Flo API format."""
+
+from datetime import datetime, timezone
+
+from pyflowater.const import FLO_TIME_FORMAT
+
+
+def day_window(now=None):
+    """Return (start, end) of the current day in LOCAL time, as the Flo website does:
+    midnight through the last millisecond of the day."""
+    if now is None:
+        now = datetime.now()
+    start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    end = now.replace(hour=23, minute=59, second=59, microsecond=999999)
+    return (start, end)
+
+
+def to_utc(date):
+    """Convert a datetime to UTC. Naive (tzinfo is None) datetimes are assumed to
+    represent local time of the running system."""
+    # in a python 3.6-or-later world we could use date.astimezone(timezone.utc).
+    # note that fromtimestamp(timestamp()) only works for times supported by the system gmtime().
+    # see https://docs.python.org/3/library/datetime.html#datetime.datetime.fromtimestamp
+    return datetime.fromtimestamp(date.timestamp(), timezone.utc)
+
+
+def format_flo_time(date):
+    """Format a datetime as the UTC timestamp string Flo requires (2020-04-11T08:00:00.000Z)"""
+    # in python 3.6 and later, consider date.isoformat(timespec='milliseconds')
+    return to_utc(date).strftime(FLO_TIME_FORMAT) + "Z"
+
+
+def parse_flo_time(value):
+    """Parse a timestamp returned by Flo (e.g. 2020-04-11T08:00:00.000Z) into
+    seconds since the epoch"""
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    date = datetime.fromisoformat(value)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.timestamp()
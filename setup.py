@@ -22,7 +22,14 @@ setuptools.setup(
     author="Ryan Snodgrass",
     author_email="rsnodgrass@gmail.com",
     license="Apache Software License",
-    install_requires=["requests>=2.0", "google-cloud-firestore"],
+    install_requires=["requests>=2.0", "retry>=0.9.2"],
+    extras_require={
+        "async": ["aiohttp>=3.7"],
+        "firestore": ["google-cloud-firestore>=2"],
+        "brotli": ["brotli>=1.0"],
+        "parquet": ["pyarrow>=6"],
+    },
+    entry_points={"console_scripts": ["pyflowater=pyflowater.cli:main"]},
     keywords=["flo", "home automation", "water monitoring"],
     zip_safe=True,
     classifiers=[
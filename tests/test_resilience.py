@@ -0,0 +1,112 @@
+"""Tests of the circuit breaker, alone and as used by PyFlo.query()."""
+
+import json
+import time
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from pyflowater import METHOD_GET, PyFlo
+from pyflowater.auth import MemoryTokenStore
+from pyflowater.resilience import CircuitBreaker, RetryPolicy, endpoint_template
+
+API_BASE = "https://stub.invalid/api/v2"
+AUTH_URL = "https://stub.invalid/api/v1/users/auth"
+DEVICE_URL = f"{API_BASE}/devices/0123abcd-0000-0000-0000-000000000001"
+
+
+class FlakyTransport(BaseAdapter):
+    """Answers logins with a new token each time, and API requests with the status
+    of status(request) (200 and an empty object by default)."""
+
+    def __init__(self):
+        super().__init__()
+        self.logins = 0
+        self.status = lambda request: 200
+
+    def send(self, request, **kwargs):
+        if request.url == AUTH_URL:
+            self.logins += 1
+            (status, body) = (
+                200,
+                {
+                    "token": f"token-{self.logins}",
+                    "tokenPayload": {"user": {"user_id": "user"}},
+                    "tokenExpiration": 86400,
+                    "timeNow": int(time.time()),
+                },
+            )
+        else:
+            (status, body) = (self.status(request), {})
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict({"Content-Type": "application/json"})
+        response._content = json.dumps(body).encode()
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def _client(transport):
+    session = requests.Session()
+    session.mount("https://", transport)
+    return PyFlo(
+        "user@example.com",
+        "password",
+        token_store=MemoryTokenStore(),
+        refresh_in_background=False,
+        retry_policy=RetryPolicy(base_delay=0),
+        api_base=API_BASE,
+        auth_url=AUTH_URL,
+        session=session,
+    )
+
+
+def test_half_open_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_trial_without_outcome_does_not_wedge():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()  # trial whose outcome is never recorded
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+
+
+def test_401_during_half_open():
+    transport = FlakyTransport()
+    flo = _client(transport)
+    flo.save_password("password")
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    flo._breakers[endpoint_template(DEVICE_URL)] = breaker
+
+    # open the circuit
+    transport.status = lambda request: 503
+    assert flo.query(DEVICE_URL, method=METHOD_GET, retry=0) is None
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # once it is half-open, the trial is rejected as the token was revoked
+    time.sleep(0.06)
+    revoked = flo._auth_token
+    transport.status = lambda request: (
+        401 if request.headers["authorization"] == revoked else 200
+    )
+    assert flo.query(DEVICE_URL, method=METHOD_GET) == {}
+    assert flo._auth_token != revoked
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert flo.query(DEVICE_URL, method=METHOD_GET) == {}